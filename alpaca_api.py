@@ -1,14 +1,22 @@
+import os
 from sqlmodel import Session, select, func
 import alpaca_trade_api as tradeapi
 
 from createdb import Stock, engine, Stock_Price
+from fetch_pipeline import TokenBucket, iter_fetched
 import config
 import pandas as pd
 
 
 # Setup api and chunk_size
+# alpaca_trade_api reads the market data url from the environment
+if config.DATA_URL: os.environ['APCA_API_DATA_URL'] = config.DATA_URL
 api = tradeapi.REST(config.API_KEY, config.SECRET_KEY, base_url=config.API_URL)
 CHUNK_SIZE = 200
+# concurrent fetch settings, alpaca allows 200 requests/min
+FETCH_WORKERS = 4
+REQUESTS_PER_SEC = 3
+QUEUE_SIZE = 8
 
 
 def get_stocks():
@@ -62,7 +70,7 @@ def get_date_after():
     return result
         
 
-def get_update_prices():
+def get_update_prices(workers=FETCH_WORKERS, rate=REQUESTS_PER_SEC):
     symbols, stock_dict = read_stocklist()
     # symbols = ['AMC','GME']
     after = get_date_after()
@@ -70,11 +78,14 @@ def get_update_prices():
     # if after != 'NaT': print("**** GOT SOMETHING")
     # else: print("***** NOTHNIG*****")
 
+    if after == 'NaT': after =None
+    chunks = [symbols[i:i+CHUNK_SIZE] for i in range(0, len(symbols), CHUNK_SIZE)]
+    bucket = TokenBucket(rate) if rate else None
+    fetched = iter_fetched(chunks, 
+                           lambda chunk: api.get_barset(chunk, 'day', limit=1000, after=after),
+                           workers=workers, queue_size=QUEUE_SIZE, bucket=bucket)
     with Session(engine) as session:
-        if after == 'NaT': after =None
-        for i in range(0, len(symbols), CHUNK_SIZE):
-            symbol_chunk = symbols[i:i+CHUNK_SIZE]
-            barsets = api.get_barset(symbol_chunk, 'day', limit=1000, after=after)
+        for symbol_chunk, barsets in fetched:
             for symbol in barsets:
                 print(f"Processing symbol {symbol} after--{after}")
                 for bar in barsets[symbol]:
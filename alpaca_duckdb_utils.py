@@ -1,13 +1,31 @@
+import os
+import time
+from datetime import date, timedelta
+import numpy as np
 import pandas as pd
 from patterns import patterns
 import config
 import alpaca_trade_api as tradeapi
 import duckdb as ddb
+from fetch_pipeline import TokenBucket, iter_fetched
+from pattern_scan import update_pattern_signals
+from price_cube import export_cube
+from query_cache import create_ingest_generation, bump_generation
+from online_indicators import update_indicator_state
+from perf import span, start_run, end_run
 
 
 # Setup api and chunk_size
+# alpaca_trade_api reads the market data url from the environment
+if config.DATA_URL: os.environ['APCA_API_DATA_URL'] = config.DATA_URL
 api = tradeapi.REST(config.API_KEY, config.SECRET_KEY, base_url=config.API_URL)
 CHUNK_SIZE = 200
+# concurrent fetch settings, alpaca allows 200 requests/min
+FETCH_WORKERS = 4
+REQUESTS_PER_SEC = 3
+QUEUE_SIZE = 8
+# backfill windows stay under the 1000 bar limit (~965 trading days)
+BACKFILL_WINDOW_DAYS = 1400
 
 
 """OPEN DUCKDB CONNECTION"""
@@ -40,8 +58,44 @@ def create_tables(conn):
                     close DOUBLE,
                     volume UINTEGER)""")
     conn.execute("CREATE UNIQUE INDEX id_date_idx ON prices (stock_id, date)")
+    create_watermarks(conn)
+    create_ingest_generation(conn)
+
+
+def create_watermarks(conn):
+    """Create ingest_watermarks (first and last ingested date per stock_id) if missing, seeded once from prices.
+    first_date moves back when a backfill inserts older bars, so pattern signals know to score them"""
+    exists = conn.execute("""SELECT COUNT(*) FROM information_schema.tables 
+                             WHERE table_name = 'ingest_watermarks'""").fetchone()[0]
+    if exists:
+        # tables from before first_date was tracked
+        conn.execute("ALTER TABLE ingest_watermarks ADD COLUMN IF NOT EXISTS first_date DATE")
+        if conn.execute("SELECT COUNT(*) FROM ingest_watermarks WHERE first_date IS NULL").fetchone()[0]:
+            conn.execute("""UPDATE ingest_watermarks SET first_date = p.first_date 
+                            FROM (SELECT stock_id, MIN(date) AS first_date FROM prices GROUP BY stock_id) p
+                            WHERE ingest_watermarks.stock_id = p.stock_id AND ingest_watermarks.first_date IS NULL""")
+        return
+    conn.execute("""CREATE TABLE ingest_watermarks(
+                    stock_id UINTEGER PRIMARY KEY,
+                    last_date DATE,
+                    first_date DATE)""")
+    conn.execute("""INSERT INTO ingest_watermarks 
+                    SELECT stock_id, MAX(date), MIN(date) FROM prices GROUP BY stock_id""")
     
    
+def create_backfill_progress(conn):
+    """Create backfill_symbol_progress checkpoints, one row per completed (symbol, window).
+    Keyed per symbol, so listing or delisting a symbol doesn't move the others into chunks without checkpoints"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS backfill_symbol_progress(
+                    symbol VARCHAR,
+                    window_start DATE,
+                    fetched_start DATE,
+                    fetched_end DATE,
+                    rows UINTEGER,
+                    exhausted BOOLEAN,
+                    PRIMARY KEY (symbol, window_start))""")
+
+
 def get_stocks():
     """get list of alpaca active symbols"""
     assets = api.list_assets(status='active')
@@ -93,43 +147,290 @@ def get_date_after():
     result = pd.Timestamp(result[0], tz='US/Eastern')
     result = result.isoformat()
     return result
+
+
+def get_watermarks():
+    """get dict{stock_id:last ingested date}"""
+    rows = conn.execute("SELECT stock_id, last_date FROM ingest_watermarks").fetchall()
+    return dict(rows)
+
+
+def plan_chunks(symbols, stock_dict, watermarks):
+    """group symbols by watermark and split each group into CHUNK_SIZE chunks.
+    Returns list of (after, symbol_chunk), after is None for symbols never ingested"""
+    groups = {}
+    for symbol in symbols:
+        groups.setdefault(watermarks.get(stock_dict[symbol]), []).append(symbol)
+    plan = []
+    for last_date, group in groups.items():
+        after = None if last_date is None else pd.Timestamp(last_date, tz='US/Eastern').isoformat()
+        plan.extend((after, group[i:i+CHUNK_SIZE]) for i in range(0, len(group), CHUNK_SIZE))
+    return plan
         
 
-def get_update_prices():
+def barsets_to_columns(barsets, stock_dict):
+    """flatten one chunk of barsets into numpy column buffers"""
+    n = sum(len(bars) for bars in barsets.values())
+    cols = {
+        'stock_id'  : np.empty(n, dtype=np.uint32),
+        'date'      : np.empty(n, dtype='datetime64[D]'),
+        'open'      : np.empty(n, dtype=np.float64),
+        'high'      : np.empty(n, dtype=np.float64),
+        'low'       : np.empty(n, dtype=np.float64),
+        'close'     : np.empty(n, dtype=np.float64),
+        'volume'    : np.empty(n, dtype=np.int64) }
+    ts = np.empty(n, dtype=np.int64)
+    i = 0
+    for symbol, bars in barsets.items():
+        k = len(bars)
+        if not k: continue
+        j = i + k
+        cols['stock_id'][i:j] = stock_dict[symbol]
+        ts[i:j]             = np.fromiter((bar.t.value for bar in bars), np.int64, k)
+        cols['open'][i:j]   = np.fromiter((bar.o for bar in bars), np.float64, k)
+        cols['high'][i:j]   = np.fromiter((bar.h for bar in bars), np.float64, k)
+        cols['low'][i:j]    = np.fromiter((bar.l for bar in bars), np.float64, k)
+        cols['close'][i:j]  = np.fromiter((bar.c for bar in bars), np.float64, k)
+        cols['volume'][i:j] = np.fromiter((bar.v for bar in bars), np.int64, k)
+        i = j
+    # bar.t is a US/Eastern timestamp, convert the whole chunk to dates at once
+    cols['date'][:] = pd.to_datetime(ts, utc=True).tz_convert('US/Eastern').tz_localize(None).values.astype('datetime64[D]')
+    return cols
+
+
+def write_prices(conn, cols, on_conflict='skip', checkpoint=None):
+    """flush one batch of column buffers into prices, return number of new rows.
+    Rows already in id_date_idx are skipped (on_conflict='skip') or overwritten (on_conflict='update').
+    checkpoint=(window_start, fetched_start, fetched_end, {symbol: (rows, exhausted)}) is recorded in backfill_symbol_progress
+    in the same transaction"""
+    if on_conflict not in ('skip', 'update'):
+        raise ValueError(f"on_conflict must be 'skip' or 'update', not {on_conflict!r}")
+    if not len(cols['stock_id']) and checkpoint is None: return 0
+    # DataFrame over the buffers without copying, duckdb scans it in place
+    conn.register('price_batch', pd.DataFrame(cols, copy=False))
+    if checkpoint is not None:
+        window_start, fetched_start, fetched_end, symbol_rows = checkpoint
+        conn.register('checkpoint_batch', pd.DataFrame([(symbol, *v) for symbol, v in symbol_rows.items()], 
+                                                       columns=['symbol', 'rows', 'exhausted']))
+    conn.begin()
+    try:
+        if on_conflict == 'update':
+            conn.execute("""UPDATE prices SET 
+                            open = b.open,
+                            high = b.high,
+                            low = b.low,
+                            close = b.close,
+                            volume = b.volume
+                            FROM price_batch b 
+                            WHERE prices.stock_id = b.stock_id AND prices.date = b.date""")
+        inserted = conn.execute("""INSERT INTO prices SELECT 
+                        b.date,
+                        b.stock_id,
+                        b.open,
+                        b.high,
+                        b.low,
+                        b.close,
+                        b.volume 
+                        FROM price_batch b
+                        WHERE NOT EXISTS (SELECT 1 FROM prices p 
+                            WHERE p.stock_id = b.stock_id AND p.date = b.date)""").fetchone()[0]
+        # advance watermarks in the same transaction as the prices they cover
+        conn.execute("""UPDATE ingest_watermarks SET last_date = greatest(ingest_watermarks.last_date, b.last_date),
+                                                first_date = least(ingest_watermarks.first_date, b.first_date)
+                        FROM (SELECT stock_id, MAX(date)::DATE AS last_date, MIN(date)::DATE AS first_date 
+                              FROM price_batch GROUP BY stock_id) b
+                        WHERE ingest_watermarks.stock_id = b.stock_id 
+                        AND (b.last_date > ingest_watermarks.last_date OR b.first_date < ingest_watermarks.first_date)""")
+        conn.execute("""INSERT INTO ingest_watermarks 
+                        SELECT stock_id, MAX(date)::DATE, MIN(date)::DATE FROM price_batch 
+                        WHERE stock_id NOT IN (SELECT stock_id FROM ingest_watermarks)
+                        GROUP BY stock_id""")
+        if checkpoint is not None:
+            conn.execute("""UPDATE backfill_symbol_progress SET fetched_start = ?, fetched_end = ?, rows = c.rows, exhausted = c.exhausted 
+                            FROM checkpoint_batch c
+                            WHERE backfill_symbol_progress.symbol = c.symbol 
+                            AND backfill_symbol_progress.window_start = ?""", [fetched_start, fetched_end, window_start])
+            conn.execute("""INSERT INTO backfill_symbol_progress SELECT c.symbol, ?, ?, ?, c.rows, c.exhausted 
+                            FROM checkpoint_batch c
+                            WHERE NOT EXISTS (SELECT 1 FROM backfill_symbol_progress p 
+                                WHERE p.symbol = c.symbol AND p.window_start = ?)""", 
+                         [window_start, fetched_start, fetched_end, window_start])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.unregister('price_batch')
+        if checkpoint is not None: conn.unregister('checkpoint_batch')
+    return inserted
+
+
+def update_derived(conn):
+    """refresh what the dashboard reads besides prices: pattern signals, the exported cube (with config.CUBE_DIR)
+    and the indicator state (with config.INDICATOR_STATE). Runs before the generation bump, so no cache
+    holds results of the old ones under the new generation"""
+    with span('pattern signals') as s:
+        s.measure(update_pattern_signals(conn, patterns))
+    if config.CUBE_DIR:
+        with span('export cube'):
+            export_cube(conn, config.CUBE_DIR)
+    if config.INDICATOR_STATE:
+        with span('indicator state') as s:
+            s.measure(update_indicator_state(conn, config.INDICATOR_STATE))
+
+
+def fetch_barset(symbol_chunk, after=None):
+    """get daily bars for one chunk of symbols"""
+    return api.get_barset(symbol_chunk, 'day', limit=1000, after=after)
+
+
+def get_update_prices(on_conflict='skip', workers=FETCH_WORKERS, rate=REQUESTS_PER_SEC):
+    """fetch each symbol's missing range on a rate limited thread pool and flush chunks into prices as they arrive"""
+    # timing spans per chunk, the run's time outside them is spent waiting on the fetch workers
+    start_run('ingest prices')
+    create_watermarks(conn)
     symbols, stock_dict = read_stocklist()
 #     symbols = ['AMC','GME']
-    tmpls0=[]
-    after = get_date_after()
-    if after == 'NaT': after =None
-    print(after)
+    with span('plan chunks') as s:
+        chunks = s.measure(plan_chunks(symbols, stock_dict, get_watermarks()))
+    print(f"{len(chunks)} chunks, {len({after for after, _ in chunks})} distinct watermarks")
+    bucket = TokenBucket(rate) if rate else None
+    failed = []
+    total = 0
+    t0 = time.perf_counter()
+    fetched = iter_fetched(chunks, lambda job: fetch_barset(job[1], job[0]), workers=workers, 
+                           queue_size=QUEUE_SIZE, bucket=bucket, 
+                           on_error=lambda job, e: failed.append((job, e)))
+    for n, ((after, symbol_chunk), barsets) in enumerate(fetched, 1):
+        with span('bars to columns') as s:
+            cols = s.measure(barsets_to_columns(barsets, stock_dict))
+        del barsets
+        with span('write prices') as s:
+            inserted = write_prices(conn, cols, on_conflict)
+            s.measure(cols, rows=inserted)
+        total += inserted
+        elapsed = time.perf_counter() - t0
+        print(f"chunk {n}/{len(chunks)}: {total} rows, {total/elapsed:,.0f} rows/sec")
+    elapsed = time.perf_counter() - t0
+    print(f"inserted {total} rows in {elapsed:.1f}s ({total/max(elapsed, 1e-9):,.0f} rows/sec)")
+    for (after, symbol_chunk), e in failed:
+        print(f"failed chunk {symbol_chunk[0]}..{symbol_chunk[-1]} after {after}: {e}")
+    # new generation, dashboard caches drop their results on the next request
+    if total or on_conflict == 'update':
+        update_derived(conn)
+        bump_generation(conn)
+    end_run()
+    return total
+
+
+
+def backfill_windows(start, end, days=BACKFILL_WINDOW_DAYS):
+    """(window_start, fetch_start, fetch_end) newest first, paging back from end to start.
+    Windows are aligned to multiples of `days` since 1970-01-01 so their keys survive a change of start/end"""
+    epoch = date(1970, 1, 1)
+    windows = []
+    window_start = epoch + timedelta(days=(end - epoch).days // days * days)
+    while window_start + timedelta(days=days) > start:
+        window_end = window_start + timedelta(days=days-1)
+        windows.append((window_start, max(window_start, start), min(window_end, end)))
+        window_start -= timedelta(days=days)
+    return windows
+
+
+def get_backfill_progress(conn):
+    """get dict{(symbol, window_start): (fetched_start, fetched_end, rows, exhausted)}"""
+    rows = conn.execute("""SELECT symbol, window_start, fetched_start, fetched_end, rows, exhausted 
+                           FROM backfill_symbol_progress""").fetchall()
+    return {(r[0], r[1]): r[2:] for r in rows}
+
+
+def backfill_prices(start, end=None, workers=FETCH_WORKERS, rate=REQUESTS_PER_SEC):
+    """page backwards per chunk from end to start, checkpointing each (symbol, window).
+    Rerun with the same arguments to resume after a crash. A symbol stops paging at its first empty window
+    after one with bars, a chunk at its first window without bars for any of its symbols"""
+    start_run('backfill prices')
+    create_watermarks(conn)
+    create_backfill_progress(conn)
+    start = pd.Timestamp(start).date()
+    end = pd.Timestamp(end).date() if end is not None else date.today()
+    symbols, stock_dict = read_stocklist()
+    symbols = sorted(symbols)
+    windows = backfill_windows(start, end)
+    done = get_backfill_progress(conn)
+
+    def is_done(symbol, window):
+        fetched = done.get((symbol, window[0]))
+        return fetched is not None and fetched[0] <= window[1] and fetched[1] >= window[2]
+
+    def pending(symbol, k, seen):
+        """(index of the next window of symbol to fetch from k on or None, whether it has had bars)"""
+        for k in range(k, len(windows)):
+            if not is_done(symbol, windows[k]): return k, seen
+            fetched = done[(symbol, windows[k][0])]
+            if fetched[3]: return None, seen    # history exhausted on a previous run
+            seen = seen or fetched[2] > 0
+        return None, seen
+
+    def chunk_job(symbol_chunk, k, seen):
+        """job fetching the next window any symbol of the chunk still needs, for all of them, or None.
+        A symbol whose window is already done is fetched again with the others, the write skips its rows"""
+        nexts = {}
+        for symbol in symbol_chunk:
+            n, had_bars = pending(symbol, k, symbol in seen)
+            if n is not None: nexts[symbol] = n
+            if had_bars: seen = seen | {symbol}
+        if not nexts: return None
+        return (list(nexts), min(nexts.values()), seen)
+
+    jobs = []
     for i in range(0, len(symbols), CHUNK_SIZE):
-        symbol_chunk = symbols[i:i+CHUNK_SIZE]
-        barsets = api.get_barset(symbol_chunk, 'day', limit=1000, after=after)
-        for symbol in barsets:
-#             print(f"Processing symbol {symbol}")
-            for bar in barsets[symbol]:
-                tmp = {
-                    'stock_id'  :stock_dict[symbol],
-                    'date'      :bar.t,
-                    'open'      :bar.o,
-                    'high'      :bar.h,
-                    'low'       :bar.l,
-                    'close'     :bar.c,
-                    'volume'    :bar.v }
-                tmpls0.append(tmp)
-    df_price = pd.DataFrame(tmpls0)
-    conn.register('df_price', df_price)
-    conn.execute("""INSERT INTO prices SELECT 
-                    date,
-                    stock_id,
-                    open,
-                    high,
-                    low,
-                    close,
-                    volume 
-                    FROM df_price""")
-#     return df_price
+        job = chunk_job(symbols[i:i+CHUNK_SIZE], 0, frozenset())
+        if job is not None: jobs.append(job)
+    print(f"backfill {start}..{end}: {len(jobs)} chunks pending, {len(windows)} windows each")
+
+    def fetch_window(job):
+        symbol_chunk, k, seen = job
+        _, fetch_start, fetch_end = windows[k]
+        return api.get_barset(symbol_chunk, 'day', limit=1000, 
+                              start=pd.Timestamp(fetch_start, tz='US/Eastern').isoformat(), 
+                              end=pd.Timestamp(fetch_end, tz='US/Eastern').isoformat())
+
+    def next_window(job, barsets):
+        symbol_chunk, k, seen = job
+        has_bars = {symbol for symbol in symbol_chunk if len(barsets.get(symbol, ()))}
+        if not has_bars: return None
+        # symbols that had bars in a newer window but none in this one have reached their first bar
+        live = [symbol for symbol in symbol_chunk if symbol in has_bars or symbol not in seen]
+        return chunk_job(live, k + 1, seen | has_bars)
 
+    failed = []
+    total = 0
+    t0 = time.perf_counter()
+    # one page per worker in flight plus one queued per worker
+    fetched = iter_fetched(jobs, fetch_window, workers=workers, queue_size=workers, 
+                           bucket=TokenBucket(rate) if rate else None, next_job=next_window,
+                           on_error=lambda job, e: failed.append((job, e)))
+    for (symbol_chunk, k, seen), barsets in fetched:
+        # same rule as next_window: no bars after a newer window had some, or no bars for the whole chunk
+        symbol_rows = {symbol: len(barsets.get(symbol, ())) for symbol in symbol_chunk}
+        stopped = not any(symbol_rows.values())
+        symbol_rows = {symbol: (n, not n and (stopped or symbol in seen)) for symbol, n in symbol_rows.items()}
+        with span('bars to columns') as s:
+            cols = s.measure(barsets_to_columns(barsets, stock_dict))
+        del barsets
+        with span('write prices') as s:
+            inserted = write_prices(conn, cols, 'skip', checkpoint=(*windows[k], symbol_rows))
+            s.measure(cols, rows=inserted)
+        total += inserted
+        elapsed = time.perf_counter() - t0
+        print(f"{symbol_chunk[0]}..{symbol_chunk[-1]} {windows[k][1]}..{windows[k][2]}: {total} rows, {total/elapsed:,.0f} rows/sec")
+    for (symbol_chunk, k, seen), e in failed:
+        print(f"failed chunk {symbol_chunk[0]}..{symbol_chunk[-1]} window {windows[k][1]}..{windows[k][2]}: {e}")
+    if total:
+        update_derived(conn)
+        bump_generation(conn)
+    end_run()
+    return total
 
 
 def main():
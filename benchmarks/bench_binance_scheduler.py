@@ -0,0 +1,36 @@
+"""Bulk kline download against mock_server with a small weight limit, checking the scheduler never gets banned.
+
+    python -m benchmarks.bench_binance_scheduler --weight-limit 300 --days 20
+"""
+import argparse
+import time
+
+import binrest
+import mock_server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--weight-limit', type=int, default=300)
+    parser.add_argument('--days', type=int, default=20, help="days of 1m candles per symbol")
+    parser.add_argument('--symbols', type=int, default=2)
+    args = parser.parse_args()
+
+    server = mock_server.serve(args.port, args.weight_limit)
+    binrest.BASE_URL = f"http://127.0.0.1:{args.port}/api/v3/"
+    binrest.scheduler = binrest.WeightScheduler(limit=args.weight_limit)
+    end_ms = int(time.time() * 1000)
+    t0 = time.perf_counter()
+    rows = binrest.download_klines(mock_server.SYMBOLS[:args.symbols], ['1m'], start_ms=end_ms - args.days * 86_400_000,
+                                   end_ms=end_ms, db_file=':memory:')
+    elapsed = time.perf_counter() - t0
+    counts = server.RequestHandlerClass.ledger.counts
+    server.shutdown()
+    print(f"{rows} klines in {elapsed:.1f}s, server responses {counts}, scheduler {binrest.scheduler.stats}")
+    if counts['429'] or counts['418']:
+        raise SystemExit("scheduler exceeded the weight limit")
+
+
+if __name__ == "__main__":
+    main()
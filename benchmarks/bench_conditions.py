@@ -0,0 +1,71 @@
+"""Compiled ConditionPlan vs the old string + eval() path on the same vectorbt indicator runs.
+
+    python -m benchmarks.bench_conditions --symbols 2000 --bars 500 --repeat 20
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from benchmarks.synthetic import random_walk
+from conditions import compile_conditions
+
+
+INDICATORS = {
+    'indicator_1': {'type': 'RSI', 'params': {'window': 14, 'ewm': False, 'short_name': 'rsi'}, 'vbt_runame': 'vbtrun_1'},
+    'indicator_2': {'type': 'MA', 'params': {'window': 10, 'ewm': False, 'short_name': 'ma'}, 'vbt_runame': 'vbtrun_2'},
+    'indicator_3': {'type': 'BBANDS', 'params': {'window': 20, 'ewm': False, 'alpha': 2, 'short_name': 'bb'}, 'vbt_runame': 'vbtrun_3'},
+}
+CONDITIONS = {
+    0: {'a': 'indicator_1', 'b': 'rsi_crossed_above', 'c1': '', 'c2': '', 'c3': 30.0, 'd': ''},
+    1: {'a': 'indicator_2', 'b': 'close_above', 'c1': 'indicator_2', 'c2': 'ma', 'c3': '', 'd': 'AND'},
+    2: {'a': 'indicator_3', 'b': 'close_crossed_below', 'c1': 'indicator_3', 'c2': 'lower', 'c3': '', 'd': 'OR'},
+    3: {'a': 'indicator_1', 'b': 'rsi_below', 'c1': '', 'c2': '', 'c3': 70.0, 'd': 'AND'},
+}
+
+
+def scan_string(conditions):
+    """the expression the dashboard used to eval()"""
+    order = ''
+    for i, cnd in conditions.items():
+        join = {'AND': '&', 'OR': '|'}.get(cnd['d'], '')
+        rhs = f"{INDICATORS[cnd['c1']]['vbt_runame']}.{cnd['c2']}" if cnd['c1'] else cnd['c3']
+        order += f"{join} ({INDICATORS[cnd['a']]['vbt_runame']}.{cnd['b']}({rhs}).values) "
+    return order
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--bars', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    close = pd.DataFrame(random_walk(args.bars, args.symbols))
+    close.iloc[:5, :10] = np.nan
+    runs = {k: getattr(vbt, v['type']).run(close, **v['params']) for k, v in INDICATORS.items()}
+    scope = {v['vbt_runame']: runs[k] for k, v in INDICATORS.items()}
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        expected = eval(scan_string(CONDITIONS), {}, scope)
+    t_eval = (time.perf_counter() - t0) / args.repeat
+
+    def load(key, output):
+        return getattr(runs[key], output).to_numpy()
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        result = compile_conditions({'scan': CONDITIONS}, INDICATORS).evaluate(load)['scan']
+    t_plan = (time.perf_counter() - t0) / args.repeat
+
+    assert np.array_equal(result, expected), "plan and eval disagree"
+    print(f"{args.symbols} symbols x {args.bars} bars, {int(result.sum())} signals")
+    print(f"string + eval : {1000*t_eval:8.1f} ms")
+    print(f"compiled plan : {1000*t_plan:8.1f} ms  ({t_eval/t_plan:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""pandas fetch_df() + pivot path vs the arrow/numpy data_access path, wall time and peak RSS.
+
+    python -m benchmarks.bench_data_access --symbols 1000 5000 10000 --days 500
+
+Each path runs in its own child process so peak RSS is not shared between them.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+
+import duckdb as ddb
+import numpy as np
+
+import data_access
+from pattern_scan import symbol_offsets, ohlc_arrays
+
+
+def make_db(path, n_symbols, days):
+    """prices table with n_symbols random walks over `days` business days"""
+    conn = ddb.connect(database=path)
+    conn.execute("""CREATE TABLE prices(stock_id UINTEGER, date DATE, open DOUBLE, high DOUBLE,
+                    low DOUBLE, close DOUBLE, volume DOUBLE)""")
+    conn.execute(f"""INSERT INTO prices SELECT s.range AS stock_id,
+                         DATE '2020-01-01' + CAST(d.range * 7 / 5 AS INTEGER) AS date,
+                         100 + random() AS open, 101 + random() AS high, 99 + random() AS low,
+                         100 + random() AS close, floor(random() * 1e6) AS volume
+                     FROM range({n_symbols}) s, range({days}) d""")
+    conn.close()
+
+
+def pandas_path(conn):
+    """what the dashboard did before: fetch_df, one pivot + ffill per field, sort + copy for talib"""
+    prices = conn.execute("SELECT * FROM prices").fetch_df()
+    frames = [prices.pivot(index='date', columns='stock_id', values=c).ffill() for c in ('open', 'high', 'low', 'close', 'volume')]
+    ohlc = ohlc_arrays(symbol_offsets(prices)[0])
+    return sum(f.shape[0] for f in frames) + len(ohlc[0])
+
+
+def arrow_path(conn):
+    cube = data_access.price_cube(conn, ('open', 'high', 'low', 'close', 'volume'))
+    table, ids, starts, ends = data_access.long_prices(conn, '1900-01-01')
+    ohlc = tuple(data_access.column_array(table, c, np.float64) for c in ('open', 'high', 'low', 'close'))
+    return len(cube.dates) * 5 + len(ohlc[0])
+
+
+def child(path, name, out):
+    conn = ddb.connect(database=path, read_only=True)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    globals()[name](conn)
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out.put((elapsed, peak / 2**10, (peak - base) / 2**10))
+
+
+def measure(path, name):
+    out = mp.Queue()
+    p = mp.Process(target=child, args=(path, name, out))
+    p.start()
+    result = out.get()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--days', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.symbols:
+            path = os.path.join(tmp, f'prices_{n}.ddb')
+            make_db(path, n, args.days)
+            for name in ('pandas_path', 'arrow_path'):
+                elapsed, peak, grown = measure(path, name)
+                print(f"{n:>6} symbols  {name:<12} {elapsed:7.2f}s  peak RSS {peak:8,.0f} MiB  (+{grown:,.0f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Serial vs concurrent price ingest against FakeBarsetAPI.
+
+    python -m benchmarks.bench_fetch --symbols 2000 --latency 1.0 --workers 8
+"""
+import argparse
+import time
+
+import duckdb as ddb
+
+import alpaca_duckdb_utils as adu
+from benchmarks.fake_barset import FakeBarsetAPI
+
+
+def setup(n_symbols):
+    conn = ddb.connect(database=':memory:')
+    adu.create_tables(conn)
+    conn.execute("INSERT INTO symbols (symbol) SELECT 'S' || range FROM range(?)", [n_symbols])
+    return conn
+
+
+def run(n_symbols, latency, workers, rate):
+    adu.api = FakeBarsetAPI(latency=latency)
+    adu.conn = setup(n_symbols)
+    t0 = time.perf_counter()
+    rows = adu.get_update_prices(workers=workers, rate=rate)
+    elapsed = time.perf_counter() - t0
+    adu.conn.close()
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0, help="requests/sec, 0 for no limit")
+    args = parser.parse_args()
+
+    results = {}
+    for label, workers in (('serial', 1), (f'{args.workers} workers', args.workers)):
+        results[label] = run(args.symbols, args.latency, workers, args.rate)
+    for label, (rows, elapsed) in results.items():
+        print(f"{label:>12}: {rows} rows in {elapsed:.2f}s ({rows/elapsed:,.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Broadcast parameter sweep vs one vectorbt run + Portfolio per combination.
+
+    python -m benchmarks.bench_param_sweep --bars 1000 --windows 5:200:5 --thresholds 20:40:1 --sample 40
+
+The per-combination loop runs on --sample combinations and is extrapolated to the full grid.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from benchmarks.synthetic import (SWEEP_INDICATORS as INDICATORS, SWEEP_ENTRIES as ENTRIES, SWEEP_EXITS as EXITS,
+                                  random_walk)
+from conditions import compile_conditions
+from param_sweep import parse_range, run_sweep, portfolio_metrics
+
+
+def single_run(close, window, threshold):
+    """what the Backtester did per click"""
+    ma = vbt.MA.run(close, window=window)
+    rsi = vbt.RSI.run(close, window=14)
+    entries = ma.close_crossed_above(ma.ma) & rsi.rsi_below(threshold)
+    exits = ma.close_crossed_below(ma.ma)
+    return vbt.Portfolio.from_signals(close, entries, exits, freq='1D')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bars', type=int, default=1000)
+    parser.add_argument('--windows', default='5:200:5')
+    parser.add_argument('--thresholds', default='20:40:1')
+    parser.add_argument('--sample', type=int, default=40)
+    args = parser.parse_args()
+
+    close = pd.Series(random_walk(args.bars), index=pd.bdate_range('2018-01-01', periods=args.bars))
+    frames = pd.DataFrame({'close': close})
+    plan = compile_conditions({'entries': ENTRIES, 'exits': EXITS}, INDICATORS)
+    axes = {'indicator_1.window': parse_range(args.windows, int), '$entry_2': parse_range(args.thresholds)}
+
+    # numba compiles on first use, keep it out of both timings
+    run_sweep(frames, INDICATORS, plan, {k: v[:2] for k, v in axes.items()})
+    portfolio_metrics(single_run(close, 10, 30.))
+
+    t0 = time.perf_counter()
+    results = run_sweep(frames, INDICATORS, plan, axes)
+    t_sweep = time.perf_counter() - t0
+
+    sample = results.sample(min(args.sample, len(results)), random_state=0)
+    t0 = time.perf_counter()
+    for i, row in sample.iterrows():
+        expected = portfolio_metrics(single_run(close, int(row['indicator_1.window']), row['$entry_2'])).iloc[0]
+        assert np.allclose(row[expected.index].astype(float), expected.astype(float), equal_nan=True), f"combination {i} differs"
+    t_loop = (time.perf_counter() - t0) / len(sample) * len(results)
+
+    print(f"{len(results)} combinations x {args.bars} bars")
+    print(f"one run per combination : {t_loop:8.2f} s  (extrapolated from {len(sample)})")
+    print(f"broadcast sweep         : {t_sweep:8.2f} s  ({t_loop/t_sweep:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Universe backtest wall time and parent peak RSS by worker count and block size.
+
+    python -m benchmarks.bench_universe_backtest --symbols 2000 --bars 750 --workers 1,2,4 --blocks 100,500
+"""
+import argparse
+import resource
+import time
+
+import duckdb as ddb
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import INDICATORS, ENTRIES, EXITS, random_walk
+from conditions import compile_conditions
+from universe_backtest import universe_backtest
+
+
+def synthetic_prices(conn, symbols, bars, seed=0):
+    dates = pd.bdate_range('2019-01-01', periods=bars)
+    close = random_walk(bars, symbols, seed).ravel()
+    prices = pd.DataFrame({'date': np.repeat(dates.values, symbols),
+                           'stock_id': np.tile(np.arange(1, symbols + 1, dtype=np.uint32), bars),
+                           'open': close, 'high': close * 1.01, 'low': close * 0.99, 'close': close, 'volume': 1000})
+    conn.execute("CREATE TABLE prices AS SELECT * FROM prices")
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, default=2000)
+    parser.add_argument('--bars', type=int, default=750)
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--blocks', default='100,500')
+    args = parser.parse_args()
+
+    conn = ddb.connect(':memory:')
+    synthetic_prices(conn, args.symbols, args.bars)
+    plan = compile_conditions({'entries': ENTRIES, 'exits': EXITS}, INDICATORS)
+    stock_ids = np.arange(1, args.symbols + 1)
+    # numba compiles in the parent on first use, keep it out of the timings
+    universe_backtest(conn, INDICATORS, plan, stock_ids[:2], workers=1)
+
+    print(f"{args.symbols} symbols x {args.bars} bars")
+    for block in (int(b) for b in args.blocks.split(',')):
+        for workers in (int(w) for w in args.workers.split(',')):
+            t0 = time.perf_counter()
+            stats = universe_backtest(conn, INDICATORS, plan, stock_ids, workers=workers, block=block)
+            elapsed = time.perf_counter() - t0
+            print(f"block {block:5d} workers {workers:2d} : {elapsed:7.2f} s  {len(stats)/elapsed:8.0f} symbols/s"
+                  f"  parent peak RSS {peak_rss_mb():7.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
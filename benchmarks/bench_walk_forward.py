@@ -0,0 +1,55 @@
+"""Walk-forward on shared full-history signals vs a fresh parameter sweep per train window.
+
+    python -m benchmarks.bench_walk_forward --bars 2500 --train 500 --test 100 --workers 1,2,4
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import (SWEEP_INDICATORS as INDICATORS, SWEEP_ENTRIES as ENTRIES, SWEEP_EXITS as EXITS,
+                                  random_walk)
+from conditions import compile_conditions
+from param_sweep import parse_range, run_sweep
+from walk_forward import walk_forward, walk_forward_windows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bars', type=int, default=2500)
+    parser.add_argument('--train', type=int, default=500)
+    parser.add_argument('--test', type=int, default=100)
+    parser.add_argument('--windows', default='5:200:5')
+    parser.add_argument('--thresholds', default='20:80:5')
+    parser.add_argument('--workers', default='1,2,4')
+    args = parser.parse_args()
+
+    close = pd.Series(random_walk(args.bars), index=pd.bdate_range('2010-01-01', periods=args.bars))
+    frames = pd.DataFrame({'close': close})
+    plan = compile_conditions({'entries': ENTRIES, 'exits': EXITS}, INDICATORS)
+    axes = {'indicator_1.window': parse_range(args.windows, int), '$entry_2': parse_range(args.thresholds)}
+    windows = walk_forward_windows(args.bars, args.train, args.test)
+
+    # numba compiles on first use, keep it out of the timings
+    walk_forward(frames.iloc[:args.train + args.test], INDICATORS, plan, {k: v[:2] for k, v in axes.items()},
+                 args.train, args.test, workers=1)
+
+    # every train window swept from scratch, indicators re-run on each window's bars
+    t0 = time.perf_counter()
+    for start, split, end in windows:
+        run_sweep(frames.iloc[start:split], INDICATORS, plan, axes)
+    t_fresh = time.perf_counter() - t0
+
+    n = len(axes['indicator_1.window']) * len(axes['$entry_2'])
+    print(f"{len(windows)} windows x {n} combinations, {args.bars} bars")
+    print(f"sweep per train window   : {t_fresh:7.2f} s  (train sweeps only)")
+    for workers in (int(w) for w in args.workers.split(',')):
+        t0 = time.perf_counter()
+        walk_forward(frames, INDICATORS, plan, axes, args.train, args.test, workers=workers)
+        elapsed = time.perf_counter() - t0
+        print(f"walk_forward, {workers:2d} workers : {elapsed:7.2f} s  ({t_fresh/elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""In-process stand-in for tradeapi.REST.get_barset, for benchmarking the ingest without the real API"""
+import random
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+FakeBar = namedtuple('FakeBar', 't o h l c v')
+EXCHANGES = ('NYSE', 'NASDAQ', 'ARCA', 'AMEX')
+
+
+def market_symbols(n):
+    """symbols of a synthetic universe of n stocks"""
+    return [f'S{i:05d}' for i in range(n)]
+
+
+def synthetic_ohlcv(symbol, n):
+    """deterministic random walk open, high, low, close, volume arrays of length n for symbol"""
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    close = 20 * np.exp(np.cumsum(rng.normal(0, 0.02, n))) + 1
+    open_ = close * (1 + rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, n))
+    volume = rng.integers(1_000, 5_000_000, n)
+    return open_.round(2), high.round(2), low.round(2), close.round(2), volume
+
+
+def _ts(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('US/Eastern') if ts.tzinfo is None else ts
+
+
+class FakeBarsetAPI:
+    """get_barset over synthetic daily bars, with simulated request latency and failures"""
+    def __init__(self, latency=0.25, history=1000, end='2022-01-03', error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dates = pd.bdate_range(end=end, periods=history, tz='US/Eastern')
+        self.stamps = list(self.dates)
+        self.calls = 0
+
+    def get_barset(self, symbols, timeframe, limit=None, start=None, end=None, after=None, until=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise ConnectionError("fake get_barset failure")
+        if isinstance(symbols, str): symbols = symbols.split(',')
+        # bars are generated over the whole calendar so every window of a symbol agrees
+        keep = np.ones(len(self.dates), dtype=bool)
+        if after is not None: keep &= self.dates > _ts(after)
+        if start is not None: keep &= self.dates >= _ts(start)
+        if until is not None: keep &= self.dates < _ts(until)
+        if end is not None: keep &= self.dates <= _ts(end)
+        idx = np.flatnonzero(keep)
+        if limit: idx = idx[-limit:]
+        dates = [self.stamps[i] for i in idx]
+        barsets = {}
+        for symbol in symbols:
+            cols = (col[idx].tolist() for col in synthetic_ohlcv(symbol, len(self.dates)))
+            barsets[symbol] = [FakeBar(*row) for row in zip(dates, *cols)]
+        return barsets
@@ -0,0 +1,255 @@
+"""Hot path benchmark suite on synthetic markets, results as JSON to compare across commits.
+
+    python -m benchmarks.suite --symbols 1000 5000 10000 --days 500 --out bench.json
+    python -m benchmarks.suite --symbols 1000 --cases pivot conditions --compare bench.json
+
+Each (case, market size) runs in its own spawned process: setup, one cold run (numba compiles,
+caches fill) and one timed warm run. Wall time is the warm run, peak RSS covers the whole child,
+throughput is the case's items (rows, symbols or values) per second of wall time."""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import duckdb as ddb
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from benchmarks.synthetic import INDICATORS, ENTRIES, EXITS, make_market
+
+
+# seconds a case may take, setup and cold run included, before its child is terminated
+CASE_TIMEOUT = 3600
+PATTERN = 'CDLENGULFING'
+
+# cases: setup(path, days) -> (run, items, unit), run() is what gets timed, items=None counts what run() returns
+
+def setup_pivot(path, days):
+    """long prices to the dense dates x symbols cube the scanner reads"""
+    from data_access import price_cube
+    from price_cube import FIELDS
+    conn = ddb.connect(database=path, read_only=True)
+    rows = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    return (lambda: price_cube(conn, FIELDS)), rows, 'rows'
+
+
+def setup_pattern_scan(path, days):
+    """one talib pattern over every symbol's trailing window"""
+    from data_access import long_prices, column_array
+    from pattern_scan import scan_pattern
+    conn = ddb.connect(database=path, read_only=True)
+    table, ids, starts, ends = long_prices(conn, '1900-01-01')
+    ohlc = tuple(column_array(table, c, np.float64) for c in ('open', 'high', 'low', 'close'))
+    return (lambda: scan_pattern(PATTERN, ohlc, ids, starts, ends)), len(ids), 'symbols'
+
+
+def _cube_frames(path):
+    from data_access import price_cube
+    conn = ddb.connect(database=path, read_only=True)
+    cube = price_cube(conn, ('high', 'low', 'close', 'volume'))
+    return conn, cube, {f: cube.frame(f) for f in cube.fields}
+
+
+def setup_indicators(path, days):
+    """vbt runs of the suite's indicators over the whole universe"""
+    from indicator_cache import run_indicator
+    conn, cube, frames = _cube_frames(path)
+
+    def run():
+        return [run_indicator(frames, v['type'], v['params']) for v in INDICATORS.values()]
+    return run, cube.data[0].size, 'values'
+
+
+def setup_conditions(path, days):
+    """compiled entry/exit plan over precomputed indicator outputs"""
+    from conditions import compile_conditions
+    from indicator_cache import run_indicator
+    conn, cube, frames = _cube_frames(path)
+    runs = {k: run_indicator(frames, v['type'], v['params']) for k, v in INDICATORS.items()}
+    plan = compile_conditions({'entries': ENTRIES, 'exits': EXITS}, INDICATORS)
+    load = lambda indi, output: getattr(runs[indi], output).to_numpy()
+    return (lambda: plan.evaluate(load)), cube.data[0].size, 'values'
+
+
+def setup_backtest(path, days):
+    """the entry/exit strategy backtested over every symbol"""
+    from conditions import compile_conditions
+    from universe_backtest import universe_backtest, universe_ids
+    conn = ddb.connect(database=path, read_only=True)
+    plan = compile_conditions({'entries': ENTRIES, 'exits': EXITS}, INDICATORS)
+    ids = universe_ids(conn)
+    return (lambda: universe_backtest(conn, INDICATORS, plan, ids)), len(ids), 'symbols'
+
+
+def setup_ingest(path, days):
+    """get_update_prices of the whole universe from FakeBarsetAPI into an empty prices table, fetch and
+    write only: the derived stages after it are the derived case"""
+    import alpaca_duckdb_utils as adu
+    from benchmarks.fake_barset import FakeBarsetAPI
+    symbols = ddb.connect(database=path, read_only=True).execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+    adu.update_derived = lambda conn: None
+    runs = []
+
+    def run():
+        # every run ingests into a new database next to the market, the second would find nothing left to fetch
+        target = f"{path}.ingest_{len(runs)}.ddb"
+        make_market(target, symbols, days, prices=False)
+        adu.api = FakeBarsetAPI(latency=0, history=days)
+        adu.conn = ddb.connect(database=target)
+        runs.append(target)
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = adu.get_update_prices(workers=adu.FETCH_WORKERS, rate=0)
+        adu.conn.close()
+        return rows
+    # items are the rows the run inserted
+    return run, None, 'rows'
+
+
+def setup_derived(path, days):
+    """update_derived after an ingest of the whole universe: every pattern signal, the cube export and
+    the indicator state, each from scratch"""
+    import alpaca_duckdb_utils as adu
+    conn = ddb.connect(database=path, read_only=True)
+    rows = conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    conn.close()
+    # a copy of the market per run, made here so the copy isn't timed
+    runs = []
+    for k in range(2):
+        target = f"{path}.derived_{k}"
+        os.makedirs(target)
+        shutil.copy(path, os.path.join(target, 'market.ddb'))
+        runs.append(target)
+
+    def run():
+        target = runs.pop(0)
+        adu.config.CUBE_DIR = os.path.join(target, 'cube')
+        adu.config.INDICATOR_STATE = os.path.join(target, 'state.npz')
+        conn = ddb.connect(database=os.path.join(target, 'market.ddb'))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                adu.update_derived(conn)
+        finally:
+            conn.close()
+    return run, rows, 'rows'
+
+
+CASES = {'pivot': setup_pivot, 'pattern_scan': setup_pattern_scan, 'indicators': setup_indicators,
+         'conditions': setup_conditions, 'backtest': setup_backtest, 'ingest': setup_ingest,
+         'derived': setup_derived}
+
+
+def child(case, path, days, out):
+    try:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        run, items, unit = CASES[case](path, days)
+        t0 = time.perf_counter()
+        run()
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        done = run()
+        wall = time.perf_counter() - t0
+        if items is None: items = done
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out.put({'wall_s': wall, 'cold_s': cold, 'peak_rss_mib': peak / 2**10, 'rss_growth_mib': (peak - base) / 2**10,
+                 'items': int(items), 'unit': unit, 'throughput': items / wall if wall else None})
+    except Exception as e:
+        out.put({'error': f"{type(e).__name__}: {e}"})
+
+
+def measure(case, path, days, timeout=CASE_TIMEOUT):
+    """run one case in a spawned child. A child that is killed (e.g. by the OOM killer) or runs past
+    timeout seconds gives an error entry instead of blocking the suite"""
+    ctx = mp.get_context('spawn')
+    out = ctx.Queue()
+    p = ctx.Process(target=child, args=(case, path, days, out))
+    p.start()
+    deadline = time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = out.get(timeout=1)
+        except queue.Empty:
+            if not p.is_alive():
+                # the result may have been flushed just before the child exited
+                try:
+                    result = out.get(timeout=1)
+                except queue.Empty:
+                    result = {'error': f"child exited with code {p.exitcode} without a result"}
+            elif time.monotonic() > deadline:
+                p.terminate()
+                result = {'error': f"timed out after {timeout}s"}
+    p.join()
+    return result
+
+
+def environment():
+    try:
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'packages': {'numpy': np.__version__, 'pandas': pd.__version__, 'vectorbt': vbt.__version__,
+                         'duckdb': ddb.__version__}}
+
+
+def compare(results, baseline):
+    """print wall time and peak RSS of results against a baseline run's JSON"""
+    base = {(r['case'], r['symbols']): r for r in baseline['results'] if 'wall_s' in r}
+    print(f"against {baseline.get('commit') or 'baseline'} of {baseline.get('created')}")
+    for r in results['results']:
+        b = base.get((r['case'], r['symbols']))
+        if b is None or 'wall_s' not in r: continue
+        print(f"{r['case']:>14} {r['symbols']:>6}  wall {r['wall_s'] / b['wall_s']:6.2f}x"
+              f"  peak RSS {r['peak_rss_mib'] / b['peak_rss_mib']:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--out', default=None, help="JSON file, default bench-<commit>.json")
+    parser.add_argument('--compare', default=None, help="JSON of an earlier run")
+    parser.add_argument('--timeout', type=float, default=CASE_TIMEOUT, help="seconds per case")
+    args = parser.parse_args()
+
+    results = {**environment(), 'days': args.days, 'results': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.symbols:
+            path = os.path.join(tmp, f'market_{n}.ddb')
+            t0 = time.perf_counter()
+            make_market(path, n, args.days)
+            print(f"{n} symbols x {args.days} days generated in {time.perf_counter() - t0:.1f}s")
+            for case in args.cases:
+                r = {'case': case, 'symbols': n, **measure(case, path, args.days, args.timeout)}
+                results['results'].append(r)
+                if 'error' in r:
+                    print(f"{case:>14} {n:>6}  failed: {r['error']}")
+                else:
+                    print(f"{case:>14} {n:>6}  {r['wall_s']:8.3f}s (cold {r['cold_s']:7.2f}s)"
+                          f"  peak RSS {r['peak_rss_mib']:7,.0f} MiB  {r['throughput']:>14,.0f} {r['unit']}/s")
+
+    out = args.out or f"bench-{(results['commit'] or 'local')[:10]}.json"
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"results in {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
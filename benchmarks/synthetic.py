@@ -0,0 +1,130 @@
+"""Deterministic synthetic market in a DuckDB file with the loader's schema, for offline benchmarks.
+
+    python -m benchmarks.synthetic market.ddb --symbols 5000 --days 500
+
+Tables come from alpaca_duckdb_utils.create_tables. Each symbol's bars are the same random walk
+FakeBarsetAPI serves for it, every LATE_EVERY-th symbol only lists part way through the history.
+Also the strategies and the plain random walk the benchmarks share."""
+import argparse
+import zlib
+
+import duckdb as ddb
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_barset import EXCHANGES, market_symbols, synthetic_ohlcv
+
+
+LATE_EVERY = 7
+MARKET_END = '2022-01-03'
+INSERT_BLOCK = 1000
+
+# entry/exit strategy of the suite's conditions and backtest cases and bench_universe_backtest
+INDICATORS = {
+    'indicator_1': {'type': 'RSI', 'params': {'window': 14, 'ewm': False, 'short_name': 'rsi'}},
+    'indicator_2': {'type': 'MA', 'params': {'window': 50, 'ewm': False, 'short_name': 'ma'}},
+    'indicator_3': {'type': 'BBANDS', 'params': {'window': 20, 'ewm': False, 'alpha': 2, 'short_name': 'bb'}},
+    'indicator_4': {'type': 'MACD', 'params': {'fast_window': 12, 'slow_window': 26, 'signal_window': 9,
+                                               'macd_ewm': True, 'signal_ewm': True, 'short_name': 'macd'}},
+}
+ENTRIES = {
+    0: {'a': 'indicator_1', 'b': 'rsi_crossed_above', 'c1': '', 'c2': '', 'c3': 30.0, 'd': ''},
+    1: {'a': 'indicator_2', 'b': 'close_above', 'c1': 'indicator_2', 'c2': 'ma', 'c3': '', 'd': 'AND'},
+    2: {'a': 'indicator_3', 'b': 'close_crossed_below', 'c1': 'indicator_3', 'c2': 'lower', 'c3': '', 'd': 'OR'},
+}
+EXITS = {
+    0: {'a': 'indicator_1', 'b': 'rsi_crossed_below', 'c1': '', 'c2': '', 'c3': 70.0, 'd': ''},
+    1: {'a': 'indicator_4', 'b': 'macd_crossed_below', 'c1': 'indicator_4', 'c2': 'signal', 'c3': '', 'd': 'OR'},
+}
+# swept strategy of bench_param_sweep and bench_walk_forward, '$entry_2' is the swept RSI threshold
+SWEEP_INDICATORS = {
+    'indicator_1': {'type': 'MA', 'params': {'window': 10, 'ewm': False, 'short_name': 'ma'}},
+    'indicator_2': {'type': 'RSI', 'params': {'window': 14, 'ewm': False, 'short_name': 'rsi'}},
+}
+SWEEP_ENTRIES = {
+    0: {'a': 'indicator_1', 'b': 'close_crossed_above', 'c1': 'indicator_1', 'c2': 'ma', 'c3': '', 'd': ''},
+    1: {'a': 'indicator_2', 'b': 'rsi_below', 'c1': '', 'c2': '', 'c3': '$entry_2', 'd': 'AND'},
+}
+SWEEP_EXITS = {
+    0: {'a': 'indicator_1', 'b': 'close_crossed_below', 'c1': 'indicator_1', 'c2': 'ma', 'c3': '', 'd': ''},
+}
+
+
+def random_walk(bars, symbols=None, seed=0):
+    """closes of random walks starting near 100, shape (bars,) or (bars, symbols)"""
+    rng = np.random.default_rng(seed)
+    shape = bars if symbols is None else (bars, symbols)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.02, shape), axis=0))
+
+
+def listing_offset(symbol, days):
+    """first bar of symbol, late listings start somewhere in the first half of the history"""
+    h = zlib.crc32(symbol.encode())
+    return h % (days // 2) if h % LATE_EVERY == 0 else 0
+
+
+def symbol_columns(symbols, days, stock_dict, dates):
+    """long columns of the bars of symbols, in the prices table's order"""
+    cols = {k: [] for k in ('date', 'stock_id', 'open', 'high', 'low', 'close', 'volume')}
+    for symbol in symbols:
+        start = listing_offset(symbol, days)
+        o, h, l, c, v = (x[start:] for x in synthetic_ohlcv(symbol, days))
+        cols['date'].append(dates[start:])
+        cols['stock_id'].append(np.full(days - start, stock_dict[symbol], dtype=np.uint32))
+        for k, x in zip(('open', 'high', 'low', 'close', 'volume'), (o, h, l, c, v)):
+            cols[k].append(x)
+    return {k: np.concatenate(v) for k, v in cols.items()}
+
+
+def insert_symbols(conn, symbols):
+    """symbols rows for the synthetic universe, returns dict{symbol: id}"""
+    n = len(symbols)
+    conn.register('symbol_batch', pd.DataFrame({
+        'symbol': symbols, 'name': [f'Synthetic {s}' for s in symbols],
+        'exchange': [EXCHANGES[i % len(EXCHANGES)] for i in range(n)],
+        'easy_to_borrow': np.ones(n, dtype=bool), 'fractionable': np.ones(n, dtype=bool),
+        'marginable': np.ones(n, dtype=bool), 'shortable': np.ones(n, dtype=bool)}))
+    try:
+        conn.execute("""INSERT INTO symbols (symbol, name, exchange, easy_to_borrow, fractionable, marginable, shortable)
+                        SELECT * FROM symbol_batch""")
+    finally:
+        conn.unregister('symbol_batch')
+    return dict(conn.execute("SELECT symbol, id FROM symbols").fetchall())
+
+
+def make_market(path, n_symbols, days, end=MARKET_END, prices=True):
+    """create the loader's tables in a new duckdb at path with n_symbols symbols and, with prices,
+    `days` business days of bars each. Returns the number of price rows"""
+    # imported here, the strategies above don't need the loader's dependencies
+    from alpaca_duckdb_utils import create_tables
+    conn = ddb.connect(database=path)
+    try:
+        create_tables(conn)
+        symbols = market_symbols(n_symbols)
+        stock_dict = insert_symbols(conn, symbols)
+        if not prices: return 0
+        dates = pd.bdate_range(end=end, periods=days).values.astype('datetime64[D]')
+        for i in range(0, n_symbols, INSERT_BLOCK):
+            conn.register('price_batch', pd.DataFrame(symbol_columns(symbols[i:i + INSERT_BLOCK], days, stock_dict, dates)))
+            try:
+                conn.execute("""INSERT INTO prices SELECT date, stock_id, open, high, low, close, volume FROM price_batch""")
+            finally:
+                conn.unregister('price_batch')
+        conn.execute("INSERT INTO ingest_watermarks SELECT stock_id, MAX(date), MIN(date) FROM prices GROUP BY stock_id")
+        return conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--symbols', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=500)
+    args = parser.parse_args()
+    rows = make_market(args.path, args.symbols, args.days)
+    print(f"{args.path}: {args.symbols} symbols, {rows} price rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,37 @@
 import requests
+from requests.adapters import HTTPAdapter
 # import json
 import csv, time
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import duckdb as ddb
 
+import config
+from fetch_pipeline import iter_fetched
+from perf import span, start_run, end_run
 
 
 kline_intervals = ('1m','3m','5m','15m','30m','1h','2h','4h','6h','8h','12h','1d','3d','1w','1M')
 
-BASE_URL = "https://api.binance.com/api/v3/"
+BASE_URL = config.BINANCE_URL or "https://api.binance.com/api/v3/"
+KLINE_LIMIT = 1000
+KLINE_WORKERS = 8
+FLUSH_ROWS = 100_000
+# request weight budget per minute (X-MBX-USED-WEIGHT-1M) and the share of it we use
+WEIGHT_LIMIT = 1200
+WEIGHT_HEADROOM = 0.9
+# lower runs first, interactive calls jump ahead of bulk downloads
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+# pooled connections, shared by all requests and download workers
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=KLINE_WORKERS))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=KLINE_WORKERS))
 
 
 class BinanceException(Exception):
@@ -23,12 +48,96 @@ class BinanceException(Exception):
         super().__init__(message)
 
 
+def kline_weight(limit):
+    """request weight of GET klines for limit"""
+    limit = limit or 500
+    if limit <= 100: return 1
+    if limit <= 500: return 2
+    if limit <= 1000: return 5
+    return 10
+
+
+class WeightScheduler:
+    """Shared gate for Binance REST calls.
+
+    Tracks the used weight reported in X-MBX-USED-WEIGHT-1M, holds requests back once the
+    minute's budget (limit * headroom) would be exceeded, and sleeps out Retry-After on 418/429.
+    Waiting requests are released lowest priority number first."""
+    def __init__(self, limit=WEIGHT_LIMIT, headroom=WEIGHT_HEADROOM, max_retries=5):
+        self.budget = int(limit * headroom)
+        self.max_retries = max_retries
+        self.used = 0
+        self.minute = int(time.time() // 60)
+        self.retry_at = 0.0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.stats = {'requests': 0, 'weight': 0, 'throttled': 0, 'retry_after': 0}
+
+    def _roll(self, now):
+        minute = int(now // 60)
+        if minute != self.minute:
+            self.minute, self.used = minute, 0
+
+    def acquire(self, weight, priority=PRIORITY_INTERACTIVE):
+        """block until this request is first in line and fits in the current minute"""
+        ticket = (priority, next(self.counter))
+        with self.cond:
+            heapq.heappush(self.waiting, ticket)
+            throttled = False
+            while True:
+                now = time.time()
+                self._roll(now)
+                if self.waiting[0] == ticket and now >= self.retry_at and self.used + weight <= self.budget:
+                    break
+                if self.waiting[0] == ticket:
+                    throttled = True
+                    wait = max(self.retry_at - now, 0) or (self.minute + 1) * 60 - now
+                    self.cond.wait(timeout=min(wait, 1.0))
+                else:
+                    self.cond.wait(timeout=1.0)
+            heapq.heappop(self.waiting)
+            self.used += weight
+            self.stats['requests'] += 1
+            self.stats['weight'] += weight
+            self.stats['throttled'] += throttled
+            self.cond.notify_all()
+
+    def update(self, r):
+        """sync used weight and ban window from a response"""
+        with self.cond:
+            self._roll(time.time())
+            used = r.headers.get('X-MBX-USED-WEIGHT-1M') or r.headers.get('X-MBX-USED-WEIGHT')
+            if used is not None:
+                self.used = max(self.used, int(used))
+            if r.status_code in (418, 429):
+                self.stats['retry_after'] += 1
+                self.retry_at = max(self.retry_at, time.time() + int(r.headers.get('Retry-After', 60)))
+            self.cond.notify_all()
+
+    def get(self, path, params=None, weight=1, priority=PRIORITY_INTERACTIVE):
+        """GET BASE_URL + path through the scheduler, retrying after 418/429"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(weight, priority)
+            r = session.get(BASE_URL + path, params=params)
+            self.update(r)
+            if r.status_code not in (418, 429): return r
+        return r
+
+    def batch(self, calls, priority=PRIORITY_INTERACTIVE, workers=4):
+        """run calls=[(path, params, weight), ...] at one priority, responses in call order"""
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda call: self.get(*call, priority=priority), calls))
+
+
+scheduler = WeightScheduler()
+
+
 def timediff():
     PATH =  'time'
     params = None
     timestamp = int(time.time() * 1000)
-    url = BASE_URL + PATH
-    r = requests.get(url, params=params)
+    r = scheduler.get(PATH, params=params, weight=1)
     if r.status_code == 200:
         data = r.json()
         print(f"diff={timestamp - data['serverTime']}ms")
@@ -37,15 +146,13 @@ def timediff():
 
 
 def all_tickers():
-    endpt = BASE_URL + "ticker/price"
-    r = requests.get(endpt)
+    r = scheduler.get("ticker/price", weight=2)
     result = r.json()
     print(result, len(result))
 
 
-def kline(symbol = 'BTCUSDT', interval='1m', starttime=None, endtime=None, limit=None):
+def kline(symbol = 'BTCUSDT', interval='1m', starttime=None, endtime=None, limit=None, priority=PRIORITY_INTERACTIVE):
     PATH = 'klines'
-    endpt = BASE_URL + PATH
 
     params = {
         'symbol': symbol,
@@ -54,7 +161,7 @@ def kline(symbol = 'BTCUSDT', interval='1m', starttime=None, endtime=None, limit
         'endTime': endtime,
         'limit': limit}
     
-    r = requests.get(endpt, params=params)
+    r = scheduler.get(PATH, params=params, weight=kline_weight(limit), priority=priority)
     result = r.json()
     return result,r 
     # if r.status_code == 200:
@@ -63,6 +170,110 @@ def kline(symbol = 'BTCUSDT', interval='1m', starttime=None, endtime=None, limit
     #     raise BinanceException(status_code=r.status_code, data=r.json())
 
 
+def create_kline_table(conn):
+    """Create klines table in conn's duckdb"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS klines(
+                    symbol VARCHAR,
+                    interval VARCHAR,
+                    open_time TIMESTAMP,
+                    open DOUBLE,
+                    high DOUBLE,
+                    low DOUBLE,
+                    close DOUBLE,
+                    volume DOUBLE,
+                    close_time TIMESTAMP,
+                    quote_volume DOUBLE,
+                    trades UINTEGER,
+                    taker_buy_base DOUBLE,
+                    taker_buy_quote DOUBLE)""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS kline_idx ON klines (symbol, interval, open_time)")
+
+
+def parse_klines(rows, symbol, interval):
+    """raw kline lists to numpy columns"""
+    n = len(rows)
+    cols = {'symbol': np.full(n, symbol, dtype=object), 'interval': np.full(n, interval, dtype=object)}
+    cols['open_time'] = np.fromiter((r[0] for r in rows), np.int64, n).astype('datetime64[ms]')
+    for i, name in ((1, 'open'), (2, 'high'), (3, 'low'), (4, 'close'), (5, 'volume')):
+        cols[name] = np.fromiter((r[i] for r in rows), np.float64, n)
+    cols['close_time'] = np.fromiter((r[6] for r in rows), np.int64, n).astype('datetime64[ms]')
+    cols['quote_volume'] = np.fromiter((r[7] for r in rows), np.float64, n)
+    cols['trades'] = np.fromiter((r[8] for r in rows), np.int64, n)
+    cols['taker_buy_base'] = np.fromiter((r[9] for r in rows), np.float64, n)
+    cols['taker_buy_quote'] = np.fromiter((r[10] for r in rows), np.float64, n)
+    return cols
+
+
+def fetch_kline_page(job):
+    """one page of klines for job=(symbol, interval, start_ms, end_ms)"""
+    symbol, interval, start_ms, end_ms = job
+    candles, r = kline(symbol, interval, starttime=start_ms, endtime=end_ms, limit=KLINE_LIMIT, priority=PRIORITY_BULK)
+    if r.status_code != 200:
+        raise BinanceException(status_code=r.status_code, data=candles if isinstance(candles, dict) else None)
+    return candles
+
+
+def next_kline_page(job, candles):
+    """job for the page after candles, None when the range is exhausted"""
+    symbol, interval, start_ms, end_ms = job
+    if len(candles) < KLINE_LIMIT: return None
+    return symbol, interval, candles[-1][0] + 1, end_ms
+
+
+def write_klines(conn, cols):
+    conn.register('kline_batch', pd.DataFrame(cols, copy=False))
+    try:
+        inserted = conn.execute("""INSERT INTO klines SELECT b.* FROM kline_batch b
+                                   WHERE NOT EXISTS (SELECT 1 FROM klines k WHERE k.symbol = b.symbol 
+                                       AND k.interval = b.interval AND k.open_time = b.open_time)""").fetchone()[0]
+    finally:
+        conn.unregister('kline_batch')
+    return inserted
+
+
+def download_klines(symbols, intervals=kline_intervals, start_ms=0, end_ms=None, db_file='klines.ddb', 
+                    workers=KLINE_WORKERS):
+    """page every (symbol, interval) from its last stored candle (or start_ms) to end_ms into db_file's klines.
+    Pages are parsed into numpy columns and flushed every FLUSH_ROWS, so memory stays bounded.
+    Requests run at PRIORITY_BULK through the weight scheduler"""
+    start_run('ingest klines')
+    conn = ddb.connect(database=db_file, read_only=False)
+    create_kline_table(conn)
+    end_ms = end_ms or int(time.time() * 1000)
+    last = {(s, i): t for s, i, t in conn.execute("""SELECT symbol, interval, epoch_ms(MAX(open_time)) 
+                                                     FROM klines GROUP BY symbol, interval""").fetchall()}
+    jobs = [(s, i, max(start_ms, last.get((s, i), -1) + 1), end_ms) for s in symbols for i in intervals]
+    failed = []
+    buffer, buffered, total = [], 0, 0
+    t0 = time.perf_counter()
+
+    def flush():
+        nonlocal buffer, buffered, total
+        if not buffer: return
+        with span('write klines') as s:
+            cols = {k: np.concatenate([c[k] for c in buffer]) for k in buffer[0]}
+            inserted = write_klines(conn, cols)
+            s.measure(cols, rows=inserted)
+        total += inserted
+        buffer, buffered = [], 0
+        print(f"{total} klines, {total/(time.perf_counter()-t0):,.0f} rows/sec")
+
+    fetched = iter_fetched(jobs, fetch_kline_page, workers=workers, queue_size=2*workers, next_job=next_kline_page,
+                           on_error=lambda job, e: failed.append((job, e)))
+    for (symbol, interval, start, end), candles in fetched:
+        if not candles: continue
+        buffer.append(parse_klines(candles, symbol, interval))
+        buffered += len(candles)
+        if buffered >= FLUSH_ROWS: flush()
+    flush()
+    for job, e in failed:
+        print(f"failed {job}: {e}")
+    print(f"scheduler: {scheduler.stats}")
+    conn.close()
+    end_run()
+    return total
+
+
 def main():
     candles, r = kline(interval='1d', limit=10000)
     print(candles, len(candles), type(candles), r.status_code)
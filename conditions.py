@@ -0,0 +1,154 @@
+"""Scan / entry / exit conditions compiled into a plan of numpy operations.
+
+A condition is the dict the dashboard builds per row:
+    {'a': indicator key, 'b': method like 'rsi_crossed_above', 'c1': other indicator key or '',
+     'c2': other indicator's output or '', 'c3': number, 'd': 'AND'/'OR' joining it to the rows above,
+     'not': negate this row}
+A 'c3' of '$name' is a parameter swept by param_sweep instead of a fixed number.
+Rows are joined left to right with AND binding tighter than OR. Identical sub-expressions, also
+across several roots (entries and exits), are evaluated once; nothing is exec'd or eval'd."""
+from functools import lru_cache, reduce
+
+import numpy as np
+
+from vbt_indicts import indicts
+
+
+OPS = ('crossed_above', 'crossed_below', 'above', 'below', 'equal')
+# trailing values a crossed_* comparison looks at for the last bar: below before, above now
+CROSS_BARS = 2
+
+
+def parse_method(method):
+    """'rsi_crossed_above' -> ('rsi', 'crossed_above')"""
+    for op in OPS:
+        if method.endswith('_' + op):
+            return method[:-len(op) - 1], op
+    raise ValueError(f"unknown compare method {method!r}")
+
+
+def crossed_above(a, b):
+    """vectorised vbt crossed_above along axis 0: a goes above b after having been below it,
+    a NaN in either side forgets the earlier below"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.broadcast_to(np.asarray(b, dtype=np.float64), a.shape)
+    with np.errstate(invalid='ignore'):
+        above, below = a > b, a < b
+    nan = np.isnan(a) | np.isnan(b)
+    idx = np.arange(a.shape[0]).reshape((-1,) + (1,) * (a.ndim - 1))
+    last_below = np.maximum.accumulate(np.where(below, idx, -1), axis=0)
+    last_nan = np.maximum.accumulate(np.where(nan, idx, -1), axis=0)
+    out = np.zeros(a.shape, dtype=bool)
+    out[1:] = above[1:] & ~above[:-1] & (last_below[:-1] > last_nan[:-1])
+    return out
+
+
+def compare(op, a, b):
+    if op == 'crossed_above': return crossed_above(a, b)
+    # a crosses below b exactly when -a crosses above -b, whatever the shapes of a and b
+    if op == 'crossed_below': return crossed_above(-np.asarray(a), -np.asarray(b))
+    with np.errstate(invalid='ignore'):
+        if op == 'above': return np.greater(a, b)
+        if op == 'below': return np.less(a, b)
+        return np.equal(a, b)
+
+
+class ConditionPlan:
+    """Hash-consed expression DAG in evaluation order.
+
+    steps are ('output', indicator key, output name), ('const', value), ('cmp', op, lhs, rhs),
+    ('not', x), ('and', x, y, ...), ('or', x, y, ...), operands being indexes of earlier steps"""
+    def __init__(self):
+        self.steps = []
+        self.index = {}
+        self.roots = {}
+
+    def node(self, *step):
+        if step[0] in ('and', 'or'):
+            # commutative: sorted and deduplicated operands, one operand is the operand itself
+            operands = tuple(sorted(set(step[1:])))
+            if len(operands) == 1: return operands[0]
+            step = (step[0], *operands)
+        if step[0] == 'not' and self.steps[step[1]][0] == 'not':
+            return self.steps[step[1]][1]
+        if step not in self.index:
+            self.index[step] = len(self.steps)
+            self.steps.append(step)
+        return self.index[step]
+
+    @property
+    def indicators(self):
+        """indicator keys the plan reads outputs of"""
+        return list(dict.fromkeys(s[1] for s in self.steps if s[0] == 'output' and s[1] != '$'))
+
+    @property
+    def last_bars(self):
+        """trailing indicator values the roots' last bar depends on"""
+        return CROSS_BARS if any(s[0] == 'cmp' and s[1].startswith('crossed') for s in self.steps) else 1
+
+    def evaluate(self, load):
+        """run every step once, load(indicator key, output name) returns the output array.
+        Returns dict{root name: boolean array}"""
+        values = []
+        for step in self.steps:
+            kind = step[0]
+            if kind == 'output': values.append(np.asarray(load(step[1], step[2]), dtype=np.float64))
+            elif kind == 'const': values.append(step[1])
+            elif kind == 'cmp': values.append(compare(step[1], values[step[2]], values[step[3]]))
+            elif kind == 'not': values.append(~values[step[1]])
+            elif kind == 'and': values.append(reduce(np.logical_and, (values[i] for i in step[1:])))
+            else: values.append(reduce(np.logical_or, (values[i] for i in step[1:])))
+        return {name: values[i] for name, i in self.roots.items()}
+
+    def describe(self, i=None):
+        """readable expression of a root (all roots for i=None)"""
+        if i is None:
+            return {name: self.describe(i) for name, i in self.roots.items()}
+        step = self.steps[i]
+        kind = step[0]
+        if kind == 'output': return f"{step[1]}.{step[2]}"
+        if kind == 'const': return repr(step[1])
+        if kind == 'cmp': return f"{self.describe(step[2])} {step[1]} {self.describe(step[3])}"
+        if kind == 'not': return f"NOT ({self.describe(step[1])})"
+        return '(' + f" {kind.upper()} ".join(self.describe(x) for x in step[1:]) + ')'
+
+
+def condition_key(cnd, indicators):
+    """hashable, canonical form of one condition row: (negate, join, lhs, op, rhs)"""
+    output, op = parse_method(cnd['b'])
+    lhs = ('output', cnd['a'], output)
+    if cnd['c1']:
+        # a bare indicator compares against its main output
+        other = cnd['c2'] or indicts[indicators[cnd['c1']]['type']]['main']
+        if other.endswith('_list'):
+            raise ValueError(f"{other!r} is a parameter list, not a series")
+        rhs = ('output', cnd['c1'], other)
+    elif isinstance(cnd['c3'], str) and cnd['c3'].startswith('$'):
+        # a swept threshold, loaded per parameter combination as load('$', name)
+        rhs = ('output', '$', cnd['c3'][1:])
+    else:
+        rhs = ('const', float(cnd['c3'] or 0))
+    join = 'or' if str(cnd.get('d', '')).upper() in ('OR', '|') else 'and'
+    return bool(cnd.get('not')), join, lhs, op, rhs
+
+
+@lru_cache(maxsize=64)
+def _compile(roots):
+    plan = ConditionPlan()
+    for name, rows in roots:
+        groups = []
+        for k, (negate, join, lhs, op, rhs) in enumerate(rows):
+            leaf = plan.node('cmp', op, plan.node(*lhs), plan.node(*rhs))
+            if negate: leaf = plan.node('not', leaf)
+            if k and join == 'and': groups[-1].append(leaf)
+            else: groups.append([leaf])
+        plan.roots[name] = plan.node('or', *(plan.node('and', *g) for g in groups))
+    return plan
+
+
+def compile_conditions(roots, indicators):
+    """ConditionPlan for roots=dict{name: dict{n: condition}} over the dashboard's indicator dict.
+    Plans are cached by the canonical conditions, an unchanged rerun reuses the compiled plan"""
+    key = tuple((name, tuple(condition_key(cnd, indicators) for _, cnd in sorted(conditions.items())))
+                for name, conditions in roots.items())
+    return _compile(key)
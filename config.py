@@ -1,7 +1,28 @@
 API_KEY = ""
 SECRET_KEY = ""
 API_URL = ""
+# alpaca market data url, "" for the default (mock_server.py serves one locally)
+DATA_URL = ""
 DB_FILE = ""
+# seconds after which the dashboard closes its prices db handle if no rerun is using it, so ingests can write
+DB_IDLE_CLOSE = 5
+# directory for the memory mapped price cube exported after ingest, "" to build it from DB_FILE
+CUBE_DIR = ""
+# first date of the price cube, exported or built from DB_FILE alike, "" for all history
+CUBE_START = "2021-06-01"
+# memory budget of the dashboard's query cache in bytes
+CACHE_MAX_BYTES = 2 * 2**30
+# memory budget of the computed indicator outputs in bytes
+INDICATOR_CACHE_BYTES = 1 * 2**30
+# .npz of running indicator values advanced after each ingest, "" to always compute from prices
+INDICATOR_STATE = ""
+# writable duckdb for backtest results, "" keeps them in memory until the dashboard restarts
+RESULTS_DB_FILE = ""
+# binance and stocktwits api roots, "" for the real apis
+BINANCE_URL = ""
+STOCKTWITS_URL = ""
+# append-only JSON lines log of the dashboard's and the loaders' timing spans, "" for none
+PERF_LOG = ""
 
 EMAIL_ADDRESS = ''
 EMAIL_PASSWORD = ''
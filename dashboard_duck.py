@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import numpy as np
 import requests
@@ -12,59 +13,128 @@ import streamlit as st
 import vectorbt as vbt
 
 from patterns import patterns
-from vbt_indicts import indicts
+from vbt_indicts import indicts, scan_requirements
+from conditions import compile_conditions
+from param_sweep import METRICS, parse_range, run_sweep, heatmap_frame
+from universe_backtest import universe_backtest, universe_ids, stored_universe
+from walk_forward import walk_forward
+from result_store import canonical_strategy, strategy_key, frame_version, portfolio_result, save_result, load_result, stored_runs
+from indicator_cache import output_loader
+from online_indicators import load_state
+from pattern_scan import scan_pattern
+from price_cube import FIELDS, open_cube, current_cube_version
+from data_access import fetch_columns, frame_from_columns, column_array, long_prices, price_cube
+from duck_pool import ConnectionManager
+from perf import span, start_run, end_run, perf_summary
+from query_cache import QueryCache, current_generation
 import config
 
-# connect to duckdb globally
-conn = ddb.connect(database=config.DB_FILE, read_only=True)
+@st.experimental_singleton
+def get_connection_manager():
+    """one read-only duckdb handle for all sessions, each script thread queries on its own cursor"""
+    manager = ConnectionManager(config.DB_FILE, read_only=True, idle_close=config.DB_IDLE_CLOSE)
+    manager.prepare('symbol_price', """SELECT prices.date, 
+                                prices.open, 
+                                prices.high,
+                                prices.low, 
+                                prices.close, 
+                                prices.volume,
+                                symbols.symbol, 
+                                symbols.name, 
+                                symbols.exchange 
+                        FROM prices JOIN symbols ON 
+                        (prices.stock_id=symbols.id)
+                        WHERE symbols.id = 
+                        (select id FROM symbols WHERE symbol=$1)""")
+    return manager
+
+# connect to duckdb globally, conn.execute() runs on this thread's cursor,
+# conn.release() at the end of the script lets the loaders open the database between reruns
+conn = get_connection_manager()
+
+@st.experimental_singleton
+def get_query_cache():
+    """query results shared by all sessions, dropped once the loader bumps the ingest generation"""
+    manager = get_connection_manager()
+    return QueryCache(config.CACHE_MAX_BYTES, lambda: current_generation(manager))
+
+cache = get_query_cache()
+
+@st.experimental_singleton
+def get_indicator_cache():
+    """vbt indicator outputs by (type, params, universe, output), dropped with the ingest generation"""
+    manager = get_connection_manager()
+    return QueryCache(config.INDICATOR_CACHE_BYTES, lambda: current_generation(manager))
+
+indicator_cache = get_indicator_cache()
+
+@st.experimental_singleton
+def get_results_connection():
+    """writable duckdb for backtest results, separate from the read-only prices database"""
+    return ConnectionManager(config.RESULTS_DB_FILE or ':memory:', read_only=False)
+
+results_conn = get_results_connection()
 
 # streamlit stuff starts
 st.sidebar.title("Options")
 option = st.sidebar.selectbox("Which Dashboard?", ('twitter', 'wallstreetbets','stocktwits', 'chart', 'pattern', 'TA scanner', 'Backtester'),5 )
 st.title(option)
+# every stage below runs in a timing span of this rerun, the perf panel at the end shows them
+start_run(option)
+# the one generation read of this rerun, cached reads below run no duckdb query
+with span('generation'):
+    indicator_cache.check_generation(cache.check_generation())
+show_perf = st.sidebar.checkbox("perf", value=False)
+with st.sidebar.expander("connection pool / cache"):
+    st.json(conn.metrics())
+    st.json(cache.metrics())
+    st.json(indicator_cache.metrics())
 
 
 def close_conn(conn):
     """Close connection to duckdb"""
     conn.close()
 
-@st.experimental_memo
+@cache.memo
 def read_stocklist():
     """get list and dict{sym:id} of all stocks"""
     # symbols = []
     # stock_dict = {}
-    rows = conn.execute("SELECT symbols.symbol, symbols.id, symbols.name FROM symbols").fetchdf()
+    rows = frame_from_columns(fetch_columns(conn, "SELECT symbols.symbol, symbols.id, symbols.name FROM symbols"))
     # stock_dict = {e : rows['id'][i] for i,e in enumerate(rows['symbol'])}
     return rows
 
-@st.experimental_memo
+@cache.memo
 def get_all_prices(startday='2021-06-01'):
     start = pd.to_datetime(startday, format='%Y-%m-%d')
-    lmtprices = conn.execute("SELECT * FROM prices WHERE date > (?)",[start]).fetch_df()
+    lmtprices = frame_from_columns(fetch_columns(conn, "SELECT * FROM prices WHERE date > (?)",[start]))
     return lmtprices
 
-@st.experimental_memo
 def get_data_from_duck(startday='2021-06-01'):
     symbols = read_stocklist()
     prices = get_all_prices(startday)
     return symbols, prices
 
-@st.experimental_memo
+@cache.memo
 def get_symbol_price(symbol):
-    df = conn.execute("""SELECT prices.date, 
-                                prices.open, 
-                                prices.high,
-                                prices.low, 
-                                prices.close, 
-                                prices.volume,
-                                symbols.symbol, 
-                                symbols.name, 
-                                symbols.exchange 
-                        FROM prices JOIN symbols ON 
-                        (prices.stock_id=symbols.id)
-                        WHERE symbols.id = 
-                        (select id FROM symbols WHERE symbol=?) 
-                        """,[symbol]).fetchdf()
+    cols = conn.execute_prepared('symbol_price', [symbol]).fetchnumpy()
+    return frame_from_columns(cols)
+
+@cache.memo
+def get_latest_signals(bullish=True):
+    """materialised pattern signals of the latest price date, one row per symbol; empty when that date has no signals
+    (patterns not yet computed after the last ingest), so an older signal date never shows as today"""
+    df = conn.execute(f"""SELECT ps.date, 
+                                 symbols.symbol, 
+                                 symbols.name, 
+                                 string_agg(ps.pattern, ', ') AS patterns, 
+                                 count(*) AS num_patterns
+                          FROM pattern_signals ps JOIN symbols ON 
+                          (ps.stock_id = symbols.id)
+                          WHERE ps.date = (SELECT MAX(date) FROM prices) 
+                          AND ps.signal {'>' if bullish else '<'} 0
+                          GROUP BY ps.date, symbols.symbol, symbols.name
+                          ORDER BY num_patterns DESC, symbols.symbol""").fetchdf()
     return df
 
 def twitter_connect():
@@ -102,51 +172,45 @@ def draw_candles(df):
                         height=700)
     return fig
 
-@st.experimental_memo
-def pivot_prices_c(prices):
-    """df format needed for all indicators"""
-    df = prices[['date','close','stock_id']]
-    df=df.pivot(index='date', columns='stock_id', values='close')
-    df.ffill(inplace=True)
-    return df
-
-@st.experimental_memo
-def pivot_prices_hl(prices):
-    """df format for atr, stoch"""
-    h,l = (prices[['date',val,'stock_id']] for val in ['high','low'])
-    dfh=h.pivot(index='date', columns='stock_id', values='high')
-    dfl=l.pivot(index='date', columns='stock_id', values='low')
-    dfh.ffill(inplace=True)
-    dfl.ffill(inplace=True)
-    return dfh,dfl
-
-@st.experimental_memo
-def pivot_prices_v(prices):
-    """df format for obv"""
-    df = prices[['date','volume','stock_id']]
-    df=df.pivot(index='date', columns='stock_id', values='volume')
-    df.ffill(inplace=True)
-    return df
-
-def vbt_run_indicator(df, name, params):
-    vbt_fn = getattr(vbt, name)
-    ranned = vbt_fn.run(df,**params)
-    return ranned
-
+@cache.memo
+def get_price_cube(version=None, startday=config.CUBE_START or None):
+    """dates x symbols OHLCV cube, shared (not copied) across reruns; every indicator input is a view into it.
+    With config.CUBE_DIR set the ingest job's exported version is memory mapped, without any duckdb query"""
+    if version is not None:
+        return open_cube(config.CUBE_DIR, version)
+    return price_cube(conn, FIELDS, startday=startday)
+
+@cache.memo
+def get_scan_cube(fields, bars):
+    """cube of only `fields` over the last `bars` trading days in prices (all since config.CUBE_START for bars=None),
+    the dates an exported cube covers"""
+    return price_cube(conn, fields, startday=config.CUBE_START or None, bars=bars)
+
+@cache.memo
+def get_indicator_state():
+    """running indicator state the ingest job keeps in config.INDICATOR_STATE, None if there is none"""
+    return load_state(config.INDICATOR_STATE)
+
+@cache.memo
+def get_long_prices(startday=config.CUBE_START or '1900-01-01'):
+    """arrow table of prices since config.CUBE_START sorted by (stock_id, date) with per symbol offsets, for pattern scans"""
+    return long_prices(conn, startday)
 
 #STOCKTWITS OPTION
 if option == 'stocktwits':
     symbol = st.sidebar.text_input("Symbol", value='AAPL', max_chars=5)
 
-    r = requests.get(f"https://api.stocktwits.com/api/2/streams/symbol/{symbol}.json")
-
-    data = r.json()
+    with span('stocktwits request') as s:
+        r = requests.get(f"{config.STOCKTWITS_URL or 'https://api.stocktwits.com/api/2/'}streams/symbol/{symbol}.json")
+        data = r.json()
+        s.measure(data['messages'])
 
-    for message in data['messages']:
-        st.image(message['user']['avatar_url'])
-        st.write(message['user']['username'])
-        st.write(message['created_at'])
-        st.write(message['body'])
+    with span('render'):
+        for message in data['messages']:
+            st.image(message['user']['avatar_url'])
+            st.write(message['user']['username'])
+            st.write(message['created_at'])
+            st.write(message['body'])
 
 # TWITTER OPTION
 if option == 'twitter':
@@ -210,20 +274,23 @@ if option == 'wallstreetbets':
 if option == 'chart':
     symbol = st.sidebar.text_input("Symbol", value='TSLA', max_chars=None, key=None, type='default').upper()
 
-    df = get_symbol_price(symbol)
+    with span('symbol prices', symbol) as s:
+        df = s.measure(get_symbol_price(symbol))
 
     st.subheader(symbol.upper())
     st.write(df['symbol'][0], df['name'][0], df['exchange'][0])
 
-    fig = draw_candles(df[['date','open','high','low','close','volume']][:100])
-    # fig.update_xaxes(type='category')
+    with span('render'):
+        fig = draw_candles(df[['date','open','high','low','close','volume']][:100])
+        # fig.update_xaxes(type='category')
 
-    st.plotly_chart(fig, use_container_width=True)
-    with st.expander("chart data", expanded=False):
-        st.dataframe(df)
+        st.plotly_chart(fig, use_container_width=True)
+        with st.expander("chart data", expanded=False):
+            st.dataframe(df)
 
 # PATTERN OPTION
 if option == 'pattern':
+    scan_mode = st.sidebar.radio("Scan for", ('selected pattern', 'any bullish pattern today', 'any bearish pattern today'))
     patvals = [p for p in patterns.keys()]
     # st.sidebar.write(patvals)
     pattern = st.sidebar.selectbox(
@@ -234,35 +301,38 @@ if option == 'pattern':
     pattern_function = getattr(talib, pattern)
     st.sidebar.write(pattern_function)
     
-    # get data from db
-    symbols = read_stocklist()
-    prices = get_all_prices()
-    
-    # scan all symbols by id with pattern
-    scan=[]
-    for i in symbols['id']:
-        try:
-            df = prices[prices["stock_id"]==i]
-            results = pattern_function(df['open'], df['high'], df['low'], df['close'])
-            last = results.tail(1).values[0]
-            if last !=0: scan.append((last, i))
-        except Exception as e:
-            print('failed on: ', i, e)
-    st.write("** NUMBER OF RESULTS: ",len(scan), "**")
-    if not scan: st.write("NO RESULTS")
+    if scan_mode != 'selected pattern':
+        # one indexed query over the signals materialised after ingest
+        with span('pattern signals') as s:
+            answer = s.measure(get_latest_signals(bullish=scan_mode == 'any bullish pattern today'))
+        st.write("** NUMBER OF RESULTS: ",len(answer), "**")
+        st.dataframe(answer)
     else:
-        scandf = pd.DataFrame(scan)
-        scandf.columns = ['signal', 'id']
-        answer = scandf.merge(symbols, how='left', on='id')
+        # get data from db
+        symbols = read_stocklist()
+        with span('long prices') as s:
+            table, ids, starts, ends = s.measure(get_long_prices())
+    
+        # scan trailing candles of all symbols with pattern, on zero-copy views of the arrow columns
+        with span('pattern scan', pattern) as s:
+            ohlc = tuple(column_array(table, c, np.float64) for c in ('open', 'high', 'low', 'close'))
+            scan = s.measure(scan_pattern(pattern, ohlc, ids, starts, ends))
+        st.write("** NUMBER OF RESULTS: ",len(scan), "**")
+        if not scan: st.write("NO RESULTS")
+        else:
+            scandf = pd.DataFrame(scan)
+            scandf.columns = ['signal', 'id']
+            answer = scandf.merge(symbols, how='left', on='id')
 
-        # # display result
-        st.dataframe(answer)
-        for index, row in answer.iterrows():
-            st.write(row['symbol'], row['signal'])
-            st.image(f"https://finviz.com/chart.ashx?t={row['symbol']}&ty=c&ta=1&p=d&s=l", caption='Sunrise by the mountains')
+            # # display result
+            with span('render'):
+                st.dataframe(answer)
+                for index, row in answer.iterrows():
+                    st.write(row['symbol'], row['signal'])
+                    st.image(f"https://finviz.com/chart.ashx?t={row['symbol']}&ty=c&ta=1&p=d&s=l", caption='Sunrise by the mountains')
 
-        # fig= draw_candles(row['df'])
-        # st.plotly_chart(fig) #, use_container_width=True)
+            # fig= draw_candles(row['df'])
+            # st.plotly_chart(fig) #, use_container_width=True)
 
 # TA SCREENER
 if option =='TA scanner':
@@ -270,8 +340,8 @@ if option =='TA scanner':
     st.sidebar.markdown("""<hr style="height:3px;background-color:#A07E06;" /> """, unsafe_allow_html=True)
 
     # get data from db
-    symbols, prices = get_data_from_duck()
-    dfc = pivot_prices_c(prices)
+    with span('stocklist') as s:
+        symbols = s.measure(read_stocklist())
 
     # Indicators setting    
     num_indicator = st.slider('How many indicators?', 1, 5, 1)
@@ -281,7 +351,6 @@ if option =='TA scanner':
         for num_i in range(num_indicator):
             st.markdown("""<hr style="height:1px;background-color:#3B903B;" /> """, unsafe_allow_html=True)
             name_val = f"indicator_{num_i+1}"
-            vbt_runame = f"vbtrun_{num_i+1}"
             select_val = st.selectbox(f"# {num_i+1} : Which Indicator?", indicts.keys(),2)#, key=f"indicator_{num_i+1}_type")
             params = indicts[select_val]['params'].copy()
             for p in params:
@@ -291,7 +360,7 @@ if option =='TA scanner':
                     params[p] = st.checkbox(f'{p}_{num_i}', value = params[p])#,key=f'indicator_{num_i+1}_params_{p}')
                 else:
                     params[p] = st.number_input(f'{p}_{num_i}', value = params[p])#,key=f'indicator_{num_i+1}_params_{p}')
-            tmp_indi[name_val] = {'type': select_val, 'params': params, 'vbt_runame': vbt_runame, 'df_set':''}
+            tmp_indi[name_val] = {'type': select_val, 'params': params}
 
     #List setted indicators
     with st.expander(f" You have {len(tmp_indi)} Indicators"):
@@ -334,100 +403,82 @@ if option =='TA scanner':
                     st.caption(f"{tmp_indi[condition_c1]['type']}, {tmp_indi[condition_c1]['params'][tuple(tmp_indi[condition_c1]['params'].keys())[0]]}")
                     condition_c2 = st.selectbox(f"# {num_c+1} : properties", indicts[tmp_indi[condition_c1]['type']]['props'])
                     condition_c3 = ''
-            if num_c:
-                condition_andor = st.checkbox(f'AND/OR_{num_c+1}',value=True)
-            else:
-                condition_andor = ''
+            col1, col2 = st.columns([1,2])
+            with col1:
+                condition_not = st.checkbox(f"# {num_c+1} Condition: NOT", value=False)
+            with col2:
+                # AND binds tighter than OR: a AND b OR c is (a AND b) OR c
+                condition_andor = st.selectbox(f"# {num_c+1} Condition: join with the rows above", ('AND', 'OR')) if num_c else ''
 
             tmp_condi[num_c] = {'a':condition_a,
                                 'b':condition_b,
                                 'c1': condition_c1,
                                 'c2': condition_c2,
                                 'c3': condition_c3,
-                                'd':condition_andor} #:TODO: radio for None, And, Or??
+                                'd':condition_andor,
+                                'not': condition_not}
 
     with st.expander(f"You have {len(tmp_condi)} scan conditions"):
         for i,c in tmp_condi.items():
-            st.write(i,c['d'],c['a'], c['b'], c['c1'], c['c2'], c['c3'])
-
-    # get unique list of indicators to set vbt run name
-    chk_indilst=[]
-    for i,cnd in tmp_condi.items():
-        chk_indilst.extend([cnd['a'],cnd['c1']])
-    chk_indiset = set(chk_indilst)
-    chk_indiset.discard('')
+            st.write(i,c['d'],'NOT' if c['not'] else '',c['a'], c['b'], c['c1'], c['c2'], c['c3'])
+
+    # compile the conditions once, the plan also names the indicators to run
+    try:
+        plan = compile_conditions({'scan': tmp_condi}, tmp_indi)
+    except ValueError as e:
+        st.error(e)
+        st.stop()
+    chk_indiset = plan.indicators
     st.write(chk_indiset)
-    # for i in chk_indiset: 
-    #     ii = i[-1]
-    #     tmp_indi[i]['vbt_runame']=f'vbtrun_{ii}'
-
-    # Scan order string
-    scanorder = ''
-    for i,cnd in tmp_condi.items():
-        if cnd['d']:
-            cond0 = '&' # TODO: modify to add OR |
-        else:
-            cond0 = ''
-        if cnd['c1']:
-            if cnd['c2']:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}.{cnd['c2']}"
+
+    # last bar: run the indicators only on the trailing bars that give the same latest values as the
+    # full history (exact for sma/std, within EWM_TOLERANCE for ewm), full history: every stored bar
+    scan_mode = st.sidebar.radio("Scan mode", ('last bar', 'full history'))
+    fields, bars = scan_requirements([(tmp_indi[i]['type'], tmp_indi[i]['params']) for i in chk_indiset], 
+                                     last_bars=plan.last_bars)
+    if scan_mode == 'full history': bars = None
+    state = get_indicator_state() if config.INDICATOR_STATE and scan_mode == 'last bar' else None
+    if state is not None and all(state.tracks(tmp_indi[i]['type'], tmp_indi[i]['params']) for i in chk_indiset):
+        # the ingest job keeps these indicators' running state, current values are lookups
+        stock_ids = pd.Index(state.stock_ids, name='stock_id')
+        scan_source = 'indicator state'
+        load = lambda indi, output: state.value(tmp_indi[indi]['type'], tmp_indi[indi]['params'], output)
+        st.caption(f"scan data: indicator state as of {state.last_date.date()} for {len(stock_ids)} symbols")
+    else:
+        with span('scan data', 'cube' if config.CUBE_DIR else 'duckdb') as s:
+            if config.CUBE_DIR:
+                cube = get_price_cube(current_cube_version(config.CUBE_DIR)).tail(bars)
             else:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}"
-        else:
-            condc = cnd['c3']
-        scanorder = scanorder + f"{cond0} {tmp_indi[cnd['a']]['vbt_runame']}.{cnd['b']}({condc}) "
-        
-        #({tmp_indi[cnd['c1']]['vbt_runame']}) "
-    scanorder = scanorder[1:]
-    
-    for i in chk_indiset:
-        if tmp_indi[i]['type'] in ['ATR', 'STOCH']:
-            dfh,dfl= pivot_prices_hl(prices)
-            tmp_indi[i]['df_set'] = 'dfh,dfl,dfc'
-        elif tmp_indi[i]['type'] == 'OBV':
-            dfv = pivot_prices_v(prices)
-            tmp_indi[i]['df_set'] = 'dfc, dfv'
-        else:
-            tmp_indi[i]['df_set'] = 'dfc'
+                cube = get_scan_cube(tuple(dict.fromkeys(['close', *fields])), bars)
+            s.measure(cube)
+        st.caption(f"scan data: {', '.join(cube.fields)} over {len(cube.dates)} bars x {len(cube.stock_ids)} symbols")
+        # vbt run ta on the scan, only for outputs not cached for this universe yet
+        stock_ids = cube.stock_ids
+        frames = {f: cube.frame(f) for f in cube.fields}
+        universe = ('scan', current_cube_version(config.CUBE_DIR) if config.CUBE_DIR else None, cube.fields, bars)
+        load = output_loader(indicator_cache, tmp_indi, frames, universe)
+        scan_source = scan_mode
 
     with st.expander('last checks'):
         st.write("last check of chk_indiset: ",chk_indiset)
-        st.write("last check of vbt run names: ",{tmp_indi[i]['vbt_runame'] for i in tmp_indi if tmp_indi[i]['vbt_runame']})
-        st.write("last check of scanorder: ",scanorder)
+        st.write("last check of scan plan: ",plan.describe())
 
     # Scan button
     submitted = st.button("Run Scan!")
     if submitted:
-        st.text("""Note to Self: Get extra df if needed, 
-            (eval) vbt_run the indicators, 
-            eval the entry expression""")
-
-        # vbt run ta
-        for indi in chk_indiset:
-            st.write(tmp_indi[indi]['vbt_runame'])
-            tmp_vbt_runame = tmp_indi[indi]['vbt_runame']
-            # st.write(f"{tmp_vbt_runame} = vbt.{tmp_indi[indi]['type']}.run({tmp_indi[indi]['df_set']},**{tmp_indi[indi]['params']})")
-            exec(f"{tmp_vbt_runame} = vbt.{tmp_indi[indi]['type']}.run({tmp_indi[indi]['df_set']},**{tmp_indi[indi]['params']})")
-        
-        st.write(f"entry = {scanorder}")
+        # one vectorised pass over the indicator outputs, dates x symbols, vbt runs show as indicator spans in it
+        with span('scan conditions', scan_source) as s:
+            entry = s.measure(plan.evaluate(load)['scan'])
 
-        entry = eval(scanorder)
-        # st.write(entry.shape)
-
-        dropcols = list(entry.columns.names)
-        st.write(dropcols)
-        dropcols.remove('stock_id')
-        st.write(dropcols)
-        # dropcols = list(range(len(dropcols)))
-
-        en = entry.droplevel(dropcols, axis=1).iloc[-1]
-        en=pd.DataFrame(en[en].index)
-        en = en.rename(columns={'stock_id': 'id'})
+        # a cube keeps symbols without bars in the scanned dates forward filled, they are not scanned
+        hits = entry[-1] & cube.valid.any(axis=0) if scan_source != 'indicator state' else entry[-1]
+        en = pd.DataFrame({'id': stock_ids[hits]})
         st.write(en.head())
 
         en = en.merge(symbols, how='left', on='id')
         st.write(en.shape)
-        st.dataframe(en)
+        with span('render') as s:
+            st.dataframe(s.measure(en))
 
         st.success('This is a success message!')
         st.balloons()
@@ -442,13 +493,22 @@ if option =='Backtester':
     st.sidebar.markdown("""<hr style="height:3px;background-color:#A07E06;" /> """, unsafe_allow_html=True)
 
     symbol_bt = st.sidebar.text_input("Symbol", value='TSLA', max_chars=None, key=None, type='default').upper()
+    universe = st.sidebar.checkbox("Universe backtest", value=False)
 
-    df_bt = get_symbol_price(symbol_bt)
-    df_bt.set_index('date', inplace=True)
+    # cached frames are shared, index a copy
+    with span('symbol prices', symbol_bt) as s:
+        df_bt = s.measure(get_symbol_price(symbol_bt).set_index('date'))
 
     st.subheader(symbol_bt.upper())
     st.write(df_bt['symbol'][0], df_bt['name'][0], df_bt['exchange'][0])
 
+    # parameter sweep: ranges like 5:200:5 or 20,25,30 on indicator params and manual numbers,
+    # every combination is backtested in one broadcast vectorbt run
+    sweep = st.sidebar.checkbox("Parameter sweep", value=False)
+    sweep_axes = {}
+    # manual number rows with a sweep range: their threshold becomes '$entry_N' / '$exit_N'
+    sweep_rows = {'entries': {}, 'exits': {}}
+
     st.markdown("""<hr style="height:3px;background-color:#A07E06;" /> """, unsafe_allow_html=True)
     # Indicators setting    
     num_indicator = st.slider('How many indicators?', 1, 5, 1)
@@ -458,7 +518,6 @@ if option =='Backtester':
         for num_i in range(num_indicator):
             st.markdown("""<hr style="height:1px;background-color:#3B903B;" /> """, unsafe_allow_html=True)
             name_val = f"indicator_{num_i+1}"
-            vbt_runame = f"vbtrun_{num_i+1}"
             select_val = st.selectbox(f"# {num_i+1} : Which Indicator?", indicts.keys(),2)#, key=f"indicator_{num_i+1}_type")
             params = indicts[select_val]['params'].copy()
             for p in params:
@@ -468,7 +527,10 @@ if option =='Backtester':
                     params[p] = st.checkbox(f'{p}_{num_i}', value = params[p])#,key=f'indicator_{num_i+1}_params_{p}')
                 else:
                     params[p] = st.number_input(f'{p}_{num_i}', value = params[p])#,key=f'indicator_{num_i+1}_params_{p}')
-            tmp_indi[name_val] = {'type': select_val, 'params': params, 'vbt_runame': vbt_runame, 'df_set':''}
+                    if sweep:
+                        values = parse_range(st.text_input(f'{p}_{num_i} sweep range', value=''), type(indicts[select_val]['params'][p]))
+                        if values: sweep_axes[f'{name_val}.{p}'] = values
+            tmp_indi[name_val] = {'type': select_val, 'params': params}
 
     #List setted indicators
     with st.expander(f" You have {len(tmp_indi)} Indicators"):
@@ -507,27 +569,34 @@ if option =='Backtester':
                     condition_c1 = ''
                     condition_c2 = ''
                     condition_c3 = st.number_input('give your best number')
+                    values = parse_range(st.text_input(f"# {num_c+1} Entry: sweep range", value='')) if sweep else None
+                    if values:
+                        sweep_rows['entries'][num_c] = f'$entry_{num_c+1}'
+                        sweep_axes[f'$entry_{num_c+1}'] = values
                 else:
                     condition_c1 = st.selectbox(f"# {num_c+1} Entry: Other Indicator (proprties)", tmp_indi.keys())
                     st.caption(f"{tmp_indi[condition_c1]['type']}, {tmp_indi[condition_c1]['params'][tuple(tmp_indi[condition_c1]['params'].keys())[0]]}")
                     condition_c2 = st.selectbox(f"# {num_c+1} : properties", indicts[tmp_indi[condition_c1]['type']]['props'])
                     condition_c3 = ''
-            if num_c:
-                condition_andor = st.checkbox(f'AND/OR_{num_c+1}',value=True)
-            else:
-                condition_andor = ''
+            col1, col2 = st.columns([1,2])
+            with col1:
+                condition_not = st.checkbox(f"# {num_c+1} Entry: NOT", value=False)
+            with col2:
+                # AND binds tighter than OR: a AND b OR c is (a AND b) OR c
+                condition_andor = st.selectbox(f"# {num_c+1} Entry: join with the rows above", ('AND', 'OR')) if num_c else ''
 
             tmp_entry[num_c] = {'a':condition_a,
                                 'b':condition_b,
                                 'c1': condition_c1,
                                 'c2': condition_c2,
                                 'c3': condition_c3,
-                                'd':condition_andor} #:TODO: radio for None, And, Or??
+                                'd':condition_andor,
+                                'not': condition_not}
 
     with st.expander(f"You have {len(tmp_entry)} entry conditions"):
         for i,c in tmp_entry.items():
             # st.write(i+1,' : ',c['d'],c['a'], c['b'], c['c1'], c['c2'], c['c3'])
-            st.text(f"{i+1} : {c['d']} {c['a']} {c['b']} {c['c1']} {c['c2']} {c['c3']}")
+            st.text(f"{i+1} : {c['d']} {'NOT ' if c['not'] else ''}{c['a']} {c['b']} {c['c1']} {c['c2']} {c['c3']}")
 
     # Exit Conditions
     num_exit = st.slider('How many exit conditions?', 1, 5, 1)
@@ -555,187 +624,234 @@ if option =='Backtester':
                     condition_c1 = ''
                     condition_c2 = ''
                     condition_c3 = st.number_input('give your best number')
+                    values = parse_range(st.text_input(f"# {num_c+1} Exit: sweep range", value='')) if sweep else None
+                    if values:
+                        sweep_rows['exits'][num_c] = f'$exit_{num_c+1}'
+                        sweep_axes[f'$exit_{num_c+1}'] = values
                 else:
                     condition_c1 = st.selectbox(f"# {num_c+1} : Other Indicator (proprties)", tmp_indi.keys())
                     st.caption(f"{tmp_indi[condition_c1]['type']}, {tmp_indi[condition_c1]['params'][tuple(tmp_indi[condition_c1]['params'].keys())[0]]}")
                     condition_c2 = st.selectbox(f"# {num_c+1} : properties", indicts[tmp_indi[condition_c1]['type']]['props'])
                     condition_c3 = ''
-            if num_c:
-                condition_andor = st.checkbox(f'AND/OR_{num_c+1}',value=True)
-            else:
-                condition_andor = ''
+            col1, col2 = st.columns([1,2])
+            with col1:
+                condition_not = st.checkbox(f"# {num_c+1} Exit: NOT", value=False)
+            with col2:
+                # AND binds tighter than OR: a AND b OR c is (a AND b) OR c
+                condition_andor = st.selectbox(f"# {num_c+1} Exit: join with the rows above", ('AND', 'OR')) if num_c else ''
 
             tmp_exit[num_c] = {'a':condition_a,
                                 'b':condition_b,
                                 'c1': condition_c1,
                                 'c2': condition_c2,
                                 'c3': condition_c3,
-                                'd':condition_andor} #:TODO: radio for None, And, Or??
+                                'd':condition_andor,
+                                'not': condition_not}
 
     with st.expander(f"You have {len(tmp_exit)} exit conditions"):
         for i,c in tmp_exit.items():
             # st.write(i,c['d'],c['a'], c['b'], c['c1'], c['c2'], c['c3'])
-            st.text(f"{i+1} : {c['d']} {c['a']} {c['b']} {c['c1']} {c['c2']} {c['c3']}")
+            st.text(f"{i+1} : {c['d']} {'NOT ' if c['not'] else ''}{c['a']} {c['b']} {c['c1']} {c['c2']} {c['c3']}")
 
-    # get unique list of indicators to set vbt run name,
-    chk_indilst=[]
-    for i,cnd in tmp_entry.items(): chk_indilst.extend([cnd['a'],cnd['c1']])
-    for i,cnd in tmp_exit.items(): chk_indilst.extend([cnd['a'],cnd['c1']])
-    chk_indiset = set(chk_indilst)
-    chk_indiset.discard('')
-
-
-    # Entry order string
-    entryorder = ''
-    for i,cnd in tmp_entry.items():
-        if cnd['d']:
-            cond0 = '&' # TODO: modify to add OR |
-        else:
-            cond0 = ''
-        if cnd['c1']:
-            if cnd['c2']:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}.{cnd['c2']}"
-            else:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}"
-        else:
-            condc = cnd['c3']
-        entryorder = entryorder + f"{cond0} {tmp_indi[cnd['a']]['vbt_runame']}.{cnd['b']}({condc}) "
-    entryorder = entryorder[1:]
-    
-    # Exit order string
-    exitorder = ''
-    for i,cnd in tmp_exit.items():
-        if cnd['d']:
-            cond0 = '&' # TODO: modify to add OR |
-        else:
-            cond0 = ''
-        if cnd['c1']:
-            if cnd['c2']:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}.{cnd['c2']}"
-            else:
-                condc = f"{tmp_indi[cnd['c1']]['vbt_runame']}"
-        else:
-            condc = cnd['c3']
-        exitorder = exitorder + f"{cond0} {tmp_indi[cnd['a']]['vbt_runame']}.{cnd['b']}({condc}) "
-    exitorder = exitorder[1:]
+    # entries and exits compile into one plan, so shared conditions are evaluated once
+    roots_bt = {'entries': tmp_entry, 'exits': tmp_exit}
+    try:
+        plan = compile_conditions(roots_bt, tmp_indi)
+    except ValueError as e:
+        st.error(e)
+        st.stop()
+    chk_indiset = plan.indicators
 
     # set df form input
     dfc = df_bt['close']
-    for i in chk_indiset:
-        if tmp_indi[i]['type'] in ['ATR', 'STOCH']:
-            dfh,dfl= df_bt['high'], df_bt['low'] #pivot_prices_hl(df)
-            tmp_indi[i]['df_set'] = 'dfh,dfl,dfc'
-        elif tmp_indi[i]['type'] == 'OBV':
-            dfv = df_bt['volume'] #pivot_prices_v(df)
-            tmp_indi[i]['df_set'] = 'dfc, dfv'
-        else:
-            # dfc = df_bt['close']
-            tmp_indi[i]['df_set'] = 'dfc'
 
     with st.expander('last checks'):
         st.write("last check of chk_indiset: ",chk_indiset)
-        st.write("last check of vbt run names: ",{tmp_indi[i]['vbt_runame'] for i in tmp_indi if tmp_indi[i]['vbt_runame']})
-        st.write("last check of entryorder: ",entryorder)
-        st.write("last check of exitorder: ",exitorder)
+        st.write("last check of entry / exit plan: ",plan.describe())
+
+    # the same strategy over every symbol or a filtered subset, in blocks of symbols on a process pool
+    if universe:
+        symbols_u = read_stocklist()
+        pick = st.text_input("Universe symbols (comma separated, empty for all)", value='')
+        exchanges = st.multiselect("Universe exchanges (empty for all)",
+                                   sorted(conn.execute("SELECT DISTINCT exchange FROM symbols").fetchnumpy()['exchange']))
+        startday_u = st.date_input("Universe from", value=dt(2021, 6, 1))
+        stock_ids_u = universe_ids(conn, [s.strip().upper() for s in pick.split(',') if s.strip()], exchanges)
+        st.caption(f"universe: {len(stock_ids_u)} symbols")
+        # same strategy, universe and ingest generation: the stored run. The universe is its sorted ids,
+        # so symbol order, spacing and case in pick don't make a new run
+        run_id = strategy_key(('universe', tuple(sorted({int(i) for i in stock_ids_u})), str(startday_u)), tmp_indi,
+                              roots_bt, longorshort, cache.current)
+        if st.button("Run Universe Backtest!"):
+            with span('stored universe') as s:
+                stats_u = s.measure(stored_universe(results_conn.cursor(), run_id))
+            if len(stats_u):
+                st.caption(f"stored universe run {run_id}")
+            else:
+                bar = st.progress(0.0)
+                with span('universe backtest', f"{len(stock_ids_u)} symbols") as s:
+                    stats_u = s.measure(universe_backtest(conn, tmp_indi, plan, stock_ids_u, startday_u, long=longorshort,
+                                                          results=results_conn.cursor(), run_id=run_id, progress=bar.progress))
+            stats_u = stats_u.merge(symbols_u, how='left', left_on='stock_id', right_on='id').drop(columns='id')
+            st.write(f"run {run_id}: {len(stats_u)} symbols, median return {stats_u['total_return'].median():.2f}%, "
+                     f"{(stats_u['total_return'] > 0).mean() * 100:.0f}% profitable, "
+                     f"{(stats_u['total_return'] > stats_u['buy_hold_return']).mean() * 100:.0f}% beat buy and hold")
+            st.dataframe(stats_u.sort_values('total_return', ascending=False))
+
+    # only axes the plan reads are swept
+    sweep_axes = {k: v for k, v in sweep_axes.items() if k.startswith('$') or k.split('.')[0] in chk_indiset}
+    sweep_plan = compile_conditions({name: {n: {**c, 'c3': sweep_rows[name].get(n, c['c3'])} for n, c in rows.items()}
+                                     for name, rows in (('entries', tmp_entry), ('exits', tmp_exit))}, tmp_indi)
+    if sweep and not sweep_axes:
+        st.warning("no sweep ranges set, give an indicator param or a manual number a range like 5:200:5")
+    if sweep and sweep_axes:
+        n_combos = int(np.prod([len(v) for v in sweep_axes.values()]))
+        st.caption(f"sweep: {n_combos} combinations over {', '.join(sweep_axes)}")
+        sweep_key = (symbol_bt, longorshort, repr(sweep_plan.describe()), repr(tmp_indi), repr(sweep_axes))
+        if st.button("Run Sweep!"):
+            bar = st.progress(0.0)
+            with span('parameter sweep', f"{n_combos} combinations") as s:
+                results = s.measure(run_sweep(df_bt, tmp_indi, sweep_plan, sweep_axes, long=longorshort, progress=bar.progress))
+            st.session_state['sweep'] = (sweep_key, results)
+        if st.session_state.get('sweep', (None,))[0] == sweep_key:
+            results = st.session_state['sweep'][1]
+            metric = st.selectbox("Sweep metric", METRICS)
+            st.dataframe(results.sort_values(metric, ascending=metric == 'max_drawdown'))
+            labels = list(sweep_axes)
+            if len(labels) > 1:
+                col1, col2 = st.columns(2)
+                x = col1.selectbox("Heatmap x", labels, 0)
+                y = col2.selectbox("Heatmap y", [l for l in labels if l != x], 0)
+                hm = heatmap_frame(results, x, y, metric)
+                fig = go.Figure(go.Heatmap(z=hm.values, x=hm.columns, y=hm.index, colorbar={'title': metric}))
+                fig.update_layout(xaxis_title=x, yaxis_title=y)
+            else:
+                fig = go.Figure(go.Scatter(x=results[labels[0]], y=results[metric], mode='lines+markers'))
+                fig.update_layout(xaxis_title=labels[0], yaxis_title=metric)
+            st.plotly_chart(fig, use_container_width=True)
+
+        # walk-forward: best combination of each rolling train window traded on the test window after it
+        with st.expander("Walk-forward"):
+            col1, col2, col3 = st.columns(3)
+            wf_train = col1.number_input("train bars", min_value=20, value=min(500, max(20, len(df_bt) // 2)))
+            wf_test = col2.number_input("test bars", min_value=5, value=100)
+            wf_metric = col3.selectbox("optimise", [m for m in METRICS if m not in ('trades', 'final_value')])
+            if st.button("Run Walk-forward!"):
+                bar = st.progress(0.0)
+                try:
+                    with span('walk-forward', f"{n_combos} combinations") as s:
+                        wf_stats, wf_equity = s.measure(walk_forward(df_bt, tmp_indi, sweep_plan, sweep_axes, int(wf_train),
+                                                                     int(wf_test), metric=wf_metric, long=longorshort,
+                                                                     progress=bar.progress))
+                except ValueError as e:
+                    st.error(e)
+                    st.stop()
+                st.write(f"out of sample return {(wf_equity.iloc[-1] - 1) * 100:.2f}% over {len(wf_stats)} windows, "
+                         f"{(~wf_stats['traded']).sum()} left in cash as no combination traded in their train bars")
+                st.dataframe(wf_stats)
+                hold = dfc.loc[wf_equity.index]
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(x=wf_equity.index, y=wf_equity.values, name='walk-forward'))
+                fig.add_trace(go.Scatter(x=hold.index, y=hold.values / hold.iloc[0], name='buy and hold'))
+                for t in wf_stats['test_start']:
+                    fig.add_vline(x=t, line={'color': 'gray', 'dash': 'dot', 'width': 1})
+                st.plotly_chart(fig, use_container_width=True)
+
+    # results are stored under the strategy hash, a repeated or shared setup loads them instead of rerunning
+    spec_bt = canonical_strategy(symbol_bt, tmp_indi, roots_bt, longorshort, frame_version(df_bt))
+    key_bt = strategy_key(symbol_bt, tmp_indi, roots_bt, longorshort, frame_version(df_bt))
+    with st.expander("Stored backtests"):
+        st.caption(f"this strategy: {key_bt}")
+        all_symbols = st.checkbox("all symbols", value=False)
+        st.dataframe(stored_runs(results_conn.cursor(), None if all_symbols else symbol_bt))
 
     # Backtest button
     submitted = st.button("Run Backtest!")
     if submitted:
-        st.text("""Note to Self: 
-            (eval) vbt_run the indicators, 
-            eval the entry expression""")
-
-        # vbt run ta
-        for indi in chk_indiset:
-            st.write(tmp_indi[indi]['vbt_runame'])
-            tmp_vbt_runame = tmp_indi[indi]['vbt_runame']
-
-            # TODO, remove check for production
-            # st.write(f"{tmp_vbt_runame} = vbt.{tmp_indi[indi]['type']}.run({tmp_indi[indi]['df_set']},**{tmp_indi[indi]['params']})")
-
-            exec(f"{tmp_vbt_runame} = vbt.{tmp_indi[indi]['type']}.run({tmp_indi[indi]['df_set']},**{tmp_indi[indi]['params']})")
-        
-        st.write(f"entry = {entryorder}")
-        entries = eval(entryorder)
-
-        st.write(f"exits = {exitorder}")
-        exits = eval(exitorder)
-
-        # Portfolio stuff
-        if longorshort:
-            Portfolio = vbt.Portfolio.from_signals(dfc, entries, exits)
+        with span('load result'):
+            result = load_result(results_conn.cursor(), key_bt)
+        if result is not None:
+            st.caption(f"stored result of {result['created']:%Y-%m-%d %H:%M}, strategy {key_bt}")
         else:
-            Portfolio = vbt.Portfolio.from_signals(dfc, short_entries=entries, short_exits=exits)
+            # vbt run ta, only for outputs not cached for this symbol yet
+            with span('backtest conditions', symbol_bt) as s:
+                signals = s.measure(plan.evaluate(output_loader(indicator_cache, tmp_indi, df_bt, ('symbol', symbol_bt))))
+            entries = pd.Series(signals['entries'], index=dfc.index)
+            exits = pd.Series(signals['exits'], index=dfc.index)
+
+            # Portfolio stuff
+            with span('portfolio', symbol_bt) as s:
+                if longorshort:
+                    Portfolio = vbt.Portfolio.from_signals(dfc, entries, exits)
+                else:
+                    Portfolio = vbt.Portfolio.from_signals(dfc, short_entries=entries, short_exits=exits)
+                result = portfolio_result(Portfolio)
+                s.measure(result['trades'])
+            with span('save result'):
+                save_result(results_conn.cursor(), key_bt, spec_bt, result)
         # st.dataframe(pd.DataFrame(Portfolio.stats()))
-        st.write(Portfolio.total_profit())
-        st.write(Portfolio.final_value())
-        pfstats = Portfolio.stats()
-        # ts = pd.Timestamp('2020-03-14T15:32:52.192548651')
-        pfstats[0] = pfstats[0].strftime('%Y-%m-%d')
-        pfstats[1] = pfstats[1].strftime('%Y-%m-%d')
-        # ts.strftime('%Y-%m-%d %X')
-        # pfstats = pd.DataFrame(pfstats).reset_index()
-        pfstats = pfstats.to_dict()
+        pfstats = result['stats']
+        st.write(pfstats['End Value'] - pfstats['Start Value'])
+        st.write(pfstats['End Value'])
 
         with st.expander("Portfolio Stats"):
             for k,v in pfstats.items(): st.write(k," : ",v)
 
 
-        st.text('PLots')
-
-        closes = Portfolio.close
-        buys = Portfolio.orders.records_readable[Portfolio.orders.records_readable['Side']=='Buy']
-        sells = Portfolio.orders.records_readable[Portfolio.orders.records_readable['Side']=='Sell']
-        fig1 = go.Figure()
-
-        fig1.add_trace(go.Scatter(x=closes.index, y=closes.values, name='closes'))
-        fig1.add_trace(go.Scatter(mode='markers',x=buys['Timestamp'], y=buys['Price'], name="buys", 
-                                marker={"symbol":'triangle-up', "color":'forestgreen', "size":11}))
-        fig1.add_trace(go.Scatter(mode='markers',x=sells['Timestamp'], y=sells['Price'], name="sells", 
-                                marker={"symbol":'triangle-down', "color":'red', "size":11}))
-        # fig1.show()
-
-        st.plotly_chart(fig1, use_container_width=True)
-        # fig1.show()
-
-        trades = Portfolio.trades.records_readable
-        fig2 = go.Figure()
-        fig2.add_shape(dict(
-            type= 'line',
-            xref= 'paper', x0= 0, x1= 1,
-            yref= 'y', y0= 0, y1= 0,
-            line={'color':'gray', 'dash':'dash'}))
-        fig2.add_trace(go.Scatter(mode='markers',name="Profit",
-                                x=trades['Exit Timestamp'], y=trades[trades['Return']>0]['Return'],
-                                marker={"symbol":'circle', 
-                                        "color":'green',
-                                        "size": 15}))#trades[trades['Return']>0]['Return']*15}))
-        fig2.add_trace(go.Scatter(mode='markers',name="Loss",
-                                x=trades['Exit Timestamp'], y=trades[trades['Return']<0]['Return'],
-                                marker={"symbol":'circle', 
-                                        "color":'red',
-                                        'size':15}))#abs(trades[trades['Return']>0]['Return'])*15}))
-
-        st.plotly_chart(fig2, use_container_width=True)    
-        # fig2.show()
-
-        Portfolio.cumulative_returns()
-        pfcum = Portfolio.cumulative_returns()
-        pfcum = pd.DataFrame(pfcum)
-        pfcumpos = pfcum[pfcum>=0]
-        pfcumneg = pfcum[pfcum<0]
-        bench = vbt.Portfolio.from_holding(dfc) #, init_cash=100)
-        bench = bench.cumulative_returns()
-        fig3 = go.Figure()
-
-        fig3.add_trace(go.Scatter(x=bench.index, y=bench.values, name='Benchmark',
-                                line=dict(color='darkblue')))
-        fig3.add_trace(go.Scatter(x=bench.index, y=pfcumpos[0], name="Cumulative Returns", opacity=0.5,
-                                fill='tozeroy', fillcolor='rgba(51, 204, 51,0.3)',line=dict(color='darkviolet')))
-        fig3.add_trace(go.Scatter(x=bench.index, y=pfcumneg[0], name="Cumulative Returns", opacity=0.5,
-                                fill='tozeroy', fillcolor='rgba(255, 153, 204,0.3)', line=dict(color='darkviolet')))
-        st.plotly_chart(fig3, use_container_width=True)  
-        # fig3.show()
+        with span('render'):
+            st.text('PLots')
+
+            closes = dfc
+            buys = result['orders'][result['orders']['side']=='Buy']
+            sells = result['orders'][result['orders']['side']=='Sell']
+            fig1 = go.Figure()
+
+            fig1.add_trace(go.Scatter(x=closes.index, y=closes.values, name='closes'))
+            fig1.add_trace(go.Scatter(mode='markers',x=buys['time'], y=buys['price'], name="buys", 
+                                    marker={"symbol":'triangle-up', "color":'forestgreen', "size":11}))
+            fig1.add_trace(go.Scatter(mode='markers',x=sells['time'], y=sells['price'], name="sells", 
+                                    marker={"symbol":'triangle-down', "color":'red', "size":11}))
+            # fig1.show()
+
+            st.plotly_chart(fig1, use_container_width=True)
+            # fig1.show()
+
+            trades = result['trades']
+            fig2 = go.Figure()
+            fig2.add_shape(dict(
+                type= 'line',
+                xref= 'paper', x0= 0, x1= 1,
+                yref= 'y', y0= 0, y1= 0,
+                line={'color':'gray', 'dash':'dash'}))
+            fig2.add_trace(go.Scatter(mode='markers',name="Profit",
+                                    x=trades['exit_time'], y=trades[trades['trade_return']>0]['trade_return'],
+                                    marker={"symbol":'circle', 
+                                            "color":'green',
+                                            "size": 15}))#trades[trades['Return']>0]['Return']*15}))
+            fig2.add_trace(go.Scatter(mode='markers',name="Loss",
+                                    x=trades['exit_time'], y=trades[trades['trade_return']<0]['trade_return'],
+                                    marker={"symbol":'circle', 
+                                            "color":'red',
+                                            'size':15}))#abs(trades[trades['Return']>0]['Return'])*15}))
+
+            st.plotly_chart(fig2, use_container_width=True)    
+            # fig2.show()
+
+            pfcum = pd.DataFrame(result['equity'])
+            pfcumpos = pfcum[pfcum>=0]
+            pfcumneg = pfcum[pfcum<0]
+            bench = vbt.Portfolio.from_holding(dfc) #, init_cash=100)
+            bench = bench.cumulative_returns()
+            fig3 = go.Figure()
+
+            fig3.add_trace(go.Scatter(x=bench.index, y=bench.values, name='Benchmark',
+                                    line=dict(color='darkblue')))
+            fig3.add_trace(go.Scatter(x=bench.index, y=pfcumpos.iloc[:, 0], name="Cumulative Returns", opacity=0.5,
+                                    fill='tozeroy', fillcolor='rgba(51, 204, 51,0.3)',line=dict(color='darkviolet')))
+            fig3.add_trace(go.Scatter(x=bench.index, y=pfcumneg.iloc[:, 0], name="Cumulative Returns", opacity=0.5,
+                                    fill='tozeroy', fillcolor='rgba(255, 153, 204,0.3)', line=dict(color='darkviolet')))
+            st.plotly_chart(fig3, use_container_width=True)  
+            # fig3.show()
 
         st.success('This is a success message!')
         st.balloons()
@@ -744,3 +860,17 @@ if option =='Backtester':
     color = st.sidebar.color_picker('Pick A Color', '#00f900')
     st.sidebar.write('The current color is', color)
 
+
+# timings of this rerun's spans, appended to config.PERF_LOG, and p50/p95 per page and stage from that log
+spans = end_run()
+if show_perf:
+    with st.sidebar.expander("perf", expanded=True):
+        st.caption(f"{option}: {spans[-1]['ms']:,.0f} ms")
+        st.dataframe(pd.DataFrame(spans, columns=['stage', 'detail', 'ms', 'self_ms', 'rows', 'bytes', 'error']))
+        if config.PERF_LOG and os.path.exists(config.PERF_LOG):
+            summary = perf_summary(config.PERF_LOG)
+            st.caption("last 7 days")
+            st.dataframe(summary[summary['page'] == option].drop(columns='page'))
+
+# done with the prices database until the next rerun, the loaders can open it for writing meanwhile
+conn.release()
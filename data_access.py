@@ -0,0 +1,53 @@
+"""DuckDB results as Arrow tables and contiguous numpy buffers, skipping the pandas copy of fetchdf()"""
+import numpy as np
+import pandas as pd
+
+from pattern_scan import offsets_from_ids
+from price_cube import build_cube_columns
+
+
+def fetch_columns(conn, sql, params=None):
+    """query result as dict{column: numpy array}"""
+    return conn.execute(sql, params or []).fetchnumpy()
+
+
+def fetch_table(conn, sql, params=None):
+    """query result as a pyarrow Table"""
+    return conn.execute(sql, params or []).fetch_arrow_table()
+
+
+def column_array(table, name, dtype=None):
+    """contiguous numpy array of an arrow column, zero-copy for a single chunk without nulls"""
+    arr = table.column(name).to_numpy()
+    if dtype is not None: arr = arr.astype(dtype, copy=False)
+    return np.ascontiguousarray(arr)
+
+
+def frame_from_columns(cols, index=None):
+    """DataFrame over numpy columns, each column keeps its own buffer"""
+    df = pd.DataFrame(cols, copy=False)
+    return df.set_index(index) if index else df
+
+
+def long_prices(conn, startday, fields=('open', 'high', 'low', 'close')):
+    """prices since startday ordered by (stock_id, date) as an arrow table,
+    with the table's stock ids and their [start, end) row offsets"""
+    table = fetch_table(conn, f"""SELECT stock_id, date, {', '.join(fields)} FROM prices 
+                                  WHERE date > ? ORDER BY stock_id, date""", [pd.Timestamp(startday)])
+    return (table, *offsets_from_ids(column_array(table, 'stock_id')))
+
+
+def price_cube(conn, fields, startday=None, bars=None, dtype=np.float64):
+    """PriceCube of `fields` since startday and/or over the last `bars` trading days (all history if neither)"""
+    cols = ', '.join(fields)
+    if bars is not None:
+        since, params = ("AND date > ?", [pd.Timestamp(startday)]) if startday is not None else ("", [])
+        sql = f"""SELECT date, stock_id, {cols} FROM prices WHERE date >= (
+                  SELECT MIN(date) FROM (SELECT DISTINCT date FROM prices 
+                      WHERE date > (SELECT MAX(date) FROM prices) - INTERVAL {2 * bars + 30} DAY
+                      ORDER BY date DESC LIMIT {bars})) {since}"""
+        return build_cube_columns(fetch_columns(conn, sql, params), dtype=dtype)
+    if startday is not None:
+        sql = f"SELECT date, stock_id, {cols} FROM prices WHERE date > ?"
+        return build_cube_columns(fetch_columns(conn, sql, [pd.Timestamp(startday)]), dtype=dtype)
+    return build_cube_columns(fetch_columns(conn, f"SELECT date, stock_id, {cols} FROM prices"), dtype=dtype)
@@ -0,0 +1,138 @@
+"""One shared DuckDB database handle, a cursor per thread and per-cursor prepared statements.
+
+Streamlit runs every session's script on its own thread. Cursors of one handle are separate
+connections to the same database, so queries of different sessions run in parallel instead of
+queueing on (or racing over) a single module level connection.
+
+Even a read-only handle holds the database file's lock, which keeps the loaders from opening it for
+writing. With idle_close set the handle is closed once no live thread uses it (release() at the end
+of a rerun, or after idle_close seconds for reruns that stopped early) and reopened on the next
+query, so ingests get in between reruns and the next rerun sees their data."""
+import threading
+import time
+import weakref
+from datetime import date, datetime
+
+import duckdb as ddb
+
+
+def sql_literal(value):
+    """render a python value as a SQL literal, for EXECUTE of a prepared statement"""
+    if value is None: return 'NULL'
+    if isinstance(value, bool): return 'TRUE' if value else 'FALSE'
+    if isinstance(value, int): return str(int(value))
+    if isinstance(value, float): return repr(float(value))
+    if isinstance(value, datetime): return f"TIMESTAMP '{value.isoformat(sep=' ')}'"
+    if isinstance(value, date): return f"DATE '{value.isoformat()}'"
+    if hasattr(value, 'item'): return sql_literal(value.item())
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class ConnectionManager:
+    """Hands each thread its own cursor of one DuckDB handle.
+
+    Statements registered with prepare() are PREPAREd once on every cursor that runs them,
+    execute_prepared() then only binds and runs them. metrics() reports cursors, queries and time"""
+    def __init__(self, database, read_only=True, idle_close=None):
+        self.database = database
+        self.read_only = read_only
+        self.idle_close = idle_close
+        self.db = None
+        # bumped on every close, a thread's cursor of an older handle is reopened
+        self.epoch = 0
+        self.users = set()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.cursors = weakref.WeakSet()
+        self.stats = {'cursors': 0, 'queries': 0, 'prepared': 0, 'prepared_runs': 0, 'query_time': 0.0, 'max_query': 0.0,
+                      'opens': 0, 'closes': 0}
+        self._open()
+        if idle_close:
+            threading.Thread(target=self._close_idle, daemon=True).start()
+
+    def _open(self):
+        self.db = ddb.connect(database=self.database, read_only=self.read_only)
+        self.stats['opens'] += 1
+
+    def cursor(self):
+        """this thread's cursor, opened on first use (and on the first use after the handle was closed)"""
+        with self.lock:
+            self.users.add(threading.current_thread())
+            cur = getattr(self.local, 'cursor', None)
+            if cur is not None and self.local.epoch == self.epoch: return cur
+            if self.db is None: self._open()
+            cur = self.local.cursor = self.db.cursor()
+            self.local.epoch = self.epoch
+            self.local.prepared = set()
+            self.cursors.add(cur)
+            self.stats['cursors'] += 1
+        return cur
+
+    def _close_handle(self):
+        """close the handle if no live thread uses it, call with self.lock held"""
+        self.users = {t for t in self.users if t.is_alive()}
+        if self.users or self.db is None: return
+        self.db.close()
+        self.db = None
+        self.epoch += 1
+        self.stats['closes'] += 1
+
+    def release(self):
+        """this thread is done with its queries for now, with idle_close the handle closes once no thread uses it"""
+        with self.lock:
+            self.users.discard(threading.current_thread())
+            self.local.cursor = None
+            if self.idle_close: self._close_handle()
+
+    def _close_idle(self):
+        # threads that never called release() (a rerun stopped early) count until they exit
+        while True:
+            time.sleep(self.idle_close)
+            with self.lock:
+                self._close_handle()
+
+    def _timed(self, key, run):
+        t0 = time.perf_counter()
+        try:
+            return run()
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self.lock:
+                self.stats[key] += 1
+                self.stats['query_time'] += elapsed
+                self.stats['max_query'] = max(self.stats['max_query'], elapsed)
+
+    def execute(self, sql, params=None):
+        """run sql on this thread's cursor, returns the cursor for fetchall()/fetchnumpy()/..."""
+        cur = self.cursor()
+        return self._timed('queries', lambda: cur.execute(sql, params or []))
+
+    def prepare(self, name, sql):
+        """register a statement with $1, $2, ... parameters under name"""
+        self.statements[name] = sql
+
+    def execute_prepared(self, name, params=()):
+        cur = self.cursor()
+        if name not in self.local.prepared:
+            cur.execute(f"PREPARE {name} AS {self.statements[name]}")
+            self.local.prepared.add(name)
+            with self.lock:
+                self.stats['prepared'] += 1
+        args = ', '.join(sql_literal(p) for p in params)
+        return self._timed('prepared_runs', lambda: cur.execute(f"EXECUTE {name}({args})" if args else f"EXECUTE {name}"))
+
+    def metrics(self):
+        """pool counters plus the number of cursors still open and the mean query time in ms"""
+        with self.lock:
+            m = dict(self.stats)
+            m['open_cursors'] = len(self.cursors)
+        runs = m['queries'] + m['prepared_runs']
+        m['mean_query_ms'] = 1000 * m['query_time'] / runs if runs else 0.0
+        return m
+
+    def close(self):
+        with self.lock:
+            if self.db is not None: self.db.close()
+            self.db = None
+            self.epoch += 1
@@ -0,0 +1,107 @@
+import queue
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """block until `tokens` are available, then take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def call_with_retry(fn, *args, retries=3, backoff=1.0, max_backoff=30.0, bucket=None, **kwargs):
+    """call fn, retrying with jittered exponential backoff. Every attempt takes a token from bucket"""
+    for attempt in range(retries + 1):
+        if bucket is not None: bucket.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries: raise
+            delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"{e!r}: retry {attempt+1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class _Failed:
+    def __init__(self, exc):
+        self.exc = exc
+
+_DONE = object()
+
+
+def iter_fetched(jobs, fetch, workers=4, queue_size=8, bucket=None, retries=3, backoff=1.0, on_error=None,
+                 next_job=None):
+    """run fetch(job) for every job on `workers` threads and yield (job, result) as they complete.
+
+    Results go through a queue of at most `queue_size` items, so the workers stall instead of
+    piling up results while the consumer (the db writer) is busy. A job that still fails after
+    `retries` is passed to on_error(job, exc), or re-raised here when on_error is None.
+    For paged fetches, next_job(job, result) returns the follow-up job (or None), which the same
+    worker fetches before taking a new job, so pages of one job arrive in order."""
+    q = queue.Queue(maxsize=queue_size)
+    jobs = iter(jobs)
+    jobs_lock = threading.Lock()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker():
+        try:
+            while not stop.is_set():
+                with jobs_lock:
+                    job = next(jobs, _DONE)
+                if job is _DONE: break
+                while job is not None and not stop.is_set():
+                    try:
+                        result = call_with_retry(fetch, job, retries=retries, backoff=backoff, bucket=bucket)
+                    except Exception as e:
+                        result = _Failed(e)
+                    put((job, result))
+                    if next_job is None or isinstance(result, _Failed): break
+                    job = next_job(job, result)
+                    result = None
+        finally:
+            put(_DONE)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for t in threads: t.start()
+    running = len(threads)
+    try:
+        while running:
+            item = q.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            job, result = item
+            if isinstance(result, _Failed):
+                if on_error is None: raise result.exc
+                on_error(job, result.exc)
+                continue
+            yield job, result
+    finally:
+        stop.set()
+        for t in threads: t.join()
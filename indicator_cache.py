@@ -0,0 +1,40 @@
+"""vectorbt indicator outputs cached across scans and backtests.
+
+Outputs are keyed by (indicator type, canonical params, universe, output name) in a QueryCache,
+which also drops them when the ingest generation changes. Changing only a threshold in a
+condition then re-evaluates the comparison against the cached output instead of re-running
+the indicator over every symbol."""
+import vectorbt as vbt
+
+from perf import span
+from vbt_indicts import indicts, canonical_params, params_key
+
+
+def run_indicator(frames, name, params):
+    """run vbt indicator name on its input fields taken from frames=dict{field: frame or series}"""
+    return getattr(vbt, name).run(*[frames[f] for f in indicts[name]['inputs']], **canonical_params(name, params))
+
+
+def output_key(name, params, universe, output):
+    return ('indicator', name, params_key(name, params), universe, output)
+
+
+def output_loader(cache, indicators, frames, universe):
+    """load(indicator key, output) for ConditionPlan.evaluate.
+
+    universe names the frames (which symbols, dates and data version); outputs missing from cache
+    come from at most one vbt run per indicator. Returned arrays are shared and read-only"""
+    runs = {}
+
+    def compute(indi, output):
+        if indi not in runs:
+            with span('indicator', indicators[indi]['type']):
+                runs[indi] = run_indicator(frames, indicators[indi]['type'], indicators[indi]['params'])
+        values = getattr(runs[indi], output).to_numpy()
+        values.flags.writeable = False
+        return values
+
+    def load(indi, output):
+        name, params = indicators[indi]['type'], indicators[indi]['params']
+        return cache.get(output_key(name, params, universe, output), lambda: compute(indi, output))
+    return load
@@ -0,0 +1,319 @@
+"""Local stand-in for the market data APIs the loaders and the dashboard call, for offline load tests.
+
+    python mock_server.py --port 8900 --symbols 5000 --latency 0.05 --error-rate 0.01
+
+serves, from synthetic data:
+    Binance   /api/v3/time, ticker/price, klines       request weights, 429 then 418 bans like Binance
+    Alpaca    /v2/assets (list_assets)                 requests per minute per client, 429 above
+              /v1/bars/day (get_barset)                the bars benchmarks.fake_barset generates
+    Stocktwits /api/2/streams/symbol/<symbol>.json     requests per hour per client, 429 above
+    /metrics  responses by API and status
+
+Every request waits latency +- jitter seconds and fails with a 500/503 at error rate. Point the code
+at it in config.py: API_URL and DATA_URL = "http://127.0.0.1:8900", BINANCE_URL =
+"http://127.0.0.1:8900/api/v3/", STOCKTWITS_URL = "http://127.0.0.1:8900/api/2/"
+"""
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from benchmarks.fake_barset import EXCHANGES, FakeBarsetAPI, market_symbols
+from binrest import kline_weight
+
+
+INTERVAL_MS = {'1m': 60_000, '3m': 180_000, '5m': 300_000, '15m': 900_000, '30m': 1_800_000,
+               '1h': 3_600_000, '2h': 7_200_000, '4h': 14_400_000, '6h': 21_600_000, '8h': 28_800_000,
+               '12h': 43_200_000, '1d': 86_400_000, '3d': 259_200_000, '1w': 604_800_000, '1M': 2_592_000_000}
+SYMBOLS = ('BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'ADAUSDT', 'XRPUSDT', 'SOLUSDT', 'DOGEUSDT', 'DOTUSDT')
+# first candle served, 2017-08-17 like BTCUSDT
+LISTED_MS = 1_502_928_000_000
+
+
+def synthetic_klines(symbol, interval, start_ms, end_ms, limit):
+    """deterministic candles for symbol/interval with open times in [start_ms, end_ms]"""
+    step = INTERVAL_MS[interval]
+    first = max(start_ms, LISTED_MS)
+    first = -(-first // step) * step
+    last = min(end_ms, int(time.time() * 1000))
+    if last < first: return []
+    opens = np.arange(first, last + 1, step, dtype=np.int64)[:limit]
+    seed = zlib.crc32(symbol.encode()) % 1000
+    price = 100 + seed + 20 * np.sin(opens / 8.64e8 + seed) + 5 * np.sin(opens / 3.6e6)
+    close = price * (1 + 0.001 * np.cos(opens / 6e4))
+    high = np.maximum(price, close) * 1.002
+    low = np.minimum(price, close) * 0.998
+    volume = 10 + (opens // step) % 97
+    return [[int(t), f"{o:.2f}", f"{h:.2f}", f"{l:.2f}", f"{c:.2f}", f"{v:.4f}", int(t + step - 1),
+             f"{v * c:.4f}", int(v), f"{v / 2:.4f}", f"{v * c / 2:.4f}", "0"]
+            for t, o, h, l, c, v in zip(opens, price, high, low, close, volume)]
+
+
+class WeightLedger:
+    """per-client weight used in the current minute, with 429 and 418 bans like Binance"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = {}
+        self.banned_until = {}
+        self.lock = threading.Lock()
+        self.counts = {'ok': 0, '429': 0, '418': 0}
+
+    def charge(self, client, weight):
+        """return (status, used weight, retry_after seconds)"""
+        now = time.time()
+        minute = int(now // 60)
+        retry_after = int((minute + 1) * 60 - now) + 1
+        with self.lock:
+            if self.banned_until.get(client, 0) > now:
+                # still hammering during a 429 backoff escalates to an IP ban
+                self.banned_until[client] = now + 120
+                self.counts['418'] += 1
+                return 418, 0, 120
+            m, used = self.used.get(client, (minute, 0))
+            if m != minute: used = 0
+            used += weight
+            self.used[client] = (minute, used)
+            if used > self.limit:
+                self.banned_until[client] = now + retry_after
+                self.counts['429'] += 1
+                return 429, used, retry_after
+            self.counts['ok'] += 1
+            return 200, used, 0
+
+
+class RequestLimiter:
+    """per-client request count in fixed windows of `window` seconds, over `limit` is a 429"""
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.used = {}
+        self.lock = threading.Lock()
+
+    def charge(self, client):
+        """return (allowed, retry_after seconds)"""
+        now = time.time()
+        current = int(now // self.window)
+        with self.lock:
+            w, used = self.used.get(client, (current, 0))
+            if w != current: used = 0
+            self.used[client] = (current, used + 1)
+        if self.limit and used >= self.limit:
+            return False, int((current + 1) * self.window - now) + 1
+        return True, 0
+
+
+class Faults:
+    """injected latency and server errors, seeded so a load test can be repeated"""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        """(seconds to wait, error status or None) for one request"""
+        with self.lock:
+            wait = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            error = self.rng.choice((500, 503)) if self.rng.random() < self.error_rate else None
+        return wait, error
+
+
+def synthetic_assets(symbols):
+    """alpaca asset records, every 50th one not tradable so list filters have something to drop"""
+    return [{'id': f"{zlib.crc32(s.encode()):08x}-0000-4000-8000-{i:012x}", 'class': 'us_equity',
+             'exchange': EXCHANGES[i % len(EXCHANGES)], 'symbol': s, 'name': f"Synthetic {s} Inc.",
+             'status': 'active', 'tradable': i % 50 != 49, 'marginable': True, 'shortable': i % 3 != 0,
+             'easy_to_borrow': i % 3 != 0, 'fractionable': i % 2 == 0}
+            for i, s in enumerate(symbols)]
+
+
+def synthetic_messages(symbol, base_url, n=30):
+    """stocktwits stream messages for symbol, newest first, a new message every minute"""
+    now = int(time.time() // 60)
+    seed = zlib.crc32(symbol.encode())
+    messages = []
+    for k in range(n):
+        minute = now - k
+        h = zlib.crc32(f"{symbol}{minute}".encode())
+        sentiment = ('Bullish', 'Bearish', None)[h % 3]
+        messages.append({
+            'id': minute * 1000 + seed % 1000,
+            'body': f"${symbol} {('to the moon', 'looks heavy here', 'watching the open')[h % 3]} #{h % 97}",
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(minute * 60)),
+            'user': {'id': h % 100_000, 'username': f"trader{h % 100_000}", 'avatar_url': base_url + 'avatar.png'},
+            'entities': {'sentiment': {'basic': sentiment} if sentiment else None},
+        })
+    return messages
+
+
+# 1x1 png for the stocktwits avatars
+AVATAR = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    ledger = None
+    faults = None
+    limiters = None
+    assets = None
+    barsets = None
+    counts = None
+    lock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, api, status):
+        with self.lock:
+            self.counts[f"{api} {status}"] += 1
+
+    def send_json(self, status, data, headers=()):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers: self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def binance(self, path, q):
+        if path == 'time':
+            return 1, {'serverTime': int(time.time() * 1000)}
+        if path == 'ticker/price':
+            return 2, [{'symbol': s, 'price': synthetic_klines(s, '1m', 0, 2**62, 1)[-1][4]} for s in SYMBOLS]
+        if path == 'klines':
+            limit = min(int(q.get('limit', 500)), 1000)
+            symbol, interval = q.get('symbol'), q.get('interval')
+            if symbol not in SYMBOLS or interval not in INTERVAL_MS:
+                return 1, None
+            end_ms = int(q.get('endTime', int(time.time() * 1000)))
+            start_ms = int(q.get('startTime', end_ms - INTERVAL_MS[interval] * (limit - 1)))
+            return kline_weight(limit), synthetic_klines(symbol, interval, start_ms, end_ms, limit)
+        return 1, None
+
+    def do_binance(self, path, q):
+        weight, data = self.binance(path, q)
+        status, used, retry_after = self.ledger.charge(self.client_address[0], weight)
+        headers = [('X-MBX-USED-WEIGHT-1M', str(used))]
+        if status != 200:
+            headers.append(('Retry-After', str(retry_after)))
+            return status, {'code': -1003, 'msg': 'Too many requests'}, headers
+        if data is None:
+            return 400, {'code': -1121, 'msg': 'Invalid symbol.'}, headers
+        return 200, data, headers
+
+    def do_alpaca(self, path, q):
+        allowed, retry_after = self.limiters['alpaca'].charge(self.client_address[0])
+        if not allowed:
+            return 429, {'code': 42910000, 'message': 'rate limit exceeded'}, [('Retry-After', str(retry_after))]
+        if path == '/v2/assets':
+            status = q.get('status')
+            return 200, [a for a in self.assets if status in (None, a['status'])], ()
+        timeframe = path[len('/v1/bars/'):]
+        if timeframe not in ('day', '1D'):
+            return 422, {'code': 42210000, 'message': f'invalid timeframe {timeframe}'}, ()
+        symbols = [s for s in q.get('symbols', '').split(',') if s]
+        if not symbols or len(symbols) > 200:
+            return 422, {'code': 42210000, 'message': 'symbols must be 1 to 200 symbols'}, ()
+        barsets = self.barsets.get_barset(symbols, 'day', limit=min(int(q.get('limit', 100)), 1000),
+                                          start=q.get('start'), end=q.get('end'), after=q.get('after'), until=q.get('until'))
+        return 200, {s: [{'t': int(b.t.timestamp()), 'o': b.o, 'h': b.h, 'l': b.l, 'c': b.c, 'v': int(b.v)} for b in bars]
+                     for s, bars in barsets.items()}, ()
+
+    def do_stocktwits(self, symbol):
+        allowed, retry_after = self.limiters['stocktwits'].charge(self.client_address[0])
+        if not allowed:
+            return 429, {'response': {'status': 429}, 'errors': [{'message': 'Rate limit exceeded.'}]}, \
+                [('Retry-After', str(retry_after))]
+        base_url = f"http://{self.headers.get('Host', '127.0.0.1')}/"
+        return 200, {'response': {'status': 200},
+                     'symbol': {'id': zlib.crc32(symbol.encode()) % 100_000, 'symbol': symbol, 'title': f"Synthetic {symbol} Inc."},
+                     'cursor': {'more': True, 'since': 0, 'max': 0},
+                     'messages': synthetic_messages(symbol, base_url)}, ()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/metrics':
+            with self.lock:
+                return self.send_json(200, {'counts': dict(self.counts), 'binance': dict(self.ledger.counts)})
+        if url.path == '/avatar.png':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(AVATAR)))
+            self.end_headers()
+            return self.wfile.write(AVATAR)
+
+        stocktwits = re.fullmatch(r'/api/2/streams/symbol/([^/]+)\.json', url.path)
+        if url.path.startswith('/api/v3/'): api = 'binance'
+        elif url.path == '/v2/assets' or url.path.startswith('/v1/bars/'): api = 'alpaca'
+        elif stocktwits: api = 'stocktwits'
+        else:
+            self.count('unknown', 404)
+            return self.send_json(404, {'code': -1, 'msg': 'not found'})
+
+        wait, error = self.faults.draw()
+        if wait: time.sleep(wait)
+        if error:
+            self.count(api, error)
+            return self.send_json(error, {'code': error, 'message': 'injected server error'})
+        if api == 'binance': status, data, headers = self.do_binance(url.path[len('/api/v3/'):], q)
+        elif api == 'alpaca': status, data, headers = self.do_alpaca(url.path, q)
+        else: status, data, headers = self.do_stocktwits(stocktwits.group(1).upper())
+        self.count(api, status)
+        self.send_json(status, data, headers)
+
+
+def serve(port=8900, weight_limit=1200, latency=0.0, jitter=0.0, error_rate=0.0, alpaca_rate=200,
+          stocktwits_rate=200, symbols=1000, history=1000, seed=0):
+    """start the server on a background thread, return it (call .shutdown() to stop).
+    alpaca_rate is requests per minute, stocktwits_rate requests per hour, 0 for no limit"""
+    handler = type('Handler', (MockHandler,), {
+        'ledger': WeightLedger(weight_limit),
+        'faults': Faults(latency, jitter, error_rate, seed),
+        'limiters': {'alpaca': RequestLimiter(alpaca_rate, 60), 'stocktwits': RequestLimiter(stocktwits_rate, 3600)},
+        'assets': synthetic_assets(market_symbols(symbols)),
+        'barsets': FakeBarsetAPI(latency=0, history=history),
+        'counts': Counter(),
+        'lock': threading.Lock()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--weight-limit', type=int, default=1200, help="binance request weight per minute")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latency varies by +- jitter seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests failing with 500/503")
+    parser.add_argument('--alpaca-rate', type=int, default=200, help="alpaca requests per minute, 0 for no limit")
+    parser.add_argument('--stocktwits-rate', type=int, default=200, help="stocktwits requests per hour, 0 for no limit")
+    parser.add_argument('--symbols', type=int, default=1000, help="stocks list_assets returns")
+    parser.add_argument('--history', type=int, default=1000, help="daily bars per stock")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    server = serve(args.port, args.weight_limit, args.latency, args.jitter, args.error_rate, args.alpaca_rate,
+                   args.stocktwits_rate, args.symbols, args.history, args.seed)
+    print(f"mock market data on http://127.0.0.1:{args.port}, binance under /api/v3/, stocktwits under /api/2/")
+    try:
+        while True:
+            time.sleep(10)
+            with server.RequestHandlerClass.lock:
+                print(dict(server.RequestHandlerClass.counts))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
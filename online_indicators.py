@@ -0,0 +1,527 @@
+"""Per-symbol running indicator state, advanced one bar at a time after each ingest.
+
+Every indicator of vbt_indicts keeps just the state its next value needs: ring buffers for rolling
+windows, ewm accumulators, the previous bar, OBV totals. advance() takes one row of bars for all
+symbols in O(window) work per symbol, independent of the history length. The state lives in one .npz
+file, so the scanner looks current values up instead of re-running vectorbt over the history.
+Values follow vectorbt's definitions on the forward filled price cube.
+
+Bars that land at or before the state's last date (a failed chunk fetched later, a backfill, a
+symbol inserted with past dates) show up as a per-symbol bar count that differs from the prices
+table, those symbols are rebuilt from their history. Symbols without a bar for STALE_DAYS leave
+the state, so delisted symbols drop out of the scan instead of being forward filled forever.
+
+The state starts at config.CUBE_START like the scan cube, so a backfill of history before it costs
+nothing here. Only a date no symbol had before, inserted between the start and the last date, adds
+a forward filled step to every symbol listed before it and replays the state, over the cube's
+dates only."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from conditions import CROSS_BARS
+from data_access import price_cube, fetch_columns
+from price_cube import FIELDS, build_cube_columns
+from vbt_indicts import indicts, canonical_params, params_key
+
+
+# calendar days without a bar after which a symbol leaves the state
+STALE_DAYS = 10
+
+
+class Stream:
+    """running state over one value per symbol, kept in self.arrays (0-d arrays are shared by all symbols)"""
+    def __init__(self, n):
+        self.arrays = self.init(n)
+
+    def grow(self, n):
+        """append state for n new symbols"""
+        new = self.init(n)
+        for k, a in self.arrays.items():
+            if a.ndim: self.arrays[k] = np.concatenate([a, new[k]], axis=-1)
+
+    def keep(self, mask):
+        """drop the state of symbols where mask is False"""
+        for k, a in self.arrays.items():
+            if a.ndim: self.arrays[k] = a[..., mask]
+
+    def splice(self, cols, other, other_cols):
+        """copy the state of other's symbols other_cols over this stream's symbols cols"""
+        for k, a in self.arrays.items():
+            if a.ndim: a[..., cols] = other.arrays[k][..., other_cols]
+
+
+class Rolling(Stream):
+    """last `window` values; mean/std/min/max like vbt's rolling_*_nb with minp=window"""
+    def __init__(self, n, window):
+        self.window = int(window)
+        super().__init__(n)
+
+    def init(self, n):
+        return {'ring': np.full((self.window, n), np.nan), 'pos': np.zeros((), dtype=np.int64),
+                'sum': np.zeros(n), 'count': np.zeros(n, dtype=np.int64)}
+
+    def push(self, x):
+        a = self.arrays
+        pos = int(a['pos'])
+        old = a['ring'][pos]
+        gone, new = ~np.isnan(old), ~np.isnan(x)
+        a['sum'] += np.where(new, x, 0) - np.where(gone, old, 0)
+        a['count'] += new.astype(np.int64) - gone
+        a['ring'][pos] = x
+        a['pos'] = np.asarray((pos + 1) % self.window)
+        return self
+
+    def splice(self, cols, other, other_cols):
+        # ring rows are in push order starting at pos, line other's oldest row up with ours
+        shift = int(self.arrays['pos']) - int(other.arrays['pos'])
+        self.arrays['ring'][:, cols] = np.roll(other.arrays['ring'][:, other_cols], shift, axis=0)
+        for k in ('sum', 'count'): self.arrays[k][cols] = other.arrays[k][other_cols]
+
+    @property
+    def full(self):
+        return self.arrays['count'] >= self.window
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.full, self.arrays['sum'] / self.arrays['count'], np.nan)
+
+    def std(self):
+        return np.where(self.full, np.std(self.arrays['ring'], axis=0), np.nan)
+
+    def min(self):
+        return np.where(self.full, np.min(self.arrays['ring'], axis=0), np.nan)
+
+    def max(self):
+        return np.where(self.full, np.max(self.arrays['ring'], axis=0), np.nan)
+
+
+class Ewm(Stream):
+    """vbt's ewm_mean_1d_nb (adjust=False, minp=span), one step per push"""
+    def __init__(self, n, span):
+        self.span = int(span)
+        self.alpha = 2 / (self.span + 1)
+        super().__init__(n)
+
+    def init(self, n):
+        return {'avg': np.full(n, np.nan), 'old_wt': np.ones(n), 'nobs': np.zeros(n, dtype=np.int64)}
+
+    def push(self, x):
+        a = self.arrays
+        had, obs = ~np.isnan(a['avg']), ~np.isnan(x)
+        a['nobs'] += obs
+        a['old_wt'] = np.where(had, a['old_wt'] * (1 - self.alpha), a['old_wt'])
+        step = had & obs & (a['avg'] != x)
+        with np.errstate(invalid='ignore'):
+            avg = (a['old_wt'] * a['avg'] + self.alpha * x) / (a['old_wt'] + self.alpha)
+        a['avg'] = np.where(step, avg, np.where(~had & obs, x, a['avg']))
+        a['old_wt'] = np.where(had & obs, 1.0, a['old_wt'])
+        return self
+
+    def mean(self):
+        return np.where(self.arrays['nobs'] >= self.span, self.arrays['avg'], np.nan)
+
+
+class EwmStd(Stream):
+    """vbt's ewm_std_1d_nb (adjust=False, minp=span, ddof=0), one step per push"""
+    def __init__(self, n, span):
+        self.span = int(span)
+        self.alpha = 2 / (self.span + 1)
+        super().__init__(n)
+
+    def init(self, n):
+        return {'mean': np.full(n, np.nan), 'cov': np.zeros(n), 'sum_wt': np.ones(n), 'sum_wt2': np.ones(n),
+                'old_wt': np.ones(n), 'nobs': np.zeros(n, dtype=np.int64)}
+
+    def push(self, x):
+        a = self.arrays
+        f = 1 - self.alpha
+        had, obs = ~np.isnan(a['mean']), ~np.isnan(x)
+        a['nobs'] += obs
+        sum_wt = np.where(had, a['sum_wt'] * f, a['sum_wt'])
+        sum_wt2 = np.where(had, a['sum_wt2'] * f * f, a['sum_wt2'])
+        old_wt = np.where(had, a['old_wt'] * f, a['old_wt'])
+        upd = had & obs
+        with np.errstate(invalid='ignore'):
+            mean = np.where(a['mean'] != x, (old_wt * a['mean'] + self.alpha * x) / (old_wt + self.alpha), a['mean'])
+            cov = (old_wt * (a['cov'] + (a['mean'] - mean) ** 2) + self.alpha * (x - mean) ** 2) / (old_wt + self.alpha)
+        total = old_wt + self.alpha
+        a['cov'] = np.where(upd, cov, a['cov'])
+        a['sum_wt'] = np.where(upd, (sum_wt + self.alpha) / total, sum_wt)
+        a['sum_wt2'] = np.where(upd, (sum_wt2 + self.alpha ** 2) / total ** 2, sum_wt2)
+        a['old_wt'] = np.where(upd, 1.0, old_wt)
+        a['mean'] = np.where(upd, mean, np.where(~had & obs, x, a['mean']))
+        return self
+
+    def std(self):
+        a = self.arrays
+        num = a['sum_wt'] ** 2
+        den = num - a['sum_wt2']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = np.where((a['nobs'] >= self.span) & (den > 0), num / den * a['cov'], np.nan)
+        return np.sqrt(var)
+
+
+class Total(Stream):
+    """running sum, NaN adds nothing (vbt's nancumsum_nb)"""
+    def init(self, n):
+        return {'total': np.zeros(n)}
+
+    def push(self, x):
+        self.arrays['total'] += np.nan_to_num(x)
+        return self
+
+    def value(self):
+        return self.arrays['total'].copy()
+
+
+def moving_average(n, window, ewm):
+    return Ewm(n, window) if ewm else Rolling(n, window)
+
+
+def moving_std(n, window, ewm):
+    return EwmStd(n, window) if ewm else Rolling(n, window)
+
+
+# one class per vbt_indicts entry: streams() names its state, update(bar, prev) returns its outputs
+class MA:
+    def __init__(self, n, window, ewm, **_):
+        self.ma = moving_average(n, window, ewm)
+
+    def streams(self):
+        return {'ma': self.ma}
+
+    def update(self, bar, prev):
+        return {'ma': self.ma.push(bar['close']).mean()}
+
+
+class MSTD:
+    def __init__(self, n, window, ewm, **_):
+        self.mstd = moving_std(n, window, ewm)
+
+    def streams(self):
+        return {'mstd': self.mstd}
+
+    def update(self, bar, prev):
+        return {'mstd': self.mstd.push(bar['close']).std()}
+
+
+class BBANDS:
+    def __init__(self, n, window, ewm, alpha, **_):
+        self.alpha = alpha
+        self.ma = moving_average(n, window, ewm)
+        # the rolling std shares the mean's ring buffer
+        self.mstd = EwmStd(n, window) if ewm else self.ma
+
+    def streams(self):
+        return {'ma': self.ma, 'mstd': self.mstd} if self.mstd is not self.ma else {'ma': self.ma}
+
+    def update(self, bar, prev):
+        self.ma.push(bar['close'])
+        if self.mstd is not self.ma: self.mstd.push(bar['close'])
+        middle, std = self.ma.mean(), self.mstd.std()
+        upper, lower = middle + self.alpha * std, middle - self.alpha * std
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'middle': middle, 'upper': upper, 'lower': lower,
+                    'percent_b': (bar['close'] - lower) / (upper - lower), 'bandwidth': (upper - lower) / middle}
+
+
+class RSI:
+    def __init__(self, n, window, ewm, **_):
+        self.up = moving_average(n, window, ewm)
+        self.down = moving_average(n, window, ewm)
+
+    def streams(self):
+        return {'up': self.up, 'down': self.down}
+
+    def update(self, bar, prev):
+        delta = bar['close'] - prev['close']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            up = self.up.push(np.where(delta < 0, 0, delta)).mean()
+            down = self.down.push(np.abs(np.where(delta > 0, 0, delta))).mean()
+            return {'rsi': 100 - 100 / (1 + up / down)}
+
+
+class MACD:
+    def __init__(self, n, fast_window, slow_window, signal_window, macd_ewm, signal_ewm, **_):
+        self.fast = moving_average(n, fast_window, macd_ewm)
+        self.slow = moving_average(n, slow_window, macd_ewm)
+        self.signal = moving_average(n, signal_window, signal_ewm)
+
+    def streams(self):
+        return {'fast': self.fast, 'slow': self.slow, 'signal': self.signal}
+
+    def update(self, bar, prev):
+        macd = self.fast.push(bar['close']).mean() - self.slow.push(bar['close']).mean()
+        signal = self.signal.push(macd).mean()
+        return {'macd': macd, 'signal': signal, 'hist': macd - signal}
+
+
+class ATR:
+    def __init__(self, n, window, ewm, **_):
+        self.atr = moving_average(n, window, ewm)
+
+    def streams(self):
+        return {'atr': self.atr}
+
+    def update(self, bar, prev):
+        # max(tr1, tr2, tr3) the way python's max treats NaN: a NaN later term never wins
+        tr = bar['high'] - bar['low']
+        with np.errstate(invalid='ignore'):
+            for other in (np.abs(bar['high'] - prev['close']), np.abs(bar['low'] - prev['close'])):
+                tr = np.where(other > tr, other, tr)
+        return {'tr': tr, 'atr': self.atr.push(tr).mean()}
+
+
+class OBV:
+    def __init__(self, n, **_):
+        self.obv = Total(n)
+
+    def streams(self):
+        return {'obv': self.obv}
+
+    def update(self, bar, prev):
+        with np.errstate(invalid='ignore'):
+            signed = np.where(bar['close'] < prev['close'], -bar['volume'], bar['volume'])
+        return {'obv': self.obv.push(signed).value()}
+
+
+class STOCH:
+    def __init__(self, n, k_window, d_window, d_ewm, **_):
+        self.low = Rolling(n, k_window)
+        self.high = Rolling(n, k_window)
+        self.d = moving_average(n, d_window, d_ewm)
+
+    def streams(self):
+        return {'low': self.low, 'high': self.high, 'd': self.d}
+
+    def update(self, bar, prev):
+        low, high = self.low.push(bar['low']).min(), self.high.push(bar['high']).max()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent_k = 100 * (bar['close'] - low) / (high - low)
+        return {'percent_k': percent_k, 'percent_d': self.d.push(percent_k).mean()}
+
+
+INDICATORS = {'MA': MA, 'MSTD': MSTD, 'BBANDS': BBANDS, 'RSI': RSI, 'MACD': MACD, 'ATR': ATR, 'OBV': OBV, 'STOCH': STOCH}
+# every indicator at its vbt_indicts defaults
+DEFAULT_SPECS = tuple((name, spec['params']) for name, spec in indicts.items())
+
+
+def spec_key(name, params):
+    """'RSI(ewm=False,window=14)', the key of one indicator config in the state file"""
+    return f"{name}({','.join(f'{p}={v}' for p, v in params_key(name, params))})"
+
+
+class OnlineIndicators:
+    """Running state of several indicator configs over a growing set of symbols.
+
+    values[(spec key, output)] holds the newest CROSS_BARS values of every output (last row newest),
+    enough for the scanner's last bar comparisons including crossed_*. bars and last_bar count the
+    real (not forward filled) bars each symbol advanced through and the date of its newest one.
+    start is the day after which the state's history begins ('YYYY-MM-DD', None for all of prices)"""
+    def __init__(self, specs=DEFAULT_SPECS, stock_ids=(), start=None):
+        self.specs = [(name, canonical_params(name, params)) for name, params in specs]
+        self.start = start
+        self.stock_ids = np.asarray(stock_ids, dtype=np.int64)
+        self.last_date = None
+        n = len(self.stock_ids)
+        self.last = {f: np.full(n, np.nan) for f in FIELDS}
+        self.bars = np.zeros(n, dtype=np.int64)
+        self.last_bar = np.full(n, np.datetime64('NaT'), dtype='datetime64[D]')
+        # dates advanced through, one push per date for every symbol
+        self.steps = 0
+        self.names = {spec_key(name, params): name for name, params in self.specs}
+        self.indicators = {key: INDICATORS[name](n, **params) for (key, name), (_, params) in zip(self.names.items(), self.specs)}
+        self.values = {}
+
+    def tracks(self, name, params):
+        return spec_key(name, params) in self.indicators
+
+    def value(self, name, params, output):
+        """newest CROSS_BARS values of an output, shape (CROSS_BARS, symbols)"""
+        return self.values[(spec_key(name, params), output)]
+
+    def add_symbols(self, stock_ids):
+        new = np.setdiff1d(np.asarray(stock_ids, dtype=np.int64), self.stock_ids)
+        if not len(new): return
+        self.stock_ids = np.concatenate([self.stock_ids, new])
+        for f in FIELDS: self.last[f] = np.concatenate([self.last[f], np.full(len(new), np.nan)])
+        self.bars = np.concatenate([self.bars, np.zeros(len(new), dtype=np.int64)])
+        self.last_bar = np.concatenate([self.last_bar, np.full(len(new), np.datetime64('NaT'), dtype='datetime64[D]')])
+        for ind in self.indicators.values():
+            for stream in ind.streams().values(): stream.grow(len(new))
+        for k, v in self.values.items():
+            self.values[k] = np.concatenate([v, np.full((CROSS_BARS, len(new)), np.nan)], axis=1)
+
+    def advance(self, date, bar, present=None):
+        """one bar per symbol, bar=dict{field: array aligned with stock_ids}, NaN where a symbol has no bar.
+        present marks the symbols with a bar (default: close is not NaN)"""
+        if present is None: present = ~np.isnan(bar['close'])
+        self.bars += present
+        self.last_bar[present] = np.datetime64(pd.Timestamp(date).date(), 'D')
+        prev = self.last
+        bar = {f: np.where(np.isnan(bar[f]), prev[f], bar[f]) if f in bar else prev[f] for f in FIELDS}
+        self.last = bar
+        for key, ind in self.indicators.items():
+            outputs = ind.update(bar, prev)
+            for f in indicts[self.names[key]]['inputs']: outputs[f] = bar[f]
+            for output, v in outputs.items():
+                hist = self.values.get((key, output))
+                if hist is None: hist = self.values[(key, output)] = np.full((CROSS_BARS, len(v)), np.nan)
+                hist[:-1] = hist[1:]
+                hist[-1] = v
+        self.last_date = pd.Timestamp(date)
+        self.steps += 1
+
+    def advance_cube(self, cube, dates=None):
+        """advance through every date of a PriceCube after last_date. With dates, through each of those
+        dates after last_date, a date the cube does not have is a date without bars for its symbols"""
+        self.add_symbols(cube.stock_ids.values)
+        cols = pd.Index(self.stock_ids).get_indexer(cube.stock_ids)
+        rows = cube.dates.get_indexer(pd.DatetimeIndex(dates)) if dates is not None else np.arange(len(cube.dates))
+        dates = pd.DatetimeIndex(dates) if dates is not None else cube.dates
+        for i, date in zip(rows, dates):
+            if self.last_date is not None and date <= self.last_date: continue
+            present = np.zeros(len(self.stock_ids), dtype=bool)
+            bar = {f: np.full(len(self.stock_ids), np.nan) for f in cube.fields}
+            if i >= 0:
+                present[cols] = cube.valid[i]
+                for f in cube.fields: bar[f][cols] = np.where(cube.valid[i], cube.array(f)[i], np.nan)
+            self.advance(date, bar, present)
+
+    def splice(self, other):
+        """take the state of other's symbols (advanced through the same dates), adding the ones not tracked yet"""
+        self.add_symbols(other.stock_ids)
+        cols = pd.Index(self.stock_ids).get_indexer(other.stock_ids)
+        other_cols = np.arange(len(other.stock_ids))
+        for f in FIELDS: self.last[f][cols] = other.last[f]
+        self.bars[cols] = other.bars
+        self.last_bar[cols] = other.last_bar
+        for key, ind in self.indicators.items():
+            theirs = other.indicators[key].streams()
+            for name, stream in ind.streams().items(): stream.splice(cols, theirs[name], other_cols)
+        for k, v in other.values.items():
+            if k not in self.values: self.values[k] = np.full((CROSS_BARS, len(self.stock_ids)), np.nan)
+            self.values[k][:, cols] = v
+
+    def drop_stale(self, days=STALE_DAYS):
+        """drop symbols without a bar in the `days` days up to last_date, returns how many"""
+        cutoff = np.datetime64(self.last_date.date(), 'D') - np.timedelta64(days, 'D')
+        keep = self.last_bar >= cutoff
+        if keep.all(): return 0
+        self.stock_ids = self.stock_ids[keep]
+        for f in FIELDS: self.last[f] = self.last[f][keep]
+        self.bars, self.last_bar = self.bars[keep], self.last_bar[keep]
+        for ind in self.indicators.values():
+            for stream in ind.streams().values(): stream.keep(keep)
+        for k, v in self.values.items(): self.values[k] = v[:, keep]
+        return int((~keep).sum())
+
+
+def save_state(state, path):
+    """write state to path as one .npz, replacing the previous file atomically"""
+    arrays = {'stock_ids': state.stock_ids, 'bars': state.bars, 'last_bar': state.last_bar}
+    for f, v in state.last.items(): arrays[f'last/{f}'] = v
+    for (key, output), v in state.values.items(): arrays[f'values/{key}/{output}'] = v
+    for key, ind in state.indicators.items():
+        for name, stream in ind.streams().items():
+            for k, v in stream.arrays.items(): arrays[f'state/{key}/{name}/{k}'] = v
+    meta = {'specs': state.specs, 'last_date': None if state.last_date is None else str(state.last_date.date()),
+            'steps': state.steps, 'start': state.start}
+    arrays['meta'] = np.array(json.dumps(meta))
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def load_state(path):
+    """OnlineIndicators saved by save_state, None if path does not exist or has no per-symbol bar counts"""
+    if not os.path.exists(path): return None
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        if 'bars' not in data.files: return None
+        # a state saved before start was recorded covers all of prices, 'all' matches no start so it is rebuilt
+        state = OnlineIndicators(meta['specs'], data['stock_ids'], meta.get('start', 'all'))
+        state.last_date = meta['last_date'] and pd.Timestamp(meta['last_date'])
+        state.steps = meta['steps']
+        state.bars, state.last_bar = data['bars'], data['last_bar']
+        state.last = {f: data[f'last/{f}'] for f in FIELDS}
+        for name in data.files:
+            kind, _, rest = name.partition('/')
+            if kind == 'values':
+                key, output = rest.rsplit('/', 1)
+                state.values[(key, output)] = data[name]
+            elif kind == 'state':
+                key, stream, k = rest.rsplit('/', 2)
+                state.indicators[key].streams()[stream].arrays[k] = data[name]
+    return state
+
+
+def start_date(state):
+    """first excluded date of the state's history as a Timestamp, the state covers dates after it"""
+    return pd.Timestamp(state.start or '1900-01-01')
+
+
+def late_symbols(conn, state, days=STALE_DAYS):
+    """stock ids with a different number of bars between state.start and state.last_date in prices than
+    the state advanced through (late bars), among the symbols with a bar in the `days` days before
+    last_date or later"""
+    last = state.last_date
+    rows = fetch_columns(conn, """SELECT stock_id,
+                                         count(*) FILTER (WHERE date > ? AND date <= ? 
+                                             AND COALESCE(open, high, low, close, volume) IS NOT NULL) AS bars
+                                  FROM prices GROUP BY stock_id HAVING MAX(date) >= ?""",
+                         [start_date(state), last, last - pd.Timedelta(days=days)])
+    known = pd.Series(state.bars, index=state.stock_ids).reindex(rows['stock_id'].astype(np.int64), fill_value=0)
+    return rows['stock_id'][known.to_numpy() != rows['bars']].astype(np.int64)
+
+
+def rebuild_symbols(conn, state, stock_ids):
+    """replace the state of stock_ids by one advanced through their history from state.start up to
+    state.last_date, over the same dates as the rest of the state"""
+    fresh = OnlineIndicators(state.specs, start=state.start)
+    since = start_date(state)
+    dates = fetch_columns(conn, "SELECT DISTINCT date FROM prices WHERE date > ? AND date <= ? ORDER BY date", 
+                          [since, state.last_date])['date']
+    cols = fetch_columns(conn, f"""SELECT date, stock_id, {', '.join(FIELDS)} FROM prices 
+                                   WHERE date > ? AND date <= ? AND list_contains(?, stock_id)""",
+                         [since, state.last_date, [int(i) for i in stock_ids]])
+    fresh.advance_cube(build_cube_columns(cols), dates)
+    state.splice(fresh)
+
+
+def update_indicator_state(conn, path, specs=DEFAULT_SPECS, start=None):
+    """advance the state in path through the bars ingested since its last date and save it. The state
+    covers the dates after start (default config.CUBE_START, the scan cube's first date, so cumulative
+    indicators like OBV match the cube's). Symbols with late bars are rebuilt, stale ones dropped. Starts
+    from scratch when the file is missing, specs or start changed or a date was inserted before last_date.
+    Returns the number of dates advanced, the caller bumps the ingest generation"""
+    if start is None: start = config.CUBE_START or None
+    state = load_state(path)
+    wanted = [(name, canonical_params(name, params)) for name, params in specs]
+    if state is not None and state.last_date is not None:
+        dates = conn.execute("SELECT count(DISTINCT date) FROM prices WHERE date > ? AND date <= ?", 
+                             [start_date(state), state.last_date]).fetchone()[0]
+        # a new date before last_date shifts the forward fill of every symbol listed before it, nearly all
+        # of them, so the state is replayed (from start, not the whole history). Backfilled bars on dates
+        # other symbols already had don't change the date count and only rebuild their symbols below
+        if dates != state.steps:
+            print(f"indicator state: {dates - state.steps} new dates up to {state.last_date.date()}, replaying from {state.start}")
+            state = None
+    if state is None or state.start != start or sorted(map(str, state.specs)) != sorted(map(str, wanted)):
+        state = OnlineIndicators(wanted, start=start)
+    late = late_symbols(conn, state) if state.last_date is not None else []
+    if len(late): rebuild_symbols(conn, state, late)
+    cube = price_cube(conn, FIELDS, startday=state.last_date if state.last_date is not None else start)
+    before = state.last_date
+    state.advance_cube(cube)
+    dropped = state.drop_stale() if state.last_date is not None else 0
+    if state.last_date == before and not len(late) and not dropped: return 0
+    save_state(state, path)
+    advanced = len(cube.dates)
+    print(f"indicator state: {len(state.indicators)} indicators x {len(state.stock_ids)} symbols advanced {advanced} dates "
+          f"to {state.last_date.date()}, {len(late)} rebuilt for late bars, {dropped} stale dropped")
+    return advanced
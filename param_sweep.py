@@ -0,0 +1,118 @@
+"""Backtest a grid of indicator params and thresholds as broadcast vectorbt runs.
+
+Every parameter combination is one column: each indicator runs once per chunk of combinations
+(param_product=False, one param list entry per column), the compiled entry/exit plan evaluates
+all columns in one pass and one Portfolio simulates them together. Chunks are sized so the
+per-column arrays stay under a memory budget."""
+import itertools
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from vbt_indicts import indicts, canonical_params
+
+
+SWEEP_BYTES = 512 * 2**20
+# float64 arrays of one bar per column alive during a chunk: indicator outputs, signals, portfolio state
+SWEEP_ARRAYS = 32
+METRICS = ('total_return', 'max_drawdown', 'sharpe_ratio', 'sortino_ratio', 'win_rate', 'trades', 'final_value')
+
+
+def parse_range(text, cast=float):
+    """'5:200:5' -> 5, 10, ..., 200 (stop included), '20,25,30' -> those values, '' -> None.
+    cast=int gives ints only when every value is a whole number, like canonical_params: '1.5:2.5:0.5'
+    for an int default stays 1.5, 2.0, 2.5 instead of truncating to 1, 2, 2"""
+    text = text.strip()
+    if not text: return None
+    if ':' in text:
+        start, stop, step = (float(x) for x in text.split(':'))
+        values = [float(v) for v in np.arange(start, stop + step / 2, step)]
+    else:
+        values = [float(x) for x in text.split(',')]
+    if cast is int and not all(v.is_integer() for v in values): return values
+    return [cast(v) for v in values]
+
+
+def sweep_grid(axes):
+    """every combination of axes=dict{label: values} as a DataFrame, one row per combination"""
+    labels = list(axes)
+    return pd.DataFrame(list(itertools.product(*(axes[l] for l in labels))), columns=labels)
+
+
+def chunk_size(bars, budget=SWEEP_BYTES):
+    """combinations per chunk for series of `bars` bars"""
+    return max(1, int(budget // (bars * 8 * SWEEP_ARRAYS)))
+
+
+def sweep_signals(frames, indicators, plan, grid):
+    """entry and exit arrays (bars x combinations) of the combinations in grid. grid columns are
+    'indicator.param' for swept params and '$name' for swept thresholds"""
+    n = len(grid)
+    runs = {}
+    for indi in plan.indicators:
+        name = indicators[indi]['type']
+        fixed = canonical_params(name, indicators[indi]['params'])
+        columns = {p: (grid[f'{indi}.{p}'] if f'{indi}.{p}' in grid else [v] * n) for p, v in fixed.items() if p != 'short_name'}
+        params = [canonical_params(name, dict(zip(columns, values))) for values in zip(*columns.values())]
+        lists = {p: [c[p] for c in params] for p in columns}
+        runs[indi] = getattr(vbt, name).run(*[frames[f] for f in indicts[name]['inputs']], **lists,
+                                            short_name=fixed['short_name'], param_product=False)
+
+    def load(indi, output):
+        if indi == '$': return np.asarray(grid['$' + output], dtype=np.float64)[None, :]
+        values = np.asarray(getattr(runs[indi], output))
+        return values.reshape(len(values), -1)
+
+    signals = plan.evaluate(load)
+    bars = len(frames['close'])
+    return tuple(np.broadcast_to(signals[k], (bars, n)) for k in ('entries', 'exits'))
+
+
+def simulate(close, entries, exits, long=True, freq='1D', columns=None):
+    """Portfolio of close against entry/exit arrays, one column per combination"""
+    entries, exits = (pd.DataFrame(x, index=close.index, columns=columns) if np.ndim(x) == 2
+                      else pd.Series(x, index=close.index) for x in (entries, exits))
+    if long:
+        return vbt.Portfolio.from_signals(close, entries, exits, freq=freq)
+    return vbt.Portfolio.from_signals(close, short_entries=entries, short_exits=exits, freq=freq)
+
+
+def run_chunk(frames, indicators, plan, grid, long=True, freq='1D'):
+    """Portfolio over the combinations in grid (one column each)"""
+    entries, exits = sweep_signals(frames, indicators, plan, grid)
+    n = len(grid)
+    columns = pd.RangeIndex(grid.index[0], grid.index[0] + n) if n else pd.RangeIndex(0)
+    return simulate(frames['close'], entries, exits, long, freq, columns)
+
+
+def portfolio_metrics(pf):
+    """per column Portfolio.stats() figures, computed vectorised instead of one stats() per column"""
+    return pd.DataFrame({
+        'total_return': pf.total_return() * 100,
+        'max_drawdown': pf.max_drawdown() * 100,
+        'sharpe_ratio': pf.sharpe_ratio(),
+        'sortino_ratio': pf.sortino_ratio(),
+        'win_rate': pf.trades.win_rate() * 100,
+        'trades': pf.trades.count(),
+        'final_value': pf.final_value(),
+    }, index=pf.wrapper.columns)
+
+
+def run_sweep(frames, indicators, plan, axes, long=True, budget=SWEEP_BYTES, freq='1D', progress=None):
+    """backtest every combination of axes over one symbol's frames=dict{field: series}.
+    Returns the grid with the METRICS columns, one row per combination"""
+    grid = sweep_grid(axes)
+    size = chunk_size(len(frames['close']), budget)
+    results = []
+    for start in range(0, len(grid), size):
+        chunk = grid.iloc[start:start + size]
+        results.append(portfolio_metrics(run_chunk(frames, indicators, plan, chunk, long, freq)))
+        if progress: progress(min(start + size, len(grid)) / len(grid))
+    metrics = pd.concat(results) if results else pd.DataFrame(columns=METRICS)
+    return pd.concat([grid, metrics], axis=1)
+
+
+def heatmap_frame(results, x, y, metric):
+    """metric over two swept axes, averaged over the others"""
+    return results.pivot_table(index=y, columns=x, values=metric, aggfunc='mean')
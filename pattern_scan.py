@@ -0,0 +1,159 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import talib
+from talib import abstract
+
+
+def symbol_offsets(prices):
+    """sort prices once by (stock_id, date); return sorted frame, stock ids and each id's [start, end) row offsets"""
+    prices = prices.sort_values(['stock_id', 'date'], kind='stable', ignore_index=True)
+    return (prices, *offsets_from_ids(prices['stock_id'].to_numpy()))
+
+
+def offsets_from_ids(ids):
+    """stock ids and [start, end) offsets of each run in an id column already sorted by stock_id"""
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.empty(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(ids)].astype(np.int64)
+    return ids[starts], starts, ends
+
+
+def ohlc_arrays(prices):
+    """contiguous float64 open, high, low, close arrays, slices of these are zero-copy views"""
+    return tuple(np.ascontiguousarray(prices[c].to_numpy(), dtype=np.float64) for c in ('open', 'high', 'low', 'close'))
+
+
+def pattern_window(pattern):
+    """shortest trailing window giving the same last value as the full history"""
+    return abstract.Function(pattern).lookback + 1
+
+
+def scan_pattern(pattern, ohlc, ids, starts, ends, window=None):
+    """run talib pattern on the trailing window of every symbol, return [(last signal, stock_id)] where signal != 0"""
+    fn = getattr(talib, pattern)
+    window = window or pattern_window(pattern)
+    o, h, l, c = ohlc
+    scan = []
+    for stock_id, start, end in zip(ids, starts, ends):
+        if end - start < window: continue
+        s = end - window
+        last = fn(o[s:end], h[s:end], l[s:end], c[s:end])[-1]
+        if last != 0: scan.append((last, stock_id))
+    return scan
+
+
+# materialised signals of every pattern, refreshed after ingest
+PATTERN_BLOCK = 500
+PATTERN_WORKERS = 4
+
+
+def create_pattern_signals(conn):
+    """Create pattern_signals (non-zero signals only) and pattern_watermarks in conn's duckdb"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS pattern_signals(
+                    stock_id UINTEGER,
+                    date DATE,
+                    pattern VARCHAR,
+                    signal SMALLINT)""")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS pattern_signals_idx ON pattern_signals (date, pattern, stock_id)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS pattern_watermarks(
+                    stock_id UINTEGER PRIMARY KEY,
+                    last_date DATE,
+                    first_date DATE)""")
+    # tables from before first_date was tracked, NULL rescores the symbol's whole history once
+    conn.execute("ALTER TABLE pattern_watermarks ADD COLUMN IF NOT EXISTS first_date DATE")
+
+
+def block_signals(pattern_names, ohlc, dates, ids, starts, ends, after, before):
+    """all patterns over one block of symbols, keep non-zero signals dated after each symbol's watermark
+    or before its `before` date (backfilled bars and the bars whose lookback they extend).
+    Returns numpy columns stock_id, date, pattern index, signal"""
+    o, h, l, c = ohlc
+    out = ([], [], [], [])
+    for stock_id, start, end, last, first in zip(ids, starts, ends, after, before):
+        new = (dates[start:end] > last) | (dates[start:end] < first)
+        if not new.any(): continue
+        for k, name in enumerate(pattern_names):
+            signal = getattr(talib, name)(o[start:end], h[start:end], l[start:end], c[start:end])
+            hit = np.flatnonzero((signal != 0) & new)
+            if not len(hit): continue
+            out[0].append(np.full(len(hit), stock_id, dtype=np.uint32))
+            out[1].append(dates[start:end][hit])
+            out[2].append(np.full(len(hit), k, dtype=np.int16))
+            out[3].append(signal[hit].astype(np.int16))
+    if not out[0]: return None
+    return tuple(np.concatenate(x) for x in out)
+
+
+def write_signals(conn, pattern_names, result):
+    """insert one block's signals, skipping ones already stored"""
+    stock_id, date, k, signal = result
+    batch = pd.DataFrame({'stock_id': stock_id, 'date': date, 
+                          'pattern': np.asarray(pattern_names, dtype=object)[k], 'signal': signal})
+    conn.register('signal_batch', batch)
+    try:
+        return conn.execute("""INSERT INTO pattern_signals SELECT b.stock_id, b.date, b.pattern, b.signal 
+                               FROM signal_batch b WHERE NOT EXISTS (SELECT 1 FROM pattern_signals s 
+                                   WHERE s.date = b.date AND s.pattern = b.pattern AND s.stock_id = b.stock_id)""").fetchone()[0]
+    finally:
+        conn.unregister('signal_batch')
+
+
+def update_pattern_signals(conn, pattern_names, workers=PATTERN_WORKERS, block=PATTERN_BLOCK):
+    """compute every pattern for bars ingested since each symbol's pattern watermark, and for bars a backfill
+    inserted before the first date scored, and store them in pattern_signals.
+    Symbols are read in blocks and scanned in a process pool, with at most 2 blocks per worker in flight.
+    The caller bumps the ingest generation once everything derived from the ingest is written"""
+    create_pattern_signals(conn)
+    pattern_names = list(pattern_names)
+    lookback = max(pattern_window(p) for p in pattern_names)
+    # calendar days holding the longest pattern lookback
+    margin = 2 * lookback + 10
+    stock_ids = [r[0] for r in conn.execute("""SELECT w.stock_id FROM ingest_watermarks w 
+                    LEFT JOIN pattern_watermarks p ON w.stock_id = p.stock_id
+                    WHERE p.last_date IS NULL OR w.last_date > p.last_date 
+                    OR p.first_date IS NULL OR w.first_date < p.first_date
+                    ORDER BY w.stock_id""").fetchall()]
+
+    def read_block(block_ids):
+        # the bars to score plus enough calendar days before them for the longest pattern lookback.
+        # A symbol with backfilled bars is read whole: they and the first `margin` days scored before
+        # them (whose lookback they extend) are rescored
+        prices = conn.execute(f"""SELECT p.stock_id, p.date, p.open, p.high, p.low, p.close, 
+                                  coalesce(w.last_date, DATE '1900-01-01') AS after,
+                                  CASE WHEN w.last_date IS NULL THEN DATE '1900-01-01'
+                                       WHEN w.first_date IS NULL THEN w.last_date + INTERVAL 1 DAY
+                                       WHEN i.first_date < w.first_date THEN w.first_date + INTERVAL {margin} DAY
+                                       ELSE DATE '1900-01-01' END AS before
+                                  FROM prices p JOIN ingest_watermarks i ON p.stock_id = i.stock_id
+                                  LEFT JOIN pattern_watermarks w ON p.stock_id = w.stock_id
+                                  WHERE p.stock_id IN ({','.join(str(x) for x in block_ids)})
+                                  AND (w.last_date IS NULL OR w.first_date IS NULL OR i.first_date < w.first_date 
+                                       OR p.date > w.last_date - INTERVAL {margin} DAY)
+                                  """).fetchdf()
+        prices, ids, starts, ends = symbol_offsets(prices)
+        dates = prices['date'].to_numpy().astype('datetime64[D]')
+        after = prices['after'].to_numpy().astype('datetime64[D]')[starts]
+        before = prices['before'].to_numpy().astype('datetime64[D]')[starts]
+        return ohlc_arrays(prices), dates, ids, starts, ends, after, before
+
+    total = 0
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(stock_ids) + block, block):
+            if i < len(stock_ids):
+                in_flight.append(pool.submit(block_signals, pattern_names, *read_block(stock_ids[i:i+block])))
+            while in_flight and (len(in_flight) >= 2 * workers or i >= len(stock_ids)):
+                result = in_flight.popleft().result()
+                if result is not None: total += write_signals(conn, pattern_names, result)
+    # all blocks written, move the pattern watermarks up to the ingest watermarks
+    conn.begin()
+    conn.execute("""UPDATE pattern_watermarks SET last_date = w.last_date, first_date = w.first_date 
+                    FROM ingest_watermarks w
+                    WHERE pattern_watermarks.stock_id = w.stock_id""")
+    conn.execute("""INSERT INTO pattern_watermarks SELECT stock_id, last_date, first_date FROM ingest_watermarks
+                    WHERE stock_id NOT IN (SELECT stock_id FROM pattern_watermarks)""")
+    conn.commit()
+    print(f"{total} pattern signals for {len(stock_ids)} symbols")
+    return total
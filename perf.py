@@ -0,0 +1,147 @@
+"""Timing spans around the hot path stages, with row counts and bytes, logged as append-only JSON lines.
+
+    with span('scan data') as s:
+        cube = get_scan_cube(fields, bars)
+        s.measure(cube)
+
+Spans of one dashboard rerun or one ingest share a run id and a page, a span opened inside another
+records it as parent and self_ms excludes the time of its children. With config.PERF_LOG set every
+closed span is appended to that file; DuckDB reads it as is for p50/p95 per page and stage."""
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import duckdb as ddb
+
+import config
+from query_cache import sizeof
+
+
+# schema of the log for duckdb, so a log whose first lines have no rows or bytes still reads as numbers
+LOG_COLUMNS = {'run': 'VARCHAR', 'page': 'VARCHAR', 'stage': 'VARCHAR', 'detail': 'VARCHAR', 'parent': 'VARCHAR',
+               'depth': 'INTEGER', 'started': 'TIMESTAMP', 'ms': 'DOUBLE', 'self_ms': 'DOUBLE', 'rows': 'BIGINT',
+               'bytes': 'BIGINT', 'error': 'VARCHAR'}
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def rows_of(value):
+    """row count of a stage's result: table rows, cube values, list length, or the count a writer returns"""
+    if isinstance(value, bool) or value is None: return None
+    if isinstance(value, int): return value
+    if hasattr(value, 'num_rows'): return int(value.num_rows)
+    if hasattr(value, 'dates') and hasattr(value, 'stock_ids'): return len(value.dates) * len(value.stock_ids)
+    if hasattr(value, 'shape'): return int(value.shape[0]) if value.shape else 1
+    if isinstance(value, tuple) and value: return rows_of(value[0])
+    if isinstance(value, dict) and value: return rows_of(next(iter(value.values())))
+    if hasattr(value, '__len__'): return len(value)
+    return None
+
+
+class Span:
+    def __init__(self, stage, detail, parent):
+        self.stage = stage
+        self.detail = detail
+        self.parent = parent
+        self.rows = None
+        self.bytes = None
+        self.children_ms = 0.0
+
+    def measure(self, value, rows=None):
+        """record rows and bytes of value (rows overrides the count), returns value"""
+        self.rows = rows if rows is not None else rows_of(value)
+        if not isinstance(value, int): self.bytes = int(sizeof(value))
+        return value
+
+
+def start_run(page):
+    """begin the spans of one dashboard rerun or ingest, returns its run id"""
+    _local.run = {'run': uuid.uuid4().hex[:12], 'page': page, 't0': time.perf_counter(), 'spans': []}
+    _local.stack = []
+    return _local.run['run']
+
+
+def _current_run():
+    run = getattr(_local, 'run', None)
+    return run if run is not None else {'run': None, 'page': None, 't0': time.perf_counter(), 'spans': []}
+
+
+def run_spans():
+    """closed spans of this thread's current run, in the order they closed"""
+    return _current_run()['spans']
+
+
+def log_records(records, path=None):
+    """append span records to the JSONL log at path (default config.PERF_LOG, "" for none)"""
+    path = path if path is not None else config.PERF_LOG
+    if not path or not records: return
+    lines = ''.join(json.dumps(r, default=str) + '\n' for r in records)
+    with _log_lock:
+        with open(path, 'a') as f:
+            f.write(lines)
+
+
+@contextmanager
+def span(stage, detail=None):
+    """time the block as `stage` of the current run, yields the Span to measure results on"""
+    run = _current_run()
+    stack = getattr(_local, 'stack', None)
+    if stack is None: stack = _local.stack = []
+    s = Span(stage, detail, stack[-1].stage if stack else None)
+    stack.append(s)
+    error = None
+    started = datetime.now()
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        stack.pop()
+        if stack: stack[-1].children_ms += ms
+        record = {'run': run['run'], 'page': run['page'], 'stage': stage, 'detail': detail, 'parent': s.parent,
+                  'depth': len(stack), 'started': started.isoformat(timespec='milliseconds'), 'ms': round(ms, 3),
+                  'self_ms': round(ms - s.children_ms, 3), 'rows': s.rows, 'bytes': s.bytes, 'error': error}
+        run['spans'].append(record)
+        log_records([record])
+
+
+def end_run():
+    """log the wall time of the current run as its 'total' span, returns the run's spans"""
+    run = _current_run()
+    ms = (time.perf_counter() - run['t0']) * 1000
+    record = {'run': run['run'], 'page': run['page'], 'stage': 'total', 'detail': None, 'parent': None, 'depth': 0,
+              'started': datetime.now().isoformat(timespec='milliseconds'), 'ms': round(ms, 3),
+              'self_ms': round(ms - sum(r['ms'] for r in run['spans'] if r['depth'] == 0), 3),
+              'rows': None, 'bytes': None, 'error': None}
+    run['spans'].append(record)
+    log_records([record])
+    return run['spans']
+
+
+def perf_summary(path=None, days=7):
+    """p50/p95/max ms per page and stage over the last `days` days of the JSONL log, slowest p95 first"""
+    path = path if path is not None else config.PERF_LOG
+    conn = ddb.connect()
+    try:
+        return conn.execute("""SELECT page, stage,
+                                      count(*) AS n,
+                                      quantile_cont(ms, 0.5) AS p50_ms,
+                                      quantile_cont(ms, 0.95) AS p95_ms,
+                                      max(ms) AS max_ms,
+                                      quantile_cont(self_ms, 0.5) AS p50_self_ms,
+                                      avg(rows) AS avg_rows,
+                                      avg(bytes) AS avg_bytes,
+                                      count(error) AS errors
+                               FROM read_json(?, format='newline_delimited', columns=?)
+                               WHERE started > ?
+                               GROUP BY page, stage
+                               ORDER BY page, p95_ms DESC""", [path, LOG_COLUMNS, datetime.now() - timedelta(days=days)]).fetchdf()
+    finally:
+        conn.close()
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class PriceCube:
+    """Dense dates x symbols OHLCV arrays built once from the long format prices.
+
+    data has shape (len(fields), n_dates, n_symbols) and is forward filled once at build time,
+    valid marks where a symbol actually had a bar. The indicators all need filled inputs, so filling
+    at build time keeps array(), frame() and tail() views (of the memory map too) instead of a filled
+    copy per scan; the unfilled values are where valid is True."""
+    def __init__(self, dates, stock_ids, data, valid, fields=FIELDS):
+        self.dates = dates
+        self.stock_ids = stock_ids
+        self.data = data
+        self.valid = valid
+        self.fields = tuple(fields)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.valid.nbytes
+
+    def array(self, field):
+        return self.data[self.fields.index(field)]
+
+    def tail(self, n):
+        """cube over the last n dates only (the whole cube for n=None)"""
+        if n is None or n >= len(self.dates): return self
+        return PriceCube(self.dates[-n:], self.stock_ids, self.data[:, -n:], self.valid[-n:], self.fields)
+
+    def frame(self, field):
+        """dates x stock_id DataFrame over the cube's memory, the layout pivot() used to give"""
+        return pd.DataFrame(self.array(field), index=self.dates, columns=self.stock_ids, copy=False)
+
+
+def forward_fill(data, valid):
+    """forward fill each field of data (fields x dates x symbols) along dates from the rows marked valid"""
+    rows = np.where(valid, np.arange(valid.shape[0])[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    cols = np.arange(valid.shape[1])[None, :]
+    for k in range(data.shape[0]):
+        data[k] = data[k][rows, cols]
+    return data
+
+
+def build_cube(prices, dtype=np.float64):
+    """PriceCube from a long format frame with date, stock_id and any of the FIELDS columns.
+    dtype=np.float32 halves the memory, volumes above 2**24 then lose precision"""
+    return build_cube_columns({c: prices[c].to_numpy() for c in prices.columns}, dtype=dtype)
+
+
+def build_cube_columns(cols, dtype=np.float64):
+    """PriceCube from dict{column: numpy array} with date, stock_id and any of the FIELDS"""
+    fields = [f for f in FIELDS if f in cols]
+    stock_ids, col = np.unique(cols['stock_id'], return_inverse=True)
+    dates, row = np.unique(cols['date'], return_inverse=True)
+    data = np.full((len(fields), len(dates), len(stock_ids)), np.nan, dtype=dtype)
+    present = np.zeros(len(row), dtype=bool)
+    for k, field in enumerate(fields):
+        # fetchnumpy gives a masked array for a column with NULLs, the data under its mask is not the value
+        values = cols[field]
+        data[k, row, col] = np.ma.filled(values.astype(dtype), np.nan) if np.ma.isMaskedArray(values) else values
+        present |= ~np.ma.getmaskarray(values)
+    # a row with every field NULL is no bar
+    valid = np.zeros((len(dates), len(stock_ids)), dtype=bool)
+    valid[row, col] = present
+    forward_fill(data, valid)
+    return PriceCube(pd.DatetimeIndex(dates, name='date'), pd.Index(stock_ids, name='stock_id'), data, valid, fields)
+
+
+# versioned on-disk cube, written by the ingest job and memory mapped read-only by the dashboard
+CUBE_KEEP = 2
+
+
+def current_cube_version(root):
+    """version named in root/CURRENT, None if no cube was exported yet"""
+    try:
+        with open(os.path.join(root, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_cube(cube, root, version=None):
+    """write cube to root/<version>/ as .npy files, then switch root/CURRENT to it.
+    Readers of an older version keep their mapping; only the newest CUBE_KEEP versions are kept"""
+    version = str(version or time.strftime('%Y%m%d%H%M%S'))
+    path = os.path.join(root, version)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'data.npy'), cube.data)
+    np.save(os.path.join(tmp, 'valid.npy'), cube.valid)
+    np.save(os.path.join(tmp, 'dates.npy'), cube.dates.values.astype('datetime64[ns]'))
+    np.save(os.path.join(tmp, 'stock_ids.npy'), cube.stock_ids.values)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'fields': cube.fields, 'shape': cube.data.shape, 'dtype': str(cube.data.dtype)}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    with open(os.path.join(root, 'CURRENT.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(root, 'CURRENT.tmp'), os.path.join(root, 'CURRENT'))
+    versions = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)) and not d.endswith('.tmp'))
+    for old in versions[:-CUBE_KEEP]:
+        if old != version: shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def open_cube(root, version=None):
+    """PriceCube over read-only memory maps of an exported version (default CURRENT).
+    All processes mapping the same version share the OS page cache"""
+    version = version or current_cube_version(root)
+    if version is None:
+        raise FileNotFoundError(f"no price cube exported to {root!r}")
+    path = os.path.join(root, version)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    data = np.load(os.path.join(path, 'data.npy'), mmap_mode='r')
+    valid = np.load(os.path.join(path, 'valid.npy'), mmap_mode='r')
+    dates = pd.DatetimeIndex(np.load(os.path.join(path, 'dates.npy')), name='date')
+    stock_ids = pd.Index(np.load(os.path.join(path, 'stock_ids.npy')), name='stock_id')
+    return PriceCube(dates, stock_ids, data, valid, meta['fields'])
+
+
+def export_cube(conn, root, startday=None, dtype=np.float64, version=None):
+    """build the cube from conn's prices since startday (default config.CUBE_START, the same start as
+    the dashboard's cube without an export) and write it as a new version"""
+    if startday is None: startday = config.CUBE_START or None
+    if startday is None:
+        prices = conn.execute("SELECT * FROM prices").fetchdf()
+    else:
+        prices = conn.execute("SELECT * FROM prices WHERE date > ?", [pd.Timestamp(startday)]).fetchdf()
+    cube = build_cube(prices, dtype=dtype)
+    del prices
+    version = write_cube(cube, root, version)
+    print(f"price cube {version}: {cube.data.shape}, {cube.nbytes/2**20:,.0f} MiB")
+    return version
@@ -0,0 +1,129 @@
+"""Query result cache keyed by the ingest generation, with an LRU byte budget.
+
+The loader bumps ingest_generation in the database after every ingest. The dashboard calls
+check_generation once at the start of each rerun, which drops everything cached under an older
+generation, so it picks up new bars on the next rerun instead of serving memoised results forever
+while cache hits within the rerun run no query at all."""
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import duckdb as ddb
+import numpy as np
+import pandas as pd
+
+
+def create_ingest_generation(conn):
+    """Create the one row ingest_generation table in conn's duckdb"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS ingest_generation(
+                    generation UBIGINT,
+                    updated TIMESTAMP)""")
+    if conn.execute("SELECT count(*) FROM ingest_generation").fetchone()[0] == 0:
+        conn.execute("INSERT INTO ingest_generation VALUES (0, current_timestamp)")
+
+
+def bump_generation(conn):
+    """mark the data as changed, call after every committed ingest. Returns the new generation"""
+    create_ingest_generation(conn)
+    conn.execute("UPDATE ingest_generation SET generation = generation + 1, updated = current_timestamp")
+    return conn.execute("SELECT generation FROM ingest_generation").fetchone()[0]
+
+
+def current_generation(conn):
+    """ingest generation of conn's database, 0 for a database no loader has bumped yet.
+    Other errors (e.g. the file locked by an ingest) are raised, not read as generation 0"""
+    try:
+        row = conn.execute("SELECT generation FROM ingest_generation").fetchone()
+    except ddb.CatalogException:
+        return 0
+    return row[0] if row else 0
+
+
+def sizeof(value):
+    """approximate bytes held by a cached value; memory mapped arrays count as 0 (they live in the page cache)"""
+    if isinstance(value, np.memmap): return 0
+    if isinstance(value, np.ndarray):
+        return 0 if isinstance(value.base, np.memmap) else value.nbytes
+    if isinstance(value, pd.DataFrame): return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)): return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)): return sum(sizeof(v) for v in value)
+    if isinstance(value, dict): return sum(sizeof(v) for v in value.values())
+    if hasattr(value, '__dict__'): return sum(sizeof(v) for v in vars(value).values())
+    if hasattr(value, 'nbytes') and not callable(value.nbytes): return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """LRU cache of query results under max_bytes, emptied when check_generation() sees generation() change.
+
+    Cached values are shared between sessions, callers must not modify them in place"""
+    def __init__(self, max_bytes, generation):
+        self.max_bytes = max_bytes
+        self.generation = generation
+        self.current = None
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def check_generation(self, generation=None):
+        """drop every entry if the data changed since they were cached, generation defaults to reading
+        generation(). When it can't be read, the last known one is kept, so a transient error doesn't
+        flush the cache twice. Returns the generation"""
+        if generation is None:
+            try:
+                generation = self.generation()
+            except Exception as e:
+                if self.current is None: raise
+                print(f"query cache: keeping generation {self.current}, {type(e).__name__}: {e}")
+                return self.current
+        with self.lock:
+            if generation != self.current:
+                if self.entries: self.stats['invalidations'] += 1
+                self.entries.clear()
+                self.bytes = 0
+                self.current = generation
+        return generation
+
+    def get(self, key, load):
+        """cached value of key or load(), under the generation of the last check_generation"""
+        generation = self.current if self.current is not None else self.check_generation()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self.entries[key][0]
+            self.stats['misses'] += 1
+        value = load()
+        size = sizeof(value)
+        with self.lock:
+            # another rerun saw an ingest land while loading, the value may be stale already
+            if generation != self.current or size > self.max_bytes: return value
+            if key in self.entries: self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.stats['evictions'] += 1
+        return value
+
+    def memo(self, fn):
+        """decorator caching fn(*args, **kwargs) by its name and (hashable) arguments"""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__qualname__, args, tuple(sorted(kwargs.items())))
+            return self.get(key, lambda: fn(*args, **kwargs))
+        return wrapper
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def metrics(self):
+        with self.lock:
+            m = dict(self.stats)
+            m.update(entries=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes, generation=self.current)
+        return m
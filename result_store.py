@@ -0,0 +1,169 @@
+"""Backtest results stored under a canonical hash of the strategy, in a writable DuckDB.
+
+The key covers what changes a result: symbol (or universe), the indicators the conditions use with
+their canonical params, the entry/exit conditions, long or short and the data version. Indicator
+slot numbers and short names do not change it, so the same strategy set up in another order or
+another session finds the stored stats, trades, orders and equity curve instead of rerunning."""
+import hashlib
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from conditions import condition_key
+from param_sweep import METRICS, portfolio_metrics
+from vbt_indicts import params_key
+
+
+TRADE_COLUMNS = {'Entry Timestamp': 'entry_time', 'Avg Entry Price': 'entry_price', 'Exit Timestamp': 'exit_time',
+                 'Avg Exit Price': 'exit_price', 'Size': 'size', 'PnL': 'pnl', 'Return': 'trade_return',
+                 'Direction': 'direction', 'Status': 'status'}
+ORDER_COLUMNS = {'Timestamp': 'time', 'Side': 'side', 'Size': 'size', 'Price': 'price', 'Fees': 'fees'}
+
+
+def create_result_tables(conn):
+    """Create backtest_runs and its stats, trades, orders and equity tables in conn's duckdb"""
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS backtest_runs(
+                    key VARCHAR PRIMARY KEY,
+                    created TIMESTAMP,
+                    symbol VARCHAR,
+                    long BOOLEAN,
+                    data_version VARCHAR,
+                    strategy VARCHAR,
+                    {', '.join(f'{m} DOUBLE' for m in METRICS)})""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS backtest_stats(
+                    key VARCHAR,
+                    stat VARCHAR,
+                    value DOUBLE,
+                    text VARCHAR)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS backtest_trades(
+                    key VARCHAR,
+                    entry_time TIMESTAMP,
+                    entry_price DOUBLE,
+                    exit_time TIMESTAMP,
+                    exit_price DOUBLE,
+                    size DOUBLE,
+                    pnl DOUBLE,
+                    trade_return DOUBLE,
+                    direction VARCHAR,
+                    status VARCHAR)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS backtest_orders(
+                    key VARCHAR,
+                    time TIMESTAMP,
+                    side VARCHAR,
+                    size DOUBLE,
+                    price DOUBLE,
+                    fees DOUBLE)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS backtest_equity(
+                    key VARCHAR,
+                    date TIMESTAMP,
+                    cumulative_return DOUBLE)""")
+
+
+def frame_version(df):
+    """data version of one symbol's price frame: bar count, last date and a close checksum"""
+    if not len(df): return '0'
+    return f"{len(df)}:{pd.Timestamp(df.index[-1]).date()}:{float(np.nansum(df['close'].to_numpy())):.6f}"
+
+
+def canonical_strategy(symbol, indicators, roots, long, data_version):
+    """json-able strategy with indicator slots replaced by (type, canonical params)"""
+    def indicator(key):
+        return [indicators[key]['type'], [list(p) for p in params_key(indicators[key]['type'], indicators[key]['params'])]]
+
+    def operand(step):
+        return [step[0], indicator(step[1]), step[2]] if step[0] == 'output' and step[1] != '$' else list(step)
+
+    conditions = {}
+    for name, rows in sorted(roots.items()):
+        conditions[name] = []
+        for _, cnd in sorted(rows.items()):
+            negate, join, lhs, op, rhs = condition_key(cnd, indicators)
+            conditions[name].append([negate, join, operand(lhs), op, operand(rhs)])
+    return {'symbol': symbol, 'conditions': conditions, 'long': bool(long), 'data_version': str(data_version)}
+
+
+def strategy_key(symbol, indicators, roots, long, data_version):
+    """hash of the canonical strategy, the same for every equivalent dashboard setup"""
+    spec = canonical_strategy(symbol, indicators, roots, long, data_version)
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+
+def stats_rows(stats):
+    """Portfolio.stats() as (stat, number or None, text) rows, dates as YYYY-MM-DD"""
+    rows = []
+    for stat, v in stats.items():
+        if isinstance(v, pd.Timestamp):
+            rows.append((stat, None, v.strftime('%Y-%m-%d')))
+        elif isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool):
+            rows.append((stat, float(v), str(v)))
+        else:
+            rows.append((stat, None, str(v)))
+    return rows
+
+
+def portfolio_result(pf):
+    """what the Backtester shows of a Portfolio: stats, trades, orders and cumulative returns"""
+    return {'stats': {s: (n if n is not None else t) for s, n, t in stats_rows(pf.stats())},
+            'metrics': portfolio_metrics(pf).iloc[0].to_dict(),
+            'trades': pf.trades.records_readable.rename(columns=TRADE_COLUMNS)[list(TRADE_COLUMNS.values())],
+            'orders': pf.orders.records_readable.rename(columns=ORDER_COLUMNS)[list(ORDER_COLUMNS.values())],
+            'equity': pf.cumulative_returns()}
+
+
+def _insert_frame(conn, table, key, frame):
+    conn.register('result_batch', frame.assign(key=key))
+    try:
+        cols = ', '.join(f'"{c}"' for c in ['key', *frame.columns])
+        conn.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM result_batch")
+    finally:
+        conn.unregister('result_batch')
+
+
+def save_result(conn, key, spec, result):
+    """store a portfolio_result under key in one transaction, replacing an earlier result of key"""
+    create_result_tables(conn)
+    conn.begin()
+    try:
+        for table in ('backtest_runs', 'backtest_stats', 'backtest_trades', 'backtest_orders', 'backtest_equity'):
+            conn.execute(f"DELETE FROM {table} WHERE key = ?", [key])
+        metrics = [float(result['metrics'][m]) for m in METRICS]
+        conn.execute(f"INSERT INTO backtest_runs VALUES (?, ?, ?, ?, ?, ?, {', '.join('?' * len(METRICS))})",
+                     [key, datetime.now(), spec['symbol'], spec['long'], spec['data_version'], json.dumps(spec)] + metrics)
+        stats = pd.DataFrame([(s, n, str(t)) for s, n, t in stats_rows(pd.Series(result['stats'], dtype=object))],
+                             columns=['stat', 'value', 'text'])
+        _insert_frame(conn, 'backtest_stats', key, stats)
+        _insert_frame(conn, 'backtest_trades', key, result['trades'])
+        _insert_frame(conn, 'backtest_orders', key, result['orders'])
+        equity = result['equity']
+        _insert_frame(conn, 'backtest_equity', key, pd.DataFrame({'date': equity.index, 'cumulative_return': equity.to_numpy()}))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def load_result(conn, key):
+    """portfolio_result stored under key, None if there is none"""
+    create_result_tables(conn)
+    run = conn.execute(f"SELECT created, {', '.join(METRICS)} FROM backtest_runs WHERE key = ?", [key]).fetchone()
+    if run is None: return None
+    stats = conn.execute("SELECT stat, value, text FROM backtest_stats WHERE key = ? ORDER BY rowid", [key]).fetchall()
+    equity = conn.execute("SELECT date, cumulative_return FROM backtest_equity WHERE key = ? ORDER BY date", [key]).fetchdf()
+    return {'created': run[0],
+            'stats': {s: (n if n is not None else t) for s, n, t in stats},
+            'metrics': dict(zip(METRICS, run[1:])),
+            'trades': conn.execute(f"""SELECT {', '.join(TRADE_COLUMNS.values())} FROM backtest_trades
+                                       WHERE key = ? ORDER BY entry_time""", [key]).fetchdf(),
+            'orders': conn.execute(f"""SELECT {', '.join(ORDER_COLUMNS.values())} FROM backtest_orders
+                                       WHERE key = ? ORDER BY time""", [key]).fetchdf(),
+            'equity': equity.set_index('date')['cumulative_return']}
+
+
+def stored_runs(conn, symbol=None):
+    """stored backtests with their metrics, best total return first, for comparing strategies"""
+    create_result_tables(conn)
+    where, params = ("WHERE symbol = ?", [symbol]) if symbol else ("", [])
+    return conn.execute(f"""SELECT key, created, symbol, long, data_version, {', '.join(METRICS)}, strategy
+                            FROM backtest_runs {where} ORDER BY total_return DESC""", params).fetchdf()
@@ -0,0 +1,162 @@
+"""One strategy backtested over every symbol of the universe (or a subset), in blocks of symbol columns.
+
+The parent reads one block of symbols' prices at a time into a dense PriceCube and a process pool
+runs indicators, the compiled entry/exit plan and Portfolio.from_signals over each block's columns.
+At most 2 blocks per worker are in flight, so memory follows the block size and not the universe.
+Per-symbol stats are written to the universe_backtest table of a writable DuckDB as blocks finish."""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import vectorbt as vbt
+
+from data_access import fetch_columns
+from indicator_cache import run_indicator
+from param_sweep import METRICS, portfolio_metrics
+from price_cube import build_cube_columns
+from vbt_indicts import indicts
+
+
+UNIVERSE_BLOCK = 250
+UNIVERSE_WORKERS = os.cpu_count() or 4
+UNIVERSE_COLUMNS = ('stock_id', 'start', 'end', 'bars', *METRICS, 'buy_hold_return')
+
+
+def create_universe_results(conn):
+    """Create universe_backtest, one row per (run_id, stock_id), and universe_runs, one row per
+    finished run, in conn's duckdb"""
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS universe_backtest(
+                    run_id VARCHAR,
+                    stock_id UINTEGER,
+                    start DATE,
+                    "end" DATE,
+                    bars INTEGER,
+                    {', '.join(f'{m} DOUBLE' for m in METRICS)},
+                    buy_hold_return DOUBLE)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS universe_runs(
+                    run_id VARCHAR PRIMARY KEY,
+                    finished TIMESTAMP,
+                    symbols INTEGER)""")
+
+
+def universe_ids(conn, symbols=None, exchanges=None):
+    """stock ids of the universe: all symbols, or only the given symbols and/or exchanges"""
+    where, params = [], []
+    if symbols:
+        where.append(f"symbol IN ({', '.join('?' * len(symbols))})")
+        params += list(symbols)
+    if exchanges:
+        where.append(f"exchange IN ({', '.join('?' * len(exchanges))})")
+        params += list(exchanges)
+    sql = "SELECT id FROM symbols" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id"
+    return fetch_columns(conn, sql, params)['id']
+
+
+def strategy_fields(indicators, plan):
+    """price fields the plan's indicators and the portfolio read"""
+    fields = ['close'] + [f for indi in plan.indicators for f in indicts[indicators[indi]['type']]['inputs']]
+    return tuple(dict.fromkeys(fields))
+
+
+def read_block(conn, fields, block_ids, startday=None):
+    """PriceCube of one block of symbols since startday"""
+    sql = f"""SELECT date, stock_id, {', '.join(fields)} FROM prices
+              WHERE stock_id IN ({','.join(str(int(x)) for x in block_ids)})"""
+    if startday is None:
+        return build_cube_columns(fetch_columns(conn, sql))
+    return build_cube_columns(fetch_columns(conn, sql + " AND date > ?", [pd.Timestamp(startday)]))
+
+
+def block_backtest(cube, indicators, plan, long=True, freq='1D'):
+    """backtest every symbol column of cube, returns a frame of UNIVERSE_COLUMNS"""
+    frames = {f: cube.frame(f) for f in cube.fields}
+    runs = {}
+
+    def load(indi, output):
+        if indi not in runs:
+            runs[indi] = run_indicator(frames, indicators[indi]['type'], indicators[indi]['params'])
+        return getattr(runs[indi], output).to_numpy()
+
+    signals = plan.evaluate(load)
+    close = frames['close']
+    entries, exits = (pd.DataFrame(signals[k], index=close.index, columns=close.columns) for k in ('entries', 'exits'))
+    if long:
+        pf = vbt.Portfolio.from_signals(close, entries, exits, freq=freq)
+    else:
+        pf = vbt.Portfolio.from_signals(close, short_entries=entries, short_exits=exits, freq=freq)
+    stats = portfolio_metrics(pf)
+    # the cube is forward filled, a symbol's own history runs from its first to its last bar
+    first = cube.valid.argmax(axis=0)
+    last = len(cube.dates) - 1 - cube.valid[::-1].argmax(axis=0)
+    # bars before a late listing are flat cash, leave them out of the return ratios
+    if first.any():
+        returns = pf.returns()
+        returns = returns.where(np.arange(len(cube.dates))[:, None] >= first[None, :]).vbt.returns(freq=freq)
+        stats['sharpe_ratio'] = returns.sharpe_ratio()
+        stats['sortino_ratio'] = returns.sortino_ratio()
+    c = cube.array('close')
+    stats.insert(0, 'stock_id', cube.stock_ids.to_numpy())
+    stats.insert(1, 'start', cube.dates[first])
+    stats.insert(2, 'end', cube.dates[last])
+    stats.insert(3, 'bars', cube.valid.sum(axis=0))
+    stats['buy_hold_return'] = (c[-1] / c[first, np.arange(c.shape[1])] - 1) * 100
+    return stats.reset_index(drop=True)
+
+
+def write_results(conn, run_id, stats):
+    """append one block's per-symbol stats under run_id"""
+    batch = stats.assign(run_id=run_id)
+    conn.register('universe_batch', batch)
+    try:
+        conn.execute(f"""INSERT INTO universe_backtest SELECT run_id, {', '.join(f'"{c}"' for c in UNIVERSE_COLUMNS)}
+                         FROM universe_batch""")
+    finally:
+        conn.unregister('universe_batch')
+
+
+def stored_universe(conn, run_id):
+    """per-symbol stats stored under run_id, empty if the run was never stored or did not finish
+    (blocks are written as they finish, an interrupted run leaves some)"""
+    create_universe_results(conn)
+    return conn.execute(f"""SELECT {', '.join(f'"{c}"' for c in UNIVERSE_COLUMNS)} FROM universe_backtest
+                            WHERE run_id = ? AND run_id IN (SELECT run_id FROM universe_runs)
+                            ORDER BY stock_id""", [run_id]).fetchdf()
+
+
+def universe_backtest(conn, indicators, plan, stock_ids, startday=None, long=True, results=None, run_id=None,
+                      workers=UNIVERSE_WORKERS, block=UNIVERSE_BLOCK, progress=None):
+    """backtest the strategy over stock_ids, reading prices from conn.
+
+    Blocks of `block` symbols are backtested in a process pool; with results (a writable duckdb
+    connection) every block's stats are stored under run_id as it finishes, replacing an earlier
+    run of the same id, and the run is marked finished in universe_runs after the last block.
+    Returns the per-symbol stats of all blocks"""
+    fields = strategy_fields(indicators, plan)
+    stock_ids = list(stock_ids)
+    if results is not None:
+        create_universe_results(results)
+        results.execute("DELETE FROM universe_runs WHERE run_id = ?", [run_id])
+        results.execute("DELETE FROM universe_backtest WHERE run_id = ?", [run_id])
+    # numba compiles on first use: compile in the parent on two symbols, forked workers inherit it
+    # instead of each compiling the same functions again
+    if stock_ids:
+        block_backtest(read_block(conn, fields, stock_ids[:2], startday), indicators, plan, long)
+    merged = []
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for i in range(0, len(stock_ids) + block, block):
+            if i < len(stock_ids):
+                cube = read_block(conn, fields, stock_ids[i:i+block], startday)
+                if len(cube.stock_ids):
+                    in_flight.append(pool.submit(block_backtest, cube, indicators, plan, long))
+            while in_flight and (len(in_flight) >= 2 * workers or i >= len(stock_ids)):
+                stats = in_flight.popleft().result()
+                if results is not None: write_results(results, run_id, stats)
+                merged.append(stats)
+                if progress: progress(min(sum(len(s) for s in merged) / max(len(stock_ids), 1), 1.0))
+    stats = pd.concat(merged, ignore_index=True) if merged else pd.DataFrame(columns=UNIVERSE_COLUMNS)
+    if results is not None:
+        results.execute("INSERT INTO universe_runs VALUES (?, current_timestamp, ?)", [run_id, len(stats)])
+    return stats
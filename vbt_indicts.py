@@ -1,8 +1,18 @@
+import math
+
+
+# per indicator: 'inputs' are the price fields run() takes, in order, 'warmup' the params whose sum is the
+# warm-up length in bars (None: the whole history matters, e.g. cumulative OBV), 'lag' extra bars for diffs,
+# 'main' the output a bare indicator stands for in a condition
 indicts = {
     'ATR'   : {
         'sig': "run(high, low, close, window=14, ewm=True, short_name='atr')",
         'params': {'window':14, 'ewm':True, 'short_name':'atr'},
         'name':'ATR',
+        'inputs': ['high', 'low', 'close'],
+        'warmup': ['window'],
+        'lag': 1,
+        'main': 'atr',
         'methods': [
             'atr_above',
             'atr_below',
@@ -44,6 +54,10 @@ indicts = {
         'sig': "run(close, window=20, ewm=False, alpha=2, short_name='bb')",
         'params': {'window':20, 'ewm':False, 'alpha':2,'short_name':'bb'},
         'name':'BBANDS',
+        'inputs': ['close'],
+        'warmup': ['window'],
+        'lag': 0,
+        'main': 'middle',
         'methods': [
             'bandwidth_above',
             'bandwidth_below',
@@ -92,6 +106,10 @@ indicts = {
         'sig': "run(close, window, ewm=False, short_name='ma')",
         'params': {'window':10, 'ewm':False, 'short_name':'ma'},
         'name':'MA',
+        'inputs': ['close'],
+        'warmup': ['window'],
+        'lag': 0,
+        'main': 'ma',
         'methods': [
             'close_above',
             'close_below',
@@ -115,6 +133,10 @@ indicts = {
         'sig': "run(close, fast_window=12, slow_window=26, signal_window=9, macd_ewm=False, signal_ewm=False, short_name='macd')",
         'params': {'fast_window':12, 'slow_window':26, 'signal_window':9, 'macd_ewm':False, 'signal_ewm':False, 'short_name':'macd'},
         'name':'MACD',
+        'inputs': ['close'],
+        'warmup': ['slow_window', 'signal_window'],
+        'lag': 0,
+        'main': 'macd',
         'methods': [
             'close_above',
             'close_below',
@@ -154,6 +176,10 @@ indicts = {
         'sig': "run(close, window, ewm=False, short_name='mstd')",
         'params': {'window':10, 'ewm':False, 'short_name':'mstd'},
         'name':'MSTD',
+        'inputs': ['close'],
+        'warmup': ['window'],
+        'lag': 0,
+        'main': 'mstd',
         'methods': [
             'close_above',
             'close_below',
@@ -178,6 +204,10 @@ indicts = {
         'sig': "run(close, volume, short_name='obv')",
         'params': {'short_name':'obv'},
         'name':'OBV',
+        'inputs': ['close', 'volume'],
+        'warmup': None,
+        'lag': 0,
+        'main': 'obv',
         'methods': [
             'close_above',
             'close_below',
@@ -206,6 +236,10 @@ indicts = {
         'sig': "run(close, window=14, ewm=False, short_name='rsi')",
         'params': {'window':14, 'ewm':False, 'short_name':'rsi'},
         'name':'RSI',
+        'inputs': ['close'],
+        'warmup': ['window'],
+        'lag': 1,
+        'main': 'rsi',
         'methods': [
             'close_above',
             'close_below',
@@ -230,6 +264,10 @@ indicts = {
         'sig': "run(high, low, close, k_window=14, d_window=3, d_ewm=False, short_name='stoch')",
         'params': {'k_window':14, 'd_window':3, 'd_ewm':False, 'short_name':'stoch'},
         'name':'STOCH',
+        'inputs': ['high', 'low', 'close'],
+        'warmup': ['k_window', 'd_window'],
+        'lag': 0,
+        'main': 'percent_k',
         'methods': [
             'close_above',
             'close_below',
@@ -270,3 +308,54 @@ indicts = {
     }
 }
 
+
+
+# relative error left in each ewm when an indicator runs on a trailing window instead of the whole
+# history (ratios of ewms like RSI can be off by a small multiple); sma/std based ones are exact
+EWM_TOLERANCE = 1e-6
+
+
+def ewm_bars(window, tol=EWM_TOLERANCE):
+    """bars after which ewm(span=window) has forgotten its first value to within tol"""
+    decay = 1 - 2 / (window + 1)
+    return 0 if decay <= 0 else math.ceil(math.log(tol) / math.log(decay))
+
+
+def indicator_lookback(name, params, tol=EWM_TOLERANCE):
+    """bars of history an indicator needs before its first stable value, None for the whole history"""
+    spec = indicts[name]
+    if spec['warmup'] is None: return None
+    params = canonical_params(name, params)
+    ewm = any(v for p, v in params.items() if 'ewm' in p)
+    bars = spec['lag']
+    for p in spec['warmup']:
+        bars += int(params[p]) + (ewm_bars(int(params[p]), tol) if ewm else 0)
+    return bars
+
+
+def scan_requirements(indicators, last_bars=1, tol=EWM_TOLERANCE):
+    """price fields and trailing bars for the last `last_bars` values of indicators=[(name, params), ...]
+    to match a full history run; bars is None when the full history is needed"""
+    fields, bars = [], 0
+    for name, params in indicators:
+        for f in indicts[name]['inputs']:
+            if f not in fields: fields.append(f)
+        lookback = indicator_lookback(name, params, tol)
+        bars = None if bars is None or lookback is None else max(bars, lookback)
+    return fields, (None if bars is None else bars + last_bars)
+
+
+def canonical_params(name, params):
+    """params completed with the defaults and cast to the defaults' types (number inputs give floats);
+    a float that is not a whole number stays a float, so alpha=2.5 is not truncated to an int default's 2"""
+    out = dict(indicts[name]['params'])
+    for p, v in params.items():
+        default = indicts[name]['params'].get(p)
+        lossy = isinstance(default, int) and not isinstance(default, bool) and isinstance(v, float) and not v.is_integer()
+        out[p] = type(default)(v) if isinstance(default, (bool, int, float)) and not lossy else v
+    return out
+
+
+def params_key(name, params):
+    """hashable key of the params that change an indicator's values (short_name only names columns)"""
+    return tuple(sorted((p, v) for p, v in canonical_params(name, params).items() if p != 'short_name'))
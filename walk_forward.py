@@ -0,0 +1,94 @@
+"""Walk-forward optimisation: pick parameters on a rolling train window, trade them on the next test window.
+
+Indicators and entry/exit signals only look back, so they are computed once over the whole history
+for every parameter combination (param_sweep, chunked by the sweep memory budget) and every window
+slices them: overlapping train windows reuse the same indicator values instead of re-running
+vectorbt per window, and a window's first bars see indicators warmed up on the bars before it.
+The windows' portfolios then run in a process pool."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from param_sweep import SWEEP_BYTES, METRICS, chunk_size, sweep_grid, sweep_signals, simulate, portfolio_metrics
+
+
+WF_WORKERS = os.cpu_count() or 4
+
+
+def walk_forward_windows(bars, train, test, step=None):
+    """[(train start, test start, test end)] bar offsets of rolling windows over `bars` bars,
+    moved forward by step (default test, back to back test windows)"""
+    step = step or test
+    return [(s, s + train, min(s + train + test, bars)) for s in range(0, bars - train, step)]
+
+
+def grid_signals(frames, indicators, plan, grid, budget=SWEEP_BYTES):
+    """entry and exit arrays over the whole history for every combination of grid"""
+    bars = len(frames['close'])
+    entries = np.zeros((bars, len(grid)), dtype=bool)
+    exits = np.zeros((bars, len(grid)), dtype=bool)
+    size = chunk_size(bars, budget)
+    for start in range(0, len(grid), size):
+        chunk = grid.iloc[start:start + size]
+        entries[:, start:start + size], exits[:, start:start + size] = sweep_signals(frames, indicators, plan, chunk)
+    return entries, exits
+
+
+def window_task(close, entries, exits, split, metric, long=True, freq='1D'):
+    """best combination by metric on the bars before split of one window and its portfolio on the rest.
+    Returns (train metrics of the best, its combination index, test metrics, test returns); when no
+    combination traded in training the index is None, the metrics NaN and the test window stays in cash"""
+    train = portfolio_metrics(simulate(close.iloc[:split], entries[:split], exits[:split], long, freq))
+    # a combination without trades has a flat equity and an infinite sharpe / sortino, never pick it
+    score = train[metric].to_numpy(dtype=np.float64)
+    score = np.where(np.isfinite(score) & (train['trades'].to_numpy() > 0), score, -np.inf)
+    if not np.isfinite(score).any():
+        missing = pd.Series(np.nan, index=train.columns)
+        return missing, None, missing, pd.Series(0.0, index=close.index[split:])
+    best = int(np.argmax(score))
+    pf = simulate(close.iloc[split:], entries[split:, best], exits[split:, best], long, freq)
+    return train.iloc[best], best, portfolio_metrics(pf).iloc[0], pf.returns()
+
+
+def walk_forward(frames, indicators, plan, axes, train, test, step=None, metric='sharpe_ratio', long=True,
+                 freq='1D', workers=WF_WORKERS, progress=None):
+    """walk-forward over one symbol's frames=dict{field: series}.
+
+    Returns (per window stats: window dates, best params, train metric and test METRICS, with NaN params
+             and traded False for windows where no combination traded in training,
+             out-of-sample equity stitched from the test windows, starting at 1)"""
+    close = frames['close']
+    grid = sweep_grid(axes)
+    windows = walk_forward_windows(len(close), train, test, step)
+    if not windows:
+        raise ValueError(f"{len(close)} bars leave no test window after {train} train bars")
+    entries, exits = grid_signals(frames, indicators, plan, grid)
+
+    # each task gets only its window's bars
+    def task(window):
+        start, split, end = window
+        return close.iloc[start:end], entries[start:end], exits[start:end], split - start, metric, long, freq
+
+    # the first window in process also compiles numba once for the forked workers
+    results = [window_task(*task(windows[0]))]
+    if progress: progress(1 / len(windows))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(window_task, *task(w)) for w in windows[1:]]
+        for k, future in enumerate(futures):
+            results.append(future.result())
+            if progress: progress((k + 2) / len(windows))
+
+    rows = []
+    for (start, split, end), (train_stats, best, test_stats, _) in zip(windows, results):
+        row = {'train_start': close.index[start], 'test_start': close.index[split], 'test_end': close.index[end - 1]}
+        row.update({c: np.nan if best is None else grid[c].iloc[best] for c in grid})
+        row['traded'] = best is not None
+        row[f'train_{metric}'] = train_stats[metric]
+        row.update({f'test_{m}': test_stats[m] for m in METRICS})
+        rows.append(row)
+    # test windows of a step below test overlap, each bar keeps the return of its latest window
+    returns = pd.concat([r[3] for r in results])
+    returns = returns[~returns.index.duplicated(keep='last')]
+    return pd.DataFrame(rows), (1 + returns).cumprod()